@@ -8,6 +8,7 @@ from .settings import router as settings_router
 from .stats import router as stats_router
 from .manage_admins import router as manage_admins_router
 from .users import router as users_router
+from .leaderboard import router as leaderboard_router
 
 router = Router()
 router.include_routers(
@@ -19,4 +20,5 @@ router.include_routers(
     stats_router,
     manage_admins_router,
     users_router,
+    leaderboard_router,
 )
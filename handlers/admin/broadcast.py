@@ -4,6 +4,7 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
+from middlewares.request_limiter import BROADCAST, request_priority
 from utils.filters import AdminFilter
 from utils.keyboards import get_broadcast_confirmation_keyboard
 from utils.states import BroadcastStates
@@ -57,7 +58,9 @@ async def process_broadcast_confirmation(call: CallbackQuery, state: FSMContext)
     successful, failed = 0, 0
     for user in users:
         try:
-            await call.bot.copy_message(chat_id=user['user_id'], from_chat_id=chat_id, message_id=message_id)
+            # Рассылка уступает очередь диалогам и уведомлениям (см. middlewares/request_limiter.py).
+            with request_priority(BROADCAST):
+                await call.bot.copy_message(chat_id=user['user_id'], from_chat_id=chat_id, message_id=message_id)
             successful += 1
         except Exception as e:
             failed += 1
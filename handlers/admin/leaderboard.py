@@ -0,0 +1,37 @@
+# handlers/admin/leaderboard.py
+
+from aiogram import Router
+from aiogram.types import CallbackQuery
+
+from utils import leaderboard, texts
+from utils.callbacks import LeaderboardPage
+from utils.filters import AdminFilter
+from utils.keyboards import get_leaderboard_pagination_keyboard
+from utils.logging_config import logger
+from utils.database.db_helpers import acquire
+from utils.database.db_queries import count_leaderboard_ranks, get_leaderboard_ranks_page
+
+router = Router()
+router.callback_query.filter(AdminFilter())
+
+_PER_PAGE = 20
+
+
+@router.callback_query(LeaderboardPage.filter())
+async def admin_leaderboard_handler(callback: CallbackQuery, callback_data: LeaderboardPage):
+    """Полный рейтинг месяца постранично — из таблицы мест (пересчитывается задачей leaderboard_ranks)."""
+    page = callback_data.page
+    period = leaderboard.current_period()
+    try:
+        async with acquire() as conn:
+            total = await count_leaderboard_ranks(conn, period)
+            rows = await get_leaderboard_ranks_page(conn, period, limit=_PER_PAGE, offset=page * _PER_PAGE)
+    except Exception as e:
+        logger.error(f"DB error in admin_leaderboard_handler: {e}", exc_info=True)
+        await callback.answer("Ошибка при загрузке рейтинга.", show_alert=True)
+        return
+
+    text = texts.get_admin_leaderboard_text(period, rows, page, total, _PER_PAGE)
+    keyboard = get_leaderboard_pagination_keyboard(page, total, _PER_PAGE)
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
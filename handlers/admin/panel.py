@@ -58,4 +58,17 @@ async def start_promo_creation_handler(call: CallbackQuery, state: FSMContext):
         "Тип скидки выберете на следующем шаге.",
         parse_mode="HTML"
     )
-    await call.answer()
\ No newline at end of file
+    await call.answer()
+
+
+@router.callback_query(F.data == "admin_bulk_promo")
+async def start_bulk_promo_handler(call: CallbackQuery, state: FSMContext):
+    """Начинает генерацию пачки одноразовых промокодов."""
+    await state.set_state(AdminPromoStates.waiting_for_bulk_data)
+    await call.message.edit_text(
+        "Введите данные в формате: <b>ПРЕФИКС,КОЛИЧЕСТВО,СКИДКА</b>\n"
+        "Например: <code>BLOGGER,10000,10</code>\n\n"
+        "Каждый код будет одноразовым. Тип скидки выберете на следующем шаге.",
+        parse_mode="HTML"
+    )
+    await call.answer()
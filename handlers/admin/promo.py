@@ -1,20 +1,51 @@
 # handlers/admin/promo.py
 
+import asyncio
+import csv
+import io
+import re
+import secrets
+
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import BufferedInputFile, Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
+from config import PROMO_BULK_MAX_COUNT
+
 from utils.filters import AdminFilter
 from utils.states import AdminPromoStates
 from utils.keyboards import get_promo_type_keyboard, back_to_admin_panel
 from utils.database.db_helpers import transaction
-from utils.database.db_queries import add_promo_code
+from utils.database.db_queries import add_promo_code, bulk_insert_promo_codes
 from utils.logging_config import logger
+from utils import promo_cache
 
 router = Router()
 router.message.filter(AdminFilter())
 router.callback_query.filter(AdminFilter())
 
+# Без похожих символов (0/O, 1/I/L), чтобы коды было удобно вводить вручную.
+_CODE_ALPHABET = "23456789ABCDEFGHJKMNPQRSTUVWXYZ"
+_CODE_RANDOM_LENGTH = 8
+_PREFIX_RE = re.compile(r"^[A-Z0-9_-]{1,20}$")
+# Сколько раз догенерировать коды взамен совпавших с уже существующими.
+_BULK_MAX_ROUNDS = 5
+
+
+def _generate_codes(prefix: str, count: int) -> list[str]:
+    return [
+        prefix + "".join(secrets.choice(_CODE_ALPHABET) for _ in range(_CODE_RANDOM_LENGTH))
+        for _ in range(count)
+    ]
+
+
+def _codes_to_csv(codes: list[str], discount_amount: float, discount_type: str) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["code", "discount", "discount_type"])
+    writer.writerows((code, f"{discount_amount:g}", discount_type) for code in codes)
+    return buffer.getvalue().encode("utf-8")
+
 
 @router.message(AdminPromoStates.waiting_for_promo_data)
 async def process_promo_data(message: Message, state: FSMContext):
@@ -73,6 +104,7 @@ async def process_promo_type(call: CallbackQuery, state: FSMContext):
         return
 
     if success:
+        promo_cache.add(code, discount_amount, discount_type)
         type_label = f"{discount_amount:g}%" if discount_type == "percent" else f"{discount_amount:g} RUB"
         await call.message.edit_text(
             f"✅ Промокод <code>{code}</code> создан.\n"
@@ -89,3 +121,86 @@ async def process_promo_type(call: CallbackQuery, state: FSMContext):
 
     await state.clear()
     await call.answer()
+
+
+# --- Пачка одноразовых промокодов ---
+
+@router.message(AdminPromoStates.waiting_for_bulk_data)
+async def process_bulk_promo_data(message: Message, state: FSMContext):
+    """Принимает PREFIX,COUNT,AMOUNT и предлагает выбрать тип скидки."""
+    parts = [p.strip() for p in (message.text or "").split(',')]
+    if len(parts) != 3:
+        await message.answer(
+            "❌ Неверный формат. Введите:\n"
+            "<b>ПРЕФИКС,КОЛИЧЕСТВО,СКИДКА</b>\n"
+            "Например: <code>BLOGGER,10000,10</code>",
+            parse_mode="HTML",
+        )
+        return
+
+    prefix, count_str, discount_str = parts
+    prefix = prefix.upper()
+    try:
+        count = int(count_str)
+        discount_amount = float(discount_str.replace(',', '.'))
+        if not _PREFIX_RE.match(prefix) or not 0 < count <= PROMO_BULK_MAX_COUNT or discount_amount <= 0:
+            raise ValueError
+    except ValueError:
+        await message.answer(
+            "❌ Префикс — до 20 латинских букв, цифр, «-» или «_»; "
+            f"количество — от 1 до {PROMO_BULK_MAX_COUNT}; скидка — положительное число."
+        )
+        return
+
+    await state.update_data(prefix=prefix, count=count, discount_amount=discount_amount)
+    await state.set_state(AdminPromoStates.waiting_for_bulk_discount_type)
+    await message.answer(
+        f"Префикс: <code>{prefix}</code>\n"
+        f"Количество кодов: <b>{count}</b> (каждый одноразовый)\n"
+        f"Скидка: <b>{discount_amount:g}</b>\n\n"
+        "Выберите тип скидки:",
+        reply_markup=get_promo_type_keyboard(),
+        parse_mode="HTML",
+    )
+
+
+@router.callback_query(AdminPromoStates.waiting_for_bulk_discount_type, F.data.in_({"promo_type_percent", "promo_type_fixed"}))
+async def process_bulk_promo_type(call: CallbackQuery, state: FSMContext):
+    """Генерирует коды, загружает их в БД через COPY и отправляет CSV-файлом."""
+    discount_type = "percent" if call.data == "promo_type_percent" else "fixed"
+    data = await state.get_data()
+    prefix, count, discount_amount = data["prefix"], data["count"], data["discount_amount"]
+    await state.clear()
+    await call.answer()
+    await call.message.edit_text(f"⏳ Генерирую {count} промокодов...")
+
+    created: list[str] = []
+    try:
+        async with transaction() as conn:
+            for _ in range(_BULK_MAX_ROUNDS):
+                missing = count - len(created)
+                if missing <= 0:
+                    break
+                # Генерация 100k кодов занимает около секунды — не блокируем event loop.
+                codes = await asyncio.to_thread(_generate_codes, prefix, missing)
+                created += await bulk_insert_promo_codes(conn, codes, 1, discount_amount, discount_type)
+    except Exception as e:
+        logger.error(f"DB error while generating promo codes with prefix '{prefix}': {e}", exc_info=True)
+        await call.message.edit_text("Произошла ошибка базы данных.", reply_markup=back_to_admin_panel())
+        return
+
+    for code in created:
+        promo_cache.add(code, discount_amount, discount_type)
+    logger.info(f"Admin {call.from_user.id} generated {len(created)} promo codes with prefix '{prefix}'")
+
+    type_label = f"{discount_amount:g}%" if discount_type == "percent" else f"{discount_amount:g} RUB"
+    shortfall = f"\n⚠️ Создано меньше запрошенного ({count})." if len(created) < count else ""
+    await call.message.answer_document(
+        BufferedInputFile(
+            _codes_to_csv(created, discount_amount, discount_type),
+            filename=f"promo_{prefix.lower()}_{len(created)}.csv",
+        ),
+        caption=f"✅ Создано промокодов: <b>{len(created)}</b>, скидка: <b>{type_label}</b>.{shortfall}",
+        parse_mode="HTML",
+    )
+    await call.message.edit_text("Готово.", reply_markup=back_to_admin_panel())
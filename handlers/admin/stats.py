@@ -1,9 +1,12 @@
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 
+from middlewares.request_limiter import limiter as request_limiter
 from utils import keyboards, texts
 from utils.filters import AdminFilter
 from utils.logging_config import logger
+from utils.database import statements
+from utils.database.connection import get_pool_stats, get_replica_pool_stats
 from utils.database.db_helpers import acquire
 from utils.database.db_queries import get_admin_statistics
 
@@ -23,6 +26,12 @@ async def admin_stats_handler(callback: CallbackQuery):
         return
 
     text = texts.get_statistics_text(stats_data)
+    if pool_stats := get_pool_stats():
+        text += texts.get_pool_stats_text(pool_stats)
+    if replica_stats := get_replica_pool_stats():
+        text += texts.get_pool_stats_text(replica_stats, title="🗄 Пул реплики (чтение)")
+    text += texts.get_statements_stats_text(statements.stats())
+    text += texts.get_telegram_limiter_stats_text(request_limiter.stats())
     keyboard = keyboards.back_to_admin_panel()
     await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
     await callback.answer()
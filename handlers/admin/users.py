@@ -2,14 +2,16 @@ from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 
-from config import ORDER_NUMBER_OFFSET
-from utils.callbacks import UserBlockAction
+from config import ORDER_NUMBER_OFFSET, REFERRAL_TREE_MAX_DEPTH
+from utils.callbacks import UserBlockAction, UserNetworkView
 from utils.filters import AdminFilter
 from utils.keyboards import back_to_admin_panel, get_user_info_keyboard
 from utils.logging_config import logger
 from utils.states import UserManageStates
-from utils.database.db_helpers import acquire, transaction
-from utils.database.db_queries import block_user, get_admin_user_profile, unblock_user
+from utils.database.db_helpers import UnitOfWork, acquire
+from utils.database.db_queries import (
+    block_user, get_admin_user_profile, get_referral_subtree_stats, unblock_user,
+)
 
 router = Router()
 router.message.filter(AdminFilter())
@@ -53,7 +55,7 @@ def _format_profile(data: dict) -> str:
         num = r['order_id'] + ORDER_NUMBER_OFFSET
         icon = _STATUS_ICONS.get(r['status'], '•')
         recent_lines.append(
-            f"  {icon} #{num} {r['action'].upper()} {r['crypto']} — {float(r['amount_rub']):,.0f} ₽"
+            f"  {icon} #{num} {r['action'].upper()} {r['crypto']} — {r['amount_rub']:,.0f} ₽"
         )
     recent_str = "\n".join(recent_lines) if recent_lines else "  нет заявок"
 
@@ -61,9 +63,11 @@ def _format_profile(data: dict) -> str:
     earnings_lines = []
     for e in data['earnings_history']:
         dt = e['created_at'].strftime("%d.%m.%Y") if e['created_at'] else "—"
-        earnings_lines.append(f"  +{float(e['amount']):,.2f} RUB  ({dt}, от <code>{e['referral_id']}</code>)")
+        earnings_lines.append(f"  +{e['amount']:,.2f} RUB  ({dt}, от <code>{e['referral_id']}</code>)")
     earnings_str = "\n".join(earnings_lines) if earnings_lines else "  нет начислений"
 
+    last_earning = data['last_earning_at'].strftime("%d.%m.%Y") if data['last_earning_at'] else "—"
+
     # Promo and lottery
     promo = u['activated_promo'] or "—"
     lottery = u['last_lottery_play'].strftime("%d.%m.%Y %H:%M") if u['last_lottery_play'] else "—"
@@ -74,14 +78,15 @@ def _format_profile(data: dict) -> str:
         f"📅 Зарегистрирован: {reg_date}\n"
         f"🚦 Статус: {status}\n"
         f"\n<b>── Финансы ──</b>\n"
-        f"💰 Реф. баланс: <b>{float(u['referral_balance']):,.2f} RUB</b>\n"
-        f"📈 Всего заработано: {float(data['total_earned']):,.2f} RUB\n"
-        f"💸 Выведено: {float(w['total_withdrawn']):,.2f} RUB"
-        f"  |  Ожидает: {float(w['pending']):,.2f} RUB\n"
+        f"💰 Реф. баланс: <b>{u['referral_balance']:,.2f} RUB</b>\n"
+        f"📈 Всего заработано: {data['total_earned']:,.2f} RUB"
+        f"  (последнее начисление: {last_earning})\n"
+        f"💸 Выведено: {w['total_withdrawn']:,.2f} RUB"
+        f"  |  Ожидает: {w['pending']:,.2f} RUB\n"
         f"\n<b>── Сделки ──</b>\n"
         f"📦 Всего заявок: <b>{o['total']}</b>"
         f"  (✅ {o['completed']} / ❌ {o['cancelled']} / ⏳ {o['processing']})\n"
-        f"💵 Объём: {float(o['total_volume']):,.2f} RUB\n"
+        f"💵 Объём: {o['total_volume']:,.2f} RUB\n"
         f"🕐 Последние:\n{recent_str}\n"
         f"\n<b>── Рефералы ──</b>\n"
         f"👥 Приглашено: {data['referral_count']}\n"
@@ -94,6 +99,26 @@ def _format_profile(data: dict) -> str:
     )
 
 
+def _format_network(user_id: int, levels: list) -> str:
+    lines = [f"🌳 <b>Сеть рефералов</b> <code>{user_id}</code> (до {REFERRAL_TREE_MAX_DEPTH} уровней)\n"]
+    if not levels:
+        lines.append("У пользователя нет рефералов.")
+        return "\n".join(lines)
+
+    for lvl in levels:
+        lines.append(
+            f"<b>{lvl['depth']} ур.</b>: 👥 {lvl['users']}  |  📦 {lvl['orders']}  |  "
+            f"💵 {lvl['volume']:,.2f} RUB  |  💼 {lvl['commission']:,.2f} RUB"
+        )
+    lines.append(
+        f"\n<b>Итого:</b> 👥 {sum(l['users'] for l in levels)} рефералов, "
+        f"📦 {sum(l['orders'] for l in levels)} сделок\n"
+        f"💵 Оборот: <b>{sum(l['volume'] for l in levels):,.2f} RUB</b>\n"
+        f"💼 Комиссия: <b>{sum(l['commission'] for l in levels):,.2f} RUB</b>"
+    )
+    return "\n".join(lines)
+
+
 @router.callback_query(F.data == "admin_manage_users")
 async def admin_manage_users_handler(callback: CallbackQuery, state: FSMContext) -> None:
     await state.set_state(UserManageStates.waiting_for_user_id)
@@ -133,11 +158,12 @@ async def user_id_input_handler(message: Message, state: FSMContext) -> None:
 
 
 @router.callback_query(UserBlockAction.filter())
-async def user_block_action_handler(callback: CallbackQuery, callback_data: UserBlockAction) -> None:
+async def user_block_action_handler(callback: CallbackQuery, callback_data: UserBlockAction,
+                                    uow: UnitOfWork) -> None:
     uid = callback_data.user_id
     action = callback_data.action
 
-    async with transaction() as conn:
+    async with uow.transaction() as conn:
         if action == "block":
             await block_user(conn, uid)
             verb = "заблокирован"
@@ -147,8 +173,9 @@ async def user_block_action_handler(callback: CallbackQuery, callback_data: User
 
     logger.info(f"Admin {callback.from_user.id} {verb} user {uid}")
 
-    async with acquire() as conn:
+    async with uow.acquire() as conn:
         data = await get_admin_user_profile(conn, uid)
+    await uow.release()
 
     if data:
         await callback.message.edit_text(
@@ -157,3 +184,20 @@ async def user_block_action_handler(callback: CallbackQuery, callback_data: User
             parse_mode="HTML",
         )
     await callback.answer(f"Пользователь {verb}.")
+
+
+@router.callback_query(UserNetworkView.filter())
+async def user_network_handler(callback: CallbackQuery, callback_data: UserNetworkView) -> None:
+    uid = callback_data.user_id
+    try:
+        async with acquire() as conn:
+            levels = await get_referral_subtree_stats(conn, uid)
+    except Exception as e:
+        logger.error(f"DB error in user_network_handler for user {uid}: {e}", exc_info=True)
+        await callback.answer("Ошибка базы данных.", show_alert=True)
+        return
+
+    await callback.message.answer(
+        _format_network(uid, levels), reply_markup=back_to_admin_panel(), parse_mode="HTML"
+    )
+    await callback.answer()
@@ -3,77 +3,144 @@
 """
 Обработчики для модуля ежедневной лотереи.
 """
-import asyncio
 from datetime import datetime, timedelta
 
-from aiogram import Router, F
+from aiogram import Bot, Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.exceptions import AiogramError
 
-from config import LOTTERY_PRIZES
+from config import LOTTERY_REVEAL_DELAY_SECONDS
+from utils import jobs
 from utils.logging_config import logger
-from utils.database.db_helpers import transaction
-from utils.database.db_queries import get_user_lottery_info, grant_daily_ticket, play_lottery
-from utils.helpers import calculate_lottery_win
+from utils.database.db_helpers import acquire, transaction
+from utils.database.db_queries import (
+    get_user_lottery_info, is_lottery_play_revealed, mark_lottery_play_revealed, play_lottery,
+)
+from utils import prize_sampler
 import utils.texts as texts
 import utils.keyboards as keyboards
 
 router = Router()
 
 
-async def _render_lottery_menu(message, user_id: int) -> None:
-    """Обновляет сообщение с меню лотереи. Не трогает callback."""
-    now = datetime.now()
+async def _render_lottery_menu(bot: Bot, chat_id: int, message_id: int, user_id: int,
+                               lottery_info: dict | None = None) -> None:
+    """Обновляет сообщение с меню лотереи. Не трогает callback, поэтому вызывается и из задач.
+
+    Билет не выдаётся записью в БД: он доступен, если с последней игры прошло 24 часа,
+    так что показ меню — одно чтение без транзакции. lottery_info можно передать готовым,
+    тогда меню строится вовсе без запроса.
+    """
     logger.info("[LOTTERY] _render_lottery_menu: user_id=%s", user_id)
 
-    async with transaction() as conn:
-        logger.debug("[LOTTERY] fetching lottery_info from DB")
-        lottery_info = await get_user_lottery_info(conn, user_id)
-        logger.debug("[LOTTERY] lottery_info=%s", lottery_info)
-
-        last_ticket_time = lottery_info.get('last_ticket')
-        logger.debug("[LOTTERY] last_ticket_time=%s", last_ticket_time)
-
-        can_get_new_ticket = False
-        if not last_ticket_time or (now - last_ticket_time.replace(tzinfo=None)) > timedelta(hours=24):
-            logger.debug("[LOTTERY] granting daily ticket")
-            await grant_daily_ticket(conn, user_id)
-            can_get_new_ticket = True
-            lottery_info['last_ticket'] = now
-            logger.debug("[LOTTERY] ticket granted")
-        else:
-            logger.debug("[LOTTERY] ticket already granted within 24h")
+    if lottery_info is None:
+        async with acquire() as conn:
+            lottery_info = await get_user_lottery_info(conn, user_id)
+    logger.debug("[LOTTERY] lottery_info=%s", lottery_info)
 
     last_play_time = lottery_info.get('last_play')
-    logger.debug("[LOTTERY] last_play_time=%s", last_play_time)
-
-    can_play = not last_play_time or (now - last_play_time.replace(tzinfo=None)) > timedelta(hours=24)
-    logger.debug("[LOTTERY] can_get_new_ticket=%s  can_play=%s", can_get_new_ticket, can_play)
+    can_play = not last_play_time or (datetime.now() - last_play_time.replace(tzinfo=None)) > timedelta(hours=24)
+    logger.debug("[LOTTERY] can_play=%s", can_play)
 
-    text = texts.get_lottery_menu_text(lottery_info, can_get_new_ticket)
-    keyboard = keyboards.get_lottery_menu_keyboard(can_get_new_ticket and can_play)
+    text = texts.get_lottery_menu_text(lottery_info, can_play)
+    keyboard = keyboards.get_lottery_menu_keyboard(can_play)
     logger.debug("[LOTTERY] text and keyboard built, editing message")
 
     try:
-        await message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        await bot.edit_message_text(
+            text, chat_id=chat_id, message_id=message_id, reply_markup=keyboard, parse_mode="HTML",
+        )
         logger.debug("[LOTTERY] message edited successfully")
     except AiogramError as e:
         logger.warning(f"[LOTTERY] edit_text failed, sending new message: {e}")
         try:
-            await message.delete()
+            await bot.delete_message(chat_id=chat_id, message_id=message_id)
         except AiogramError:
             pass
-        await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+        await bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode="HTML")
+
+
+# --- Анимация розыгрыша ---
+# Игра фиксируется в БД сразу, а анимация и показ результата идут задачами очереди:
+# обработчик нажатия не ждёт ~4 секунды, пока крутится 🎰.
+# dedup_key не даёт поставить вторую такую же задачу, пока первая в очереди, а отметка
+# lottery_plays.revealed_at — повторить показ, когда задача уже выполнена. Результат
+# может прийти дважды, только если процесс упадёт между отправкой текста и отметкой.
+
+def _dedup_key(kind: str, payload: dict) -> str:
+    return f"{kind}:{payload['play_id']}"
+
+
+async def _is_revealed(payload: dict) -> bool:
+    # Через основную базу: реплика может ещё не видеть свежую отметку.
+    async with transaction() as conn:
+        return await is_lottery_play_revealed(conn, payload['play_id'])
+
+
+@jobs.job("lottery_dice")
+async def _send_lottery_dice(bot: Bot, payload: dict) -> None:
+    """Отправляет 🎰 и ставит показ выигрыша на момент, когда анимация закончится."""
+    if await _is_revealed(payload):
+        logger.info("[LOTTERY] play #%s already revealed, skipping dice", payload['play_id'])
+        return
+    dice_message_id = None
+    try:
+        dice_msg = await bot.send_dice(chat_id=payload['chat_id'], emoji="🎰")
+        dice_message_id = dice_msg.message_id
+        logger.debug("[LOTTERY] dice sent")
+    except AiogramError as e:
+        logger.warning("[LOTTERY] dice animation error (non-critical): %s", e)
+
+    async with transaction() as conn:
+        await jobs.enqueue(
+            conn, "lottery_reveal", {**payload, 'dice_message_id': dice_message_id},
+            delay_seconds=LOTTERY_REVEAL_DELAY_SECONDS if dice_message_id else 0,
+            dedup_key=_dedup_key("lottery_reveal", payload),
+        )
+
+
+@jobs.job("lottery_reveal")
+async def _reveal_lottery_win(bot: Bot, payload: dict) -> None:
+    """Убирает 🎰, сообщает выигрыш и обновляет меню лотереи."""
+    if await _is_revealed(payload):
+        logger.info("[LOTTERY] play #%s already revealed, skipping", payload['play_id'])
+        return
+    chat_id = payload['chat_id']
+    if payload.get('dice_message_id'):
+        try:
+            await bot.delete_message(chat_id=chat_id, message_id=payload['dice_message_id'])
+            logger.debug("[LOTTERY] dice deleted")
+        except AiogramError as e:
+            logger.warning("[LOTTERY] dice delete error (non-critical): %s", e)
+
+    win_text = texts.get_lottery_win_text(payload['prize_amount'])
+    await bot.send_message(chat_id, win_text, parse_mode="HTML")
+    logger.debug("[LOTTERY] win text sent")
+    async with transaction() as conn:
+        await mark_lottery_play_revealed(conn, payload['play_id'])
+
+    # Результат уже показан: ошибка меню не должна перезапускать задачу.
+    try:
+        # Состояние известно из самой игры — не читаем его с реплики, которая может отставать.
+        played_at = datetime.fromisoformat(payload['played_at'])
+        await _render_lottery_menu(
+            bot, chat_id, payload['menu_message_id'], payload['user_id'],
+            lottery_info={'last_play': played_at, 'last_ticket': played_at},
+        )
+    except Exception as e:
+        logger.warning("[LOTTERY] could not refresh lottery menu after reveal: %s", e)
 
 
 @router.callback_query(F.data == "lottery_menu")
 async def lottery_menu_handler(callback: CallbackQuery):
-    """Показывает меню лотереи, проверяет и выдает ежедневный билет."""
+    """Показывает меню лотереи и доступность ежедневного билета."""
     user_id = callback.from_user.id
     logger.info("[LOTTERY] lottery_menu_handler triggered: user_id=%s", user_id)
 
     try:
-        await _render_lottery_menu(callback.message, user_id)
+        await _render_lottery_menu(
+            callback.bot, callback.message.chat.id, callback.message.message_id, user_id,
+        )
         logger.debug("[LOTTERY] lottery_menu_handler: answering callback")
         await callback.answer()
         logger.debug("[LOTTERY] lottery_menu_handler: done")
@@ -89,54 +156,39 @@ async def lottery_menu_handler(callback: CallbackQuery):
 async def lottery_play_handler(callback: CallbackQuery):
     """Обрабатывает нажатие на кнопку 'Испытать удачу!'."""
     user_id = callback.from_user.id
-    now = datetime.now()
     logger.info("[LOTTERY] lottery_play_handler triggered: user_id=%s", user_id)
 
     try:
+        # Право на игру проверяется в том же запросе, что и списание билета,
+        # поэтому повторное нажатие не сыграет второй раз.
+        prize_amount = prize_sampler.draw()
         async with transaction() as conn:
-            logger.debug("[LOTTERY] fetching lottery_info for play check")
-            lottery_info = await get_user_lottery_info(conn, user_id)
-            last_ticket_time = lottery_info.get('last_ticket')
-            last_play_time = lottery_info.get('last_play')
-            logger.debug("[LOTTERY] last_ticket=%s  last_play=%s", last_ticket_time, last_play_time)
-
-            can_get_ticket = last_ticket_time and (now - last_ticket_time.replace(tzinfo=None)) < timedelta(hours=24)
-            can_play = not last_play_time or (now - last_play_time.replace(tzinfo=None)) > timedelta(hours=24)
-            logger.debug("[LOTTERY] can_get_ticket=%s  can_play=%s", can_get_ticket, can_play)
-
-            if not (can_get_ticket and can_play):
-                logger.debug("[LOTTERY] play not allowed, answering with alert")
-                await callback.answer(
-                    "Вы уже играли сегодня или у вас нет билета. Попробуйте завтра.",
-                    show_alert=True,
-                )
-                return
-
-            prize_amount = calculate_lottery_win(LOTTERY_PRIZES)
-            logger.debug("[LOTTERY] prize_amount=%s, saving play to DB", prize_amount)
-            await play_lottery(conn, user_id, prize_amount)
-            logger.debug("[LOTTERY] play saved to DB")
-
-        # Отвечаем на callback ДО анимации и ДО render_lottery_menu
-        logger.debug("[LOTTERY] answering callback before animation")
-        await callback.answer()
-
-        try:
-            dice_msg = await callback.bot.send_dice(chat_id=user_id, emoji="🎰")
-            logger.debug("[LOTTERY] dice sent")
-            await asyncio.sleep(3.5)
-            await dice_msg.delete()
-            logger.debug("[LOTTERY] dice deleted")
-        except AiogramError as e:
-            logger.warning("[LOTTERY] dice animation error (non-critical): %s", e)
+            played = await play_lottery(conn, user_id, prize_amount)
+            if played:
+                play_id, played_at = played
+                # Анимация и результат — в той же транзакции, что и игра:
+                # либо сыграно и результат будет показан, либо ничего не произошло.
+                payload = {
+                    'play_id': play_id,
+                    'user_id': user_id,
+                    'chat_id': callback.message.chat.id,
+                    'menu_message_id': callback.message.message_id,
+                    'prize_amount': prize_amount,
+                    'played_at': played_at.isoformat(),
+                }
+                await jobs.enqueue(conn, "lottery_dice", payload,
+                                   dedup_key=_dedup_key("lottery_dice", payload))
+
+        if not played:
+            logger.debug("[LOTTERY] play not allowed, answering with alert")
+            await callback.answer(
+                "Вы уже играли сегодня или у вас нет билета. Попробуйте завтра.",
+                show_alert=True,
+            )
+            return
+        logger.debug("[LOTTERY] play saved to DB, prize_amount=%s", prize_amount)
 
-        win_text = texts.get_lottery_win_text(prize_amount)
-        await callback.message.answer(win_text, parse_mode="HTML")
-        logger.debug("[LOTTERY] win text sent")
-
-        # Обновляем меню лотереи — НЕ передаём callback (он уже закрыт)
-        logger.debug("[LOTTERY] rendering updated lottery menu")
-        await _render_lottery_menu(callback.message, user_id)
+        await callback.answer()
         logger.debug("[LOTTERY] lottery_play_handler: done")
 
     except Exception as e:
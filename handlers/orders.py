@@ -45,7 +45,7 @@ def _format_orders_text(orders: list, page: int, total: int) -> str:
         created = order['created_at'].strftime('%d.%m.%Y %H:%M') if order['created_at'] else '—'
         lines.append(
             f"<b>#{order_number}</b> | {action} {order['crypto']}\n"
-            f"  Сумма: <b>{float(order['amount_rub']):,.0f} RUB</b>\n"
+            f"  Сумма: <b>{order['amount_rub']:,.0f} RUB</b>\n"
             f"  Статус: {status}\n"
             f"  Дата: {created}\n"
         )
@@ -8,9 +8,10 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 
+from utils import promo_cache
 from utils.logging_config import logger
 from utils.database.db_helpers import transaction
-from utils.database.db_queries import activate_promo_for_user, get_promo_discount_info
+from utils.database.db_queries import activate_promo_for_user
 from utils.states import PromoStates
 
 router = Router()
@@ -30,20 +31,37 @@ async def promo_entry_handler(event: Message | CallbackQuery, state: FSMContext)
 
 @router.message(PromoStates.waiting_for_promo_code)
 async def process_promo_code(message: Message, state: FSMContext):
-    code = message.text.strip()
-    try:
-        async with transaction() as conn:
-            result = await activate_promo_for_user(conn, message.from_user.id, code)
-            if result == "success":
-                discount_amount, discount_type = await get_promo_discount_info(conn, code)
-            else:
-                discount_amount, discount_type = 0.0, 'percent'
-    except Exception as e:
-        logger.error(f"DB error during promo activation for user {message.from_user.id}: {e}", exc_info=True)
-        await message.answer("Произошла ошибка базы данных. Попробуйте позже.")
+    user_id = message.from_user.id
+    code = (message.text or "").strip().upper()
+    if promo_cache.is_rate_limited(user_id):
+        await message.answer("⏳ Слишком много неверных попыток. Попробуйте ввести промокод позже.")
         await state.clear()
         return
 
+    if not code or promo_cache.is_known_invalid(code):
+        result, discount_amount, discount_type, uses_left = "invalid_or_expired", 0.0, 'percent', None
+    else:
+        try:
+            async with transaction() as conn:
+                result, discount_amount, discount_type, uses_left = await activate_promo_for_user(
+                    conn, user_id, code
+                )
+        except Exception as e:
+            logger.error(f"DB error during promo activation for user {user_id}: {e}", exc_info=True)
+            await message.answer("Произошла ошибка базы данных. Попробуйте позже.")
+            await state.clear()
+            return
+
+    if result == "invalid_or_expired":
+        # Такого кода нет — это попытка подбора.
+        if code:
+            promo_cache.forget(code)
+        promo_cache.register_invalid_attempt(user_id)
+    elif result == "exhausted" or (result == "success" and uses_left == 0):
+        # Код существует, но выключен или его использования закончились: убираем из индекса,
+        # попыткой подбора это не считаем.
+        promo_cache.discard(code)
+
     if result == "success":
         type_label = "%" if discount_type == 'percent' else "RUB"
         await message.answer(
@@ -52,13 +70,15 @@ async def process_promo_code(message: Message, state: FSMContext):
             parse_mode="HTML",
         )
     elif result == "invalid_or_expired":
-        await message.answer(
-            "❌ Такого промокода не существует, он неактивен, или у него закончились использования."
-        )
+        await message.answer("❌ Такого промокода не существует.")
+    elif result == "exhausted":
+        await message.answer("❌ Этот промокод неактивен, или у него закончились использования.")
     elif result == "already_active":
         await message.answer("⚠️ У вас уже есть другой активный промокод. Сначала используйте его.")
     elif result == "already_redeemed":
         await message.answer("⚠️ Вы уже использовали этот промокод ранее.")
+    elif result == "unknown_user":
+        await message.answer("Сначала запустите бота командой /start.")
     else:
         await message.answer("Произошла системная ошибка, попробуйте позже.")
 
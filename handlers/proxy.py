@@ -3,25 +3,60 @@
 Проксирование сообщений между пользователем (ЛС) и операторами (тема группы).
 """
 
+from functools import partial
+from typing import Optional
+
 from aiogram import F, Bot, Router
 from aiogram.exceptions import AiogramError
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 
-from config import SUPPORT_GROUP_ID
-from utils import keyboards
+from config import MEDIA_GROUP_WINDOW_SECONDS, SUPPORT_GROUP_ID
+from utils import keyboards, operator_responses, order_routes
 from utils.logging_config import logger
+from utils.media_groups import MediaGroupCollector
+from utils.send_scheduler import scheduler as send_scheduler
 from utils.states import TransactionStates
-from utils.database.db_helpers import acquire, transaction
-from utils.database.db_queries import (
-    get_active_order_for_user, get_order_by_topic_id, mark_order_operator_responded,
-)
+from utils.database.db_helpers import acquire
+from utils.database.db_queries import get_active_order_for_user, get_order_by_topic_id
 
 # Два роутера: для ЛС и для группы поддержки
 private_router = Router()
 group_router = Router()
 group_router.message.filter(F.chat.id == SUPPORT_GROUP_ID)
 
+OPERATOR_REPLY_HEADER = "💬 <b>Ответ от оператора:</b>\n\n"
+
+# Альбомы (чеки из нескольких фото) копятся и пересылаются одним запросом.
+# Полосы: ("to_topic", user_id) — от пользователя в тему, ("to_user", user_id) — обратно.
+_albums = MediaGroupCollector(MEDIA_GROUP_WINDOW_SECONDS)
+
+
+async def _route_for_user(user_id: int) -> Optional[tuple[int, int]]:
+    """(order_id, topic_id) активной заявки пользователя: из таблицы маршрутов, при промахе — из БД."""
+    route = order_routes.topic_for_user(user_id)
+    if route is not None:
+        return route
+    async with acquire() as conn:
+        active_order = await get_active_order_for_user(conn, user_id)
+    if not active_order or not active_order.get('topic_id'):
+        return None
+    order_routes.add(active_order['order_id'], user_id, active_order['topic_id'])
+    return active_order['order_id'], active_order['topic_id']
+
+
+async def _route_for_topic(topic_id: int) -> Optional[tuple[int, int]]:
+    """(order_id, user_id) заявки, которой принадлежит тема: из таблицы маршрутов, при промахе — из БД."""
+    route = order_routes.order_for_topic(topic_id)
+    if route is not None:
+        return route
+    async with acquire() as conn:
+        order_info = await get_order_by_topic_id(conn, topic_id)
+    if not order_info or not order_info.get('user_id'):
+        return None
+    order_routes.remember_topic(topic_id, order_info['order_id'], order_info['user_id'])
+    return order_info['order_id'], order_info['user_id']
+
 
 # =============================================================================
 # --- Пользователь → тема ---
@@ -31,14 +66,13 @@ group_router.message.filter(F.chat.id == SUPPORT_GROUP_ID)
 async def initiate_operator_reply_handler(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     try:
-        async with acquire() as conn:
-            active_order = await get_active_order_for_user(conn, user_id)
+        route = await _route_for_user(user_id)
     except Exception as e:
         logger.error(f"DB error in initiate_operator_reply for user {user_id}: {e}", exc_info=True)
         await callback.answer("Ошибка базы данных.", show_alert=True)
         return
 
-    if not active_order:
+    if not route:
         await callback.answer("⚠️ У вас нет активных заявок для ответа.", show_alert=True)
         return
 
@@ -52,28 +86,57 @@ async def initiate_operator_reply_handler(callback: CallbackQuery, state: FSMCon
 
 
 @private_router.message(TransactionStates.waiting_for_operator_reply, F.chat.type == "private")
-async def user_message_to_topic_handler(message: Message, state: FSMContext):
+async def user_message_to_topic_handler(message: Message, state: FSMContext, bot: Bot):
     user_id = message.from_user.id
     try:
-        async with acquire() as conn:
-            active_order = await get_active_order_for_user(conn, user_id)
+        route = await _route_for_user(user_id)
     except Exception as e:
         logger.error(f"DB error in user_message_to_topic for user {user_id}: {e}", exc_info=True)
         await message.answer("❌ Ошибка базы данных.")
         return
 
-    if not active_order or not active_order.get('topic_id'):
+    if not route:
         await message.answer(
             "⚠️ Не удалось найти вашу активную заявку. Возможно, она уже закрыта. Вы выведены из режима чата."
         )
         await state.clear()
         return
 
-    try:
-        await message.forward(chat_id=SUPPORT_GROUP_ID, message_thread_id=active_order['topic_id'])
-    except Exception as e:
-        logger.error(f"Failed to forward user message from {user_id} to topic {active_order['topic_id']}: {e}")
-        await message.answer("❌ Не удалось отправить сообщение. Попробуйте позже.")
+    order_id, topic_id = route
+    lane = ("to_topic", user_id)
+    if message.media_group_id:
+        _albums.add(lane, message, partial(_forward_album_to_topic, bot, order_id, user_id, topic_id))
+        return
+    await _albums.wait(lane)
+
+    # Отправка идёт в очереди темы: хендлер не ждёт Telegram, порядок сообщений сохраняется.
+    send_scheduler.submit(
+        SUPPORT_GROUP_ID,
+        partial(message.forward, chat_id=SUPPORT_GROUP_ID, message_thread_id=topic_id),
+        on_error=partial(_on_forward_failed, message, order_id, user_id, topic_id),
+        thread_id=topic_id,
+    )
+
+
+async def _forward_album_to_topic(bot: Bot, order_id: int, user_id: int, topic_id: int,
+                                  parts: list[Message]) -> None:
+    send_scheduler.submit(
+        SUPPORT_GROUP_ID,
+        partial(
+            bot.forward_messages, chat_id=SUPPORT_GROUP_ID, message_thread_id=topic_id,
+            from_chat_id=user_id, message_ids=[m.message_id for m in parts],
+        ),
+        on_error=partial(_on_forward_failed, parts[0], order_id, user_id, topic_id),
+        thread_id=topic_id,
+    )
+
+
+async def _on_forward_failed(message: Message, order_id: int, user_id: int, topic_id: int,
+                             error: Exception) -> None:
+    logger.error(f"Failed to forward user message from {user_id} to topic {topic_id}: {error}")
+    # Маршрут мог устареть (заявку закрыли на другой реплике) — следующее сообщение перепроверит БД.
+    order_routes.close(order_id, user_id)
+    await message.answer("❌ Не удалось отправить сообщение. Попробуйте позже.")
 
 
 @private_router.callback_query(F.data == "end_reply_session")
@@ -96,35 +159,53 @@ async def operator_reply_to_user_handler(message: Message, bot: Bot):
         return
 
     try:
-        async with acquire() as conn:
-            order_info = await get_order_by_topic_id(conn, message.message_thread_id)
+        route = await _route_for_topic(message.message_thread_id)
     except Exception as e:
         logger.error(f"DB error in operator_reply for topic {message.message_thread_id}: {e}", exc_info=True)
         return
 
-    if not order_info or not order_info.get('user_id'):
+    if not route:
         return
+    order_id, user_id = route
 
     # Оператор ответил в теме — прекращаем напоминания по этой заявке.
-    try:
-        async with transaction() as conn:
-            await mark_order_operator_responded(conn, order_info['order_id'])
-    except Exception as e:
-        logger.warning(f"Could not mark operator response for order #{order_info['order_id']}: {e}")
+    operator_responses.mark(order_id)
 
-    user_id = order_info['user_id']
-    header = "💬 <b>Ответ от оператора:</b>\n\n"
+    lane = ("to_user", user_id)
+    if message.media_group_id:
+        _albums.add(lane, message, partial(_copy_album_to_user, bot, user_id))
+        return
+    await _albums.wait(lane)
+
+    header = OPERATOR_REPLY_HEADER
+    on_error = partial(_on_reply_failed, message, user_id)
+    if message.text:
+        send_scheduler.submit(user_id, partial(
+            bot.send_message, chat_id=user_id, text=header + message.html_text, parse_mode="HTML",
+        ), on_error)
+    elif message.caption:
+        send_scheduler.submit(user_id, partial(
+            message.copy_to, chat_id=user_id, caption=header + message.html_caption, parse_mode="HTML",
+        ), on_error)
+    else:
+        send_scheduler.submit(user_id, partial(bot.send_message, user_id, header, parse_mode="HTML"), on_error)
+        send_scheduler.submit(user_id, partial(message.copy_to, chat_id=user_id), on_error)
+
+
+async def _copy_album_to_user(bot: Bot, user_id: int, parts: list[Message]) -> None:
+    # Заголовок отдельным сообщением, альбом — одним copyMessages с исходными подписями.
+    on_error = partial(_on_reply_failed, parts[0], user_id)
+    send_scheduler.submit(
+        user_id, partial(bot.send_message, user_id, OPERATOR_REPLY_HEADER, parse_mode="HTML"), on_error,
+    )
+    send_scheduler.submit(user_id, partial(
+        bot.copy_messages, chat_id=user_id, from_chat_id=SUPPORT_GROUP_ID,
+        message_ids=[m.message_id for m in parts],
+    ), on_error)
 
-    try:
-        if message.text:
-            await bot.send_message(chat_id=user_id, text=header + message.html_text, parse_mode="HTML")
-        elif message.caption:
-            await message.copy_to(chat_id=user_id, caption=header + message.html_caption, parse_mode="HTML")
-        else:
-            await bot.send_message(user_id, header, parse_mode="HTML")
-            await message.copy_to(chat_id=user_id)
-    except Exception as e:
-        logger.error(f"Failed to proxy reply to user {user_id}: {e}", exc_info=True)
-        await message.reply(
-            f"⚠️ Не удалось доставить сообщение пользователю {user_id}. Возможно, он заблокировал бота."
-        )
+
+async def _on_reply_failed(message: Message, user_id: int, error: Exception) -> None:
+    logger.error(f"Failed to proxy reply to user {user_id}: {error}", exc_info=True)
+    await message.reply(
+        f"⚠️ Не удалось доставить сообщение пользователю {user_id}. Возможно, он заблокировал бота."
+    )
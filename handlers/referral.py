@@ -1,18 +1,19 @@
 # handlers/referral.py
 """
-Реферальная система: история начислений, вывод баланса.
+Реферальная система: история начислений, топ рефереров месяца, вывод баланса.
 """
 
 from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 
-from config import MIN_WITHDRAWAL_AMOUNT, SUPPORT_GROUP_ID
-from utils import keyboards, texts
+from config import LEADERBOARD_PUBLIC_SIZE, MIN_WITHDRAWAL_AMOUNT, SUPPORT_GROUP_ID
+from utils import keyboards, leaderboard, texts
 from utils.logging_config import logger
 from utils.database.db_helpers import acquire, transaction
 from utils.database.db_queries import (
-    create_withdrawal_request, get_referral_earnings_history, get_user_referral_info,
+    create_withdrawal_request, get_leaderboard_rank, get_referral_earnings_history,
+    get_user_referral_info, get_users_names,
 )
 from utils.states import ReferralStates
 
@@ -36,6 +37,26 @@ async def referral_earnings_handler(callback: CallbackQuery):
     await callback.answer()
 
 
+@router.callback_query(F.data == "ref_leaderboard")
+async def referral_leaderboard_handler(callback: CallbackQuery):
+    """Топ месяца — из top-K в памяти; своё место — из таблицы мест."""
+    user_id = callback.from_user.id
+    period = leaderboard.current_period()
+    top = leaderboard.top(LEADERBOARD_PUBLIC_SIZE)
+    try:
+        async with acquire() as conn:
+            names = await get_users_names(conn, [referrer_id for referrer_id, _ in top]) if top else {}
+            own_rank = await get_leaderboard_rank(conn, period, user_id)
+    except Exception as e:
+        logger.error(f"DB error in referral_leaderboard_handler for user {user_id}: {e}", exc_info=True)
+        await callback.answer("Ошибка при загрузке рейтинга. Попробуйте позже.", show_alert=True)
+        return
+
+    text = texts.get_leaderboard_text(period, top, names, user_id, own_rank)
+    await callback.message.edit_text(text, reply_markup=keyboards.get_back_to_main_menu_keyboard(), parse_mode="HTML")
+    await callback.answer()
+
+
 @router.callback_query(F.data == "ref_withdraw")
 async def withdrawal_request_handler(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
@@ -82,7 +103,13 @@ async def process_withdrawal_details(message: Message, state: FSMContext):
             name=f"Вывод {amount:,.0f} RUB для {message.from_user.full_name}",
         )
         async with transaction() as conn:
-            await create_withdrawal_request(conn, user_id, amount, topic.message_thread_id)
+            created = await create_withdrawal_request(conn, user_id, amount, topic.message_thread_id)
+        if not created:
+            await message.bot.delete_forum_topic(
+                chat_id=SUPPORT_GROUP_ID, message_thread_id=topic.message_thread_id
+            )
+            await message.answer("❌ Недостаточно средств на балансе. Возможно, вывод уже был создан.")
+            return
 
         admin_text = texts.get_withdrawal_request_admin_notification(
             user_id, message.from_user.username, amount
@@ -95,7 +122,7 @@ async def process_withdrawal_details(message: Message, state: FSMContext):
         )
         await message.answer(
             f"✅ Заявка на вывод <b>{amount:,.2f} RUB</b> создана!\n\n"
-            "Оператор свяжется с вами для обработки выплаты. Ваш реферальный баланс был обнулён.",
+            "Оператор свяжется с вами для обработки выплаты. Сумма списана с реферального баланса.",
             parse_mode="HTML",
         )
         logger.info(f"User {user_id} created withdrawal request for {amount:.2f} RUB.")
@@ -9,8 +9,9 @@ from aiogram.filters import Command
 from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
 
-from config import ADMIN_CHAT_ID, MIN_WITHDRAWAL_AMOUNT, REFERRAL_PERCENTAGE, MIN_WITHDRAWAL_AMOUNT
-from utils import keyboards, texts
+from config import ADMIN_CHAT_ID, MIN_WITHDRAWAL_AMOUNT, REFERRAL_PERCENTAGE, REFERRAL_TREE_MAX_DEPTH
+from middlewares.request_limiter import NOTIFICATION, request_priority
+from utils import keyboards, known_users, texts
 from utils.logging_config import logger
 from utils.texts import WELCOME_PHOTO_URL, WELCOME_TEXT
 from utils.database.db_helpers import acquire, transaction
@@ -56,24 +57,30 @@ async def start_handler(message: Message, state: FSMContext):
         except (ValueError, IndexError):
             logger.warning(f"Invalid referrer payload from user {user_id}: {parts[1]}")
 
-    try:
-        async with transaction() as conn:
-            is_new_user = await save_or_update_user(conn, user_id, username, full_name, referrer_id)
-    except Exception as e:
-        logger.error(f"DB error in start_handler for user {user_id}: {e}", exc_info=True)
-        await message.answer("Произошла ошибка базы данных. Попробуйте позже.")
-        return
+    is_new_user = False
+    if not known_users.is_unchanged(user_id, username, full_name):
+        try:
+            async with transaction() as conn:
+                is_new_user = await save_or_update_user(
+                    conn, user_id, username, full_name, referrer_id, max_tree_depth=REFERRAL_TREE_MAX_DEPTH
+                )
+        except Exception as e:
+            logger.error(f"DB error in start_handler for user {user_id}: {e}", exc_info=True)
+            await message.answer("Произошла ошибка базы данных. Попробуйте позже.")
+            return
+        known_users.remember(user_id, username, full_name)
 
     if is_new_user:
         for admin_id in ADMIN_CHAT_ID:
             try:
-                await message.bot.send_message(
-                    chat_id=admin_id,
-                    text=(
-                        f"Новый пользователь: @{message.from_user.username or 'NoUsername'}\n"
-                        f"Имя: {full_name}\nID: {user_id}"
-                    ),
-                )
+                with request_priority(NOTIFICATION):
+                    await message.bot.send_message(
+                        chat_id=admin_id,
+                        text=(
+                            f"Новый пользователь: @{message.from_user.username or 'NoUsername'}\n"
+                            f"Имя: {full_name}\nID: {user_id}"
+                        ),
+                    )
             except Exception as e:
                 logger.error(f"Failed to notify admin {admin_id} about new user: {e}")
 
@@ -3,10 +3,8 @@
 FSM-флоу покупки и продажи криптовалюты.
 """
 
-import asyncio
-
 from aiogram import F, Bot, Router
-from aiogram.exceptions import AiogramError
+from aiogram.exceptions import AiogramError, TelegramForbiddenError
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 
@@ -14,13 +12,13 @@ from config import (
     NETWORK_FEE_RUB, ORDER_GREETING_DELAY_SECONDS, ORDER_NUMBER_OFFSET,
     SERVICE_COMMISSION_PERCENT, SUPPORT_GROUP_ID,
 )
-from utils import keyboards, texts
+from utils import jobs, keyboards, order_routes, promo_cache, texts
 from utils.callbacks import CancelOrder, CryptoSelection, RubInputSwitch
 from utils.crypto_rates import crypto_rates
 from utils.logging_config import logger
 from utils.states import TransactionStates
 from utils.texts import WELCOME_PHOTO_URL, WELCOME_TEXT
-from utils.database.db_helpers import acquire, transaction
+from utils.database.db_helpers import UnitOfWork, transaction
 from utils.database.db_queries import (
     clear_user_activated_promo, create_order, get_active_order_for_user,
     get_all_settings, get_order_by_id, get_promo_discount_info,
@@ -30,14 +28,16 @@ from utils.database.db_queries import (
 router = Router()
 
 
-async def _send_delayed_greeting(bot: Bot, user_id: int):
+@jobs.job("order_greeting")
+async def _send_delayed_greeting(bot: Bot, payload: dict):
+    user_id = payload['user_id']
     try:
-        await asyncio.sleep(ORDER_GREETING_DELAY_SECONDS)
         await bot.send_message(
             chat_id=user_id,
             text="Приветствую, оператор будет на связи в течение 5 минут!",
         )
-    except Exception as e:
+    except TelegramForbiddenError as e:
+        # Пользователь заблокировал бота — повторять бессмысленно.
         logger.warning(f"Could not send delayed greeting to user {user_id}: {e}")
 
 
@@ -117,7 +117,7 @@ async def switch_to_rub_handler(callback: CallbackQuery, callback_data: RubInput
 
 @router.message(TransactionStates.waiting_for_crypto_amount)
 @router.message(TransactionStates.waiting_for_rub_amount)
-async def process_amount_input(message: Message, state: FSMContext, bot: Bot):
+async def process_amount_input(message: Message, state: FSMContext, bot: Bot, uow: UnitOfWork):
     try:
         amount = float(message.text.replace(',', '.'))
         if amount <= 0:
@@ -155,12 +155,18 @@ async def process_amount_input(message: Message, state: FSMContext, bot: Bot):
     promo_discount_amount = 0.0
     promo_discount_type = 'percent'
     try:
-        async with acquire() as conn:
+        async with uow.acquire() as conn:
             promo_code = await get_user_activated_promo(conn, message.from_user.id)
             if promo_code:
-                promo_discount_amount, promo_discount_type = await get_promo_discount_info(conn, promo_code)
+                # Исчерпанного кода в индексе нет, но уже активированную скидку пользователь получает.
+                cached = promo_cache.lookup(promo_code)
+                promo_discount_amount, promo_discount_type = (
+                    cached or await get_promo_discount_info(conn, promo_code)
+                )
     except Exception as e:
         logger.error(f"DB error while checking promo: {e}", exc_info=True)
+    # Дальше только запросы к Telegram — не держим соединение.
+    await uow.release()
 
     base_service = amount_rub * (SERVICE_COMMISSION_PERCENT / 100)
     base_network = float(NETWORK_FEE_RUB)
@@ -271,11 +277,11 @@ async def process_user_requisites(message: Message, state: FSMContext, bot: Bot)
 # --- Подтверждение и создание заявки ---
 
 @router.callback_query(F.data == "final_confirm_and_get_requisites")
-async def final_confirm_handler(callback: CallbackQuery, state: FSMContext, bot: Bot):
+async def final_confirm_handler(callback: CallbackQuery, state: FSMContext, bot: Bot, uow: UnitOfWork):
     user_id = callback.from_user.id
 
     try:
-        async with acquire() as conn:
+        async with uow.acquire() as conn:
             active = await get_active_order_for_user(conn, user_id)
     except Exception as e:
         logger.error(f"DB error checking active order for user {user_id}: {e}", exc_info=True)
@@ -283,6 +289,7 @@ async def final_confirm_handler(callback: CallbackQuery, state: FSMContext, bot:
         return
 
     if active:
+        await uow.release()
         await callback.message.edit_text("❗️ <b>У вас уже есть активная заявка.</b>", parse_mode="HTML")
         await callback.answer()
         return
@@ -290,7 +297,7 @@ async def final_confirm_handler(callback: CallbackQuery, state: FSMContext, bot:
     data = await state.get_data()
     try:
         await _create_order_and_enter_chat(
-            bot=bot, state=state, from_user=callback.from_user,
+            bot=bot, uow=uow, state=state, from_user=callback.from_user,
             user_requisites=data.get('user_requisites', 'Не указаны'),
             message_to_edit=callback.message,
         )
@@ -301,34 +308,51 @@ async def final_confirm_handler(callback: CallbackQuery, state: FSMContext, bot:
         await callback.answer()
 
 
-async def _create_order_and_enter_chat(bot: Bot, state: FSMContext, from_user,
+async def _create_order_and_enter_chat(bot: Bot, uow: UnitOfWork, state: FSMContext, from_user,
                                         user_requisites: str, message_to_edit: Message):
     data = await state.get_data()
     user_id = from_user.id
 
-    async with transaction() as conn:
-        settings = await get_all_settings(conn)
-        topic = await bot.create_forum_topic(
-            chat_id=SUPPORT_GROUP_ID, name=f"Заявка от {from_user.full_name}"
-        )
-        promo_code = data.get('promo_code')
-        payment_bank = data.get('payment_bank')
-        stored_requisites = (
-            f"Банк отправителя: {payment_bank}\n{user_requisites}"
-            if payment_bank else user_requisites
-        )
-        order_id = await create_order(
-            conn, user_id=user_id, topic_id=topic.message_thread_id,
-            username=from_user.username or "Нет username",
-            action=data.get('action'), crypto=data.get('crypto'),
-            amount_crypto=data.get('amount_crypto'),
-            amount_rub=data.get('total_amount'),
-            phone_and_bank=stored_requisites, promo_code=promo_code,
-            service_commission_rub=data.get('service_commission_rub', 0.0),
-            network_fee_rub=data.get('network_fee_rub', 0.0),
-        )
-        if promo_code:
-            await clear_user_activated_promo(conn, user_id)
+    # Тема создаётся до транзакции: запрос к Telegram может ждать лимита, и держать
+    # в это время соединение из пула незачем.
+    await uow.release()
+    topic = await bot.create_forum_topic(
+        chat_id=SUPPORT_GROUP_ID, name=f"Заявка от {from_user.full_name}"
+    )
+    promo_code = data.get('promo_code')
+    payment_bank = data.get('payment_bank')
+    stored_requisites = (
+        f"Банк отправителя: {payment_bank}\n{user_requisites}"
+        if payment_bank else user_requisites
+    )
+    try:
+        async with uow.transaction() as conn:
+            settings = await get_all_settings(conn)
+            order_id = await create_order(
+                conn, user_id=user_id, topic_id=topic.message_thread_id,
+                username=from_user.username or "Нет username",
+                action=data.get('action'), crypto=data.get('crypto'),
+                amount_crypto=data.get('amount_crypto'),
+                amount_rub=data.get('total_amount'),
+                phone_and_bank=stored_requisites, promo_code=promo_code,
+                service_commission_rub=data.get('service_commission_rub', 0.0),
+                network_fee_rub=data.get('network_fee_rub', 0.0),
+            )
+            if promo_code:
+                await clear_user_activated_promo(conn, user_id)
+            await jobs.enqueue(
+                conn, "order_greeting", {'user_id': user_id},
+                delay_seconds=ORDER_GREETING_DELAY_SECONDS,
+            )
+    except Exception:
+        # Заявка не создана — пустая тема в группе поддержки не нужна.
+        try:
+            await bot.delete_forum_topic(chat_id=SUPPORT_GROUP_ID, message_thread_id=topic.message_thread_id)
+        except AiogramError:
+            pass
+        raise
+    await uow.release()
+    order_routes.add(order_id, user_id, topic.message_thread_id)
 
     order_number = order_id + ORDER_NUMBER_OFFSET
     await bot.edit_forum_topic(
@@ -360,7 +384,6 @@ async def _create_order_and_enter_chat(bot: Bot, state: FSMContext, from_user,
         reply_markup=keyboards.get_final_actions_keyboard(order_id),
         parse_mode="HTML",
     )
-    asyncio.create_task(_send_delayed_greeting(bot, user_id))
     await state.set_state(TransactionStates.waiting_for_operator_reply)
 
 
@@ -403,11 +426,14 @@ async def cancel_order_handler(callback: CallbackQuery, callback_data: CancelOrd
                 await callback.answer("Заявка уже закрыта.", show_alert=True)
                 return
             await update_order_status(conn, order_id, "cancelled_by_user")
-            await refund_promo_if_needed(conn, callback.from_user.id, order_id)
+            released_promo = await refund_promo_if_needed(conn, callback.from_user.id, order_id)
     except Exception as e:
         logger.error(f"DB error in cancel_order for order #{order_id}: {e}", exc_info=True)
         await callback.answer("Ошибка при отмене заявки в базе данных!", show_alert=True)
         return
+    order_routes.close(order_id, callback.from_user.id)
+    if released_promo:
+        promo_cache.restore(released_promo)
 
     if order_info and order_info.get('topic_id'):
         try:
@@ -1,6 +1,6 @@
 """
 Точка входа: инициализация БД, регистрация роутера, запуск поллинга
-и фоновые задачи (автозакрытие заявок, ночные напоминания).
+и воркер очереди задач (автозакрытие заявок, напоминания, приветствия).
 """
 
 import asyncio
@@ -23,24 +23,35 @@ from config import (
     SUPPORT_GROUP_ID,
     TOKEN,
     DATABASE_URL,
+    DATABASE_REPLICA_URL,
+    BALANCE_CHECKPOINT_INTERVAL_SECONDS,
+    BALANCE_CHECKPOINT_SETTLE_SECONDS,
+    BALANCE_RECONCILE_INTERVAL_SECONDS,
+    LEADERBOARD_RANKS_INTERVAL_SECONDS,
 )
 from handlers import router
 import utils.admin_cache as admin_cache
+from utils import jobs, leaderboard, operator_responses, order_routes, promo_cache
+from utils.send_scheduler import scheduler as send_scheduler
 from utils.database.connection import init_pool, close_pool
 from utils.database.db_connector import run_migrations
 from utils.database.db_helpers import acquire, transaction
 from utils.database.db_queries import (
+    auto_close_stale_orders,
+    checkpoint_balances,
     get_all_admins,
-    get_orders_needing_warning,
-    get_processing_orders,
-    get_stale_processing_orders,
-    mark_order_warned,
-    update_order_status,
+    get_orders_needing_reminder,
+    mark_orders_reminded,
+    mark_orders_warned,
+    rebuild_leaderboard_ranks,
+    reconcile_balance_checkpoints,
 )
 from utils.logging_config import logger
 from middlewares.throttling import ThrottlingMiddleware
 from middlewares.logging import LoggingMiddleware
 from middlewares.blocked_users import BlockedUserMiddleware
+from middlewares.database import DatabaseMiddleware
+from middlewares.request_limiter import NOTIFICATION, limiter as request_limiter, request_priority
 
 MSK_TZ = ZoneInfo("Europe/Moscow")
 
@@ -64,115 +75,129 @@ def _seconds_until_next_msk_night_start() -> int:
     return max(60, int((target - now).total_seconds()))
 
 
-async def auto_close_orders_loop(bot: Bot):
-    """Периодически предупреждает и автозакрывает заявки старше ORDER_AUTO_CLOSE_MINUTES."""
-    while True:
-        try:
-            async with transaction() as conn:
-                for order in await get_orders_needing_warning(conn, ORDER_AUTO_CLOSE_MINUTES, warn_before_minutes=5):
-                    order_number = order["order_id"] + ORDER_NUMBER_OFFSET
-                    try:
-                        await bot.send_message(
-                            chat_id=order["user_id"],
-                            text=(
-                                f"⏳ Ваша заявка <b>#{order_number}</b> будет автоматически отменена "
-                                f"через 5 минут, если оператор её не обработает. "
-                                f"Свяжитесь с оператором, если нужна помощь."
-                            ),
-                            parse_mode="HTML",
-                        )
-                    except Exception as e:
-                        logger.warning(f"Could not send warning to user {order['user_id']}: {e}")
-                    await mark_order_warned(conn, order["order_id"])
-
-            async with transaction() as conn:
-                for order in await get_stale_processing_orders(conn, ORDER_AUTO_CLOSE_MINUTES):
-                    if not await update_order_status(conn, order["order_id"], "auto_closed"):
-                        continue
-                    order_number = order["order_id"] + ORDER_NUMBER_OFFSET
-                    try:
-                        await bot.send_message(
-                            chat_id=order["user_id"],
-                            text=(
-                                f"⏱ Заявка <b>#{order_number}</b> автоматически закрыта, "
-                                f"так как не была обработана в течение {ORDER_AUTO_CLOSE_MINUTES} минут."
-                            ),
-                            parse_mode="HTML",
-                        )
-                    except Exception as e:
-                        logger.warning(f"Could not notify user {order['user_id']} about auto close: {e}")
-                    if order.get("topic_id"):
-                        try:
-                            await bot.send_message(
-                                chat_id=SUPPORT_GROUP_ID,
-                                message_thread_id=order["topic_id"],
-                                text=f"⏱ <b>Заявка #{order_number} автоматически закрыта</b> (превышено время ожидания {ORDER_AUTO_CLOSE_MINUTES} мин).",
-                                parse_mode="HTML",
-                            )
-                        except Exception as e:
-                            logger.warning(f"Could not notify topic {order['topic_id']} about auto close: {e}")
-        except Exception as e:
-            logger.error(f"auto_close_orders_loop error: {e}", exc_info=True)
+async def _notify(bot: Bot, chat_id: int, text: str, **kwargs) -> None:
+    """Отправляет служебное уведомление (лимит частоты — в middleware сессии); ошибки только логирует."""
+    try:
+        with request_priority(NOTIFICATION):
+            await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML", **kwargs)
+    except Exception as e:
+        logger.warning(f"Could not send notification to chat {chat_id}: {e}")
 
-        await asyncio.sleep(60)
 
+@jobs.job("auto_close_orders", interval=60)
+async def auto_close_orders(bot: Bot, payload: dict):
+    """Предупреждает и автозакрывает заявки старше ORDER_AUTO_CLOSE_MINUTES.
 
-async def admin_orders_reminder_loop(bot: Bot):
+    Изменения в БД делаются двумя set-based UPDATE … RETURNING и коммитятся сразу;
+    уведомления уходят уже после коммита, параллельно и под общим лимитером.
+    """
+    async with transaction() as conn:
+        warned = await mark_orders_warned(conn, ORDER_AUTO_CLOSE_MINUTES, warn_before_minutes=5)
+        closed = await auto_close_stale_orders(conn, ORDER_AUTO_CLOSE_MINUTES)
+
+    sends = []
+    for order in warned:
+        order_number = order["order_id"] + ORDER_NUMBER_OFFSET
+        sends.append(_notify(
+            bot, order["user_id"],
+            f"⏳ Ваша заявка <b>#{order_number}</b> будет автоматически отменена "
+            f"через 5 минут, если оператор её не обработает. "
+            f"Свяжитесь с оператором, если нужна помощь.",
+        ))
+    for order in closed:
+        order_routes.close(order["order_id"], order["user_id"])
+        if order["promo_code_used"]:
+            promo_cache.restore(order["promo_code_used"])
+        order_number = order["order_id"] + ORDER_NUMBER_OFFSET
+        sends.append(_notify(
+            bot, order["user_id"],
+            f"⏱ Заявка <b>#{order_number}</b> автоматически закрыта, "
+            f"так как не была обработана в течение {ORDER_AUTO_CLOSE_MINUTES} минут.",
+        ))
+        if order.get("topic_id"):
+            sends.append(_notify(
+                bot, SUPPORT_GROUP_ID,
+                f"⏱ <b>Заявка #{order_number} автоматически закрыта</b> (превышено время ожидания {ORDER_AUTO_CLOSE_MINUTES} мин).",
+                message_thread_id=order["topic_id"],
+            ))
+    if sends:
+        await asyncio.gather(*sends)
+
+
+@jobs.job("admin_orders_reminder", interval=ADMIN_REMINDER_TICK_SECONDS)
+async def admin_orders_reminder(bot: Bot, payload: dict):
     """Шлёт напоминания о необработанных заявках прямо в тему каждой заявки.
 
     Так тап по уведомлению Telegram открывает нужную тему напрямую. По каждой заявке
     напоминание отправляется не чаще одного раза в ADMIN_REMINDER_INTERVAL_SECONDS
-    (по умолчанию 1.5 минуты), без начальной «пачки».
+    (по умолчанию 1.5 минуты). Время последнего напоминания хранится в orders.reminded_at,
+    поэтому интервал соблюдается и после перезапуска, и при нескольких репликах.
     """
-    last_sent: dict[int, datetime] = {}
-    while True:
+    async with acquire() as conn:
+        orders = await get_orders_needing_reminder(conn, ADMIN_REMINDER_INTERVAL_SECONDS)
+
+    now = datetime.now()
+    reminded = []
+    for order in orders:
+        order_id = order["order_id"]
+        topic_id = order["topic_id"]
+        order_number = order_id + ORDER_NUMBER_OFFSET
+        minutes = int((now - order["created_at"]).total_seconds() // 60)
+        age_note = f" (уже {minutes} мин)" if minutes >= 1 else ""
+        text = (
+            f"🔔 <b>Заявка #{order_number} ещё не обработана{age_note}.</b>\n"
+            f"Возьмите её, пожалуйста, в работу."
+        )
         try:
-            async with acquire() as conn:
-                processing = await get_processing_orders(conn)
-
-            now = datetime.now()
-            active_ids = set()
-            for order in processing:
-                order_id = order["order_id"]
-                active_ids.add(order_id)
-                topic_id = order.get("topic_id")
-                if not topic_id:
-                    continue
-
-                age = (now - order["created_at"]).total_seconds()
-                prev = last_sent.get(order_id)
-                if prev is not None and (now - prev).total_seconds() < ADMIN_REMINDER_INTERVAL_SECONDS:
-                    continue
-
-                order_number = order_id + ORDER_NUMBER_OFFSET
-                minutes = int(age // 60)
-                age_note = f" (уже {minutes} мин)" if minutes >= 1 else ""
-                text = (
-                    f"🔔 <b>Заявка #{order_number} ещё не обработана{age_note}.</b>\n"
-                    f"Возьмите её, пожалуйста, в работу."
+            with request_priority(NOTIFICATION):
+                await bot.send_message(
+                    chat_id=SUPPORT_GROUP_ID,
+                    message_thread_id=topic_id,
+                    text=text,
+                    parse_mode="HTML",
                 )
-                try:
-                    await bot.send_message(
-                        chat_id=SUPPORT_GROUP_ID,
-                        message_thread_id=topic_id,
-                        text=text,
-                        parse_mode="HTML",
-                    )
-                    last_sent[order_id] = now
-                except Exception as e:
-                    logger.warning(f"Could not send reminder to topic {topic_id} (order #{order_number}): {e}")
-
-            # Чистим трекинг по заявкам, которые больше не в работе.
-            for oid in [oid for oid in last_sent if oid not in active_ids]:
-                del last_sent[oid]
+            reminded.append(order_id)
         except Exception as e:
-            logger.error(f"admin_orders_reminder_loop error: {e}", exc_info=True)
+            logger.warning(f"Could not send reminder to topic {topic_id} (order #{order_number}): {e}")
+
+    if reminded:
+        async with transaction() as conn:
+            await mark_orders_reminded(conn, reminded)
+
+
+@jobs.job("balance_checkpoints", interval=BALANCE_CHECKPOINT_INTERVAL_SECONDS)
+async def balance_checkpoints(bot: Bot, payload: dict):
+    """Сворачивает накопившиеся записи balance_ledger в checkpoint'ы, чтобы чтение баланса оставалось коротким."""
+    async with transaction() as conn:
+        updated = await checkpoint_balances(conn, BALANCE_CHECKPOINT_SETTLE_SECONDS)
+    if updated:
+        logger.info(f"Balance checkpoints updated for {updated} users")
 
-        await asyncio.sleep(ADMIN_REMINDER_TICK_SECONDS)
+
+@jobs.job("balance_reconciliation", interval=BALANCE_RECONCILE_INTERVAL_SECONDS)
+async def balance_reconciliation(bot: Bot, payload: dict):
+    """Сверяет checkpoint'ы с полной суммой ledger; расхождения чинит и пишет в лог."""
+    async with transaction() as conn:
+        fixed = await reconcile_balance_checkpoints(conn)
+    for row in fixed:
+        logger.error(
+            f"Balance checkpoint mismatch for user {row['user_id']}: "
+            f"checkpoint {row['checkpoint_balance']:.2f}, ledger {row['ledger_balance']:.2f} (fixed)"
+        )
+
+
+@jobs.job("leaderboard_ranks", interval=LEADERBOARD_RANKS_INTERVAL_SECONDS)
+async def leaderboard_ranks(bot: Bot, payload: dict):
+    """Пересчитывает таблицу мест лидерборда за текущий месяц (и прошлый — чтобы дописать его итог)."""
+    current = leaderboard.current_period()
+    previous = (current - timedelta(days=1)).replace(day=1)
+    async with transaction() as conn:
+        for period in (previous, current):
+            await rebuild_leaderboard_ranks(conn, period)
 
 
 async def main():
-    await init_pool(DATABASE_URL)
+    await init_pool(DATABASE_URL, DATABASE_REPLICA_URL or None)
 
     async with acquire() as conn:
         db_admins = await get_all_admins(conn)
@@ -180,15 +205,39 @@ async def main():
     admin_cache.init(ADMIN_CHAT_ID, db_admin_ids)
     logger.info(f"Admin cache initialized: {admin_cache.all_ids()}")
 
+    try:
+        await promo_cache.refresh()
+    except Exception as e:
+        # Без индекса промокоды проверяются через БД с негативным кэшем.
+        logger.error(f"Failed to load promo code index: {e}", exc_info=True)
+    try:
+        await leaderboard.refresh()
+    except Exception as e:
+        logger.error(f"Failed to load referral leaderboard: {e}", exc_info=True)
+    try:
+        await order_routes.refresh()
+    except Exception as e:
+        # Без прогрева маршруты заполняются из БД при первом сообщении.
+        logger.error(f"Failed to load order routes: {e}", exc_info=True)
+
     bot = Bot(token=TOKEN)
-    auto_close_task = None
-    admin_reminder_task = None
+    # Все запросы бота проходят через общий лимит Telegram API с приоритетами и повтором после 429.
+    bot.session.middleware(request_limiter)
+    # Фоновые задачи процесса: отменяются при остановке бота.
+    background_tasks = [
+        asyncio.create_task(promo_cache.run_refresh_loop()),
+        asyncio.create_task(leaderboard.run_refresh_loop()),
+        asyncio.create_task(order_routes.run_refresh_loop()),
+        asyncio.create_task(operator_responses.run_flush_loop()),
+    ]
 
     try:
         bot_info = await bot.get_me()
         logger.info(f"Bot started: {bot_info.first_name} @{bot_info.username}")
 
         dp = Dispatcher(storage=MemoryStorage())
+        dp.message.middleware(DatabaseMiddleware())
+        dp.callback_query.middleware(DatabaseMiddleware())
         dp.message.middleware(BlockedUserMiddleware())
         dp.callback_query.middleware(BlockedUserMiddleware())
         dp.message.middleware(ThrottlingMiddleware(rate=1.0))
@@ -211,20 +260,18 @@ async def main():
 
         dp.include_router(router)
 
-        auto_close_task = asyncio.create_task(auto_close_orders_loop(bot))
-        admin_reminder_task = asyncio.create_task(admin_orders_reminder_loop(bot))
+        await jobs.ensure_periodic()
+        background_tasks.append(asyncio.create_task(jobs.run_worker(bot)))
 
         await dp.start_polling(bot)
     except TelegramUnauthorizedError:
         logger.error("TelegramUnauthorizedError: invalid TELEGRAM_BOT_TOKEN.")
         raise
     finally:
-        for task in [auto_close_task, admin_reminder_task]:
-            if task:
-                task.cancel()
-        tasks_to_cancel = [t for t in [auto_close_task, admin_reminder_task] if t]
-        if tasks_to_cancel:
-            await asyncio.gather(*tasks_to_cancel, return_exceptions=True)
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await send_scheduler.close()
         await close_pool()
         await bot.session.close()
 
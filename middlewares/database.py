@@ -0,0 +1,36 @@
+"""
+Middleware, выдающий хендлеру UnitOfWork — одно лениво берущееся соединение с БД на апдейт.
+
+Хендлер получает его аргументом `uow` и открывает явные границы:
+
+    async with uow.transaction() as conn: ...
+    async with uow.acquire() as conn: ...
+
+После завершения хендлера соединение возвращается в пул. Заодно middleware запоминает
+пользователя апдейта — по нему db_helpers держит read-your-writes при чтении с реплики.
+"""
+
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from utils.database.db_helpers import UnitOfWork, reset_current_user, set_current_user
+
+
+class DatabaseMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        user_token = set_current_user(user.id if user else None)
+        uow = UnitOfWork()
+        data["uow"] = uow
+        try:
+            return await handler(event, data)
+        finally:
+            await uow.release()
+            reset_current_user(user_token)
@@ -0,0 +1,224 @@
+"""
+Middleware сессии Bot: общий лимит исходящих запросов к Telegram API и повтор после 429.
+
+Через него проходят все запросы бота — ответы в диалогах, уведомления, напоминания,
+рассылки. Сообщения (send*, copy*, forward*) ждут токен в бакете своего чата (у лички,
+групп и группы поддержки — разные лимиты), затем в общем бакете бота. Остальные
+запросы к чатам (edit*, delete*, темы форума и т.п.) не расходуют лимит сообщений чата
+и ждут только общий бакет. Запросы без чата и чтения (get*) идут без ограничений.
+
+Ожидающие обслуживаются по приоритету, потом по очереди: диалог с пользователем
+и оператором (DIALOG) раньше служебных уведомлений (NOTIFICATION), а те раньше
+рассылок (BROADCAST). Приоритет задаётся для текущей задачи:
+
+    with request_priority(BROADCAST):
+        await bot.copy_message(...)
+
+На TelegramRetryAfter чат ставится на паузу (или запрос просто ждёт retry_after),
+и запрос повторяется (до TG_MAX_RETRIES раз).
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Mapping, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from cachetools import TTLCache
+
+from config import (
+    SEND_GROUP_BURST, SEND_GROUP_RATE_PER_MINUTE, SEND_PRIVATE_RATE_PER_SECOND, SUPPORT_GROUP_BURST,
+    SUPPORT_GROUP_ID, SUPPORT_GROUP_RATE_PER_SECOND, TG_GLOBAL_RATE_PER_SECOND, TG_MAX_RETRIES,
+)
+from utils.logging_config import logger
+
+DIALOG, NOTIFICATION, BROADCAST = 0, 1, 2
+PRIORITY_NAMES = {DIALOG: "dialog", NOTIFICATION: "notification", BROADCAST: "broadcast"}
+
+# Методы, которые публикуют сообщение в чат и расходуют его лимит сообщений.
+_MESSAGE_METHOD_PREFIXES = ("send", "copy", "forward")
+
+_priority: ContextVar[int] = ContextVar("telegram_request_priority", default=DIALOG)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """Задаёт приоритет запросов к Telegram для текущей задачи (и задач, созданных внутри)."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _PriorityBucket:
+    """Token bucket, в котором ожидающие получают токены по приоритету, затем FIFO."""
+
+    def __init__(self, rate: float, burst: int):
+        self._rate = rate
+        self._capacity = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def waiting(self) -> dict[int, int]:
+        counts: dict[int, int] = {}
+        for priority, _, fut in self._waiters:
+            if not fut.done():
+                counts[priority] = counts.get(priority, 0) + 1
+        return counts
+
+    def pause(self, seconds: float) -> None:
+        """Не выдаёт токены seconds секунд (после ответа 429)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, priority: int) -> None:
+        self._refill()
+        if not self._waiters and self._tokens >= 1 and time.monotonic() >= self._paused_until:
+            self._tokens -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._schedule()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Токен уже выдали, но задачу отменили — возвращаем его.
+                self._tokens += 1
+            raise
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def _schedule(self) -> None:
+        if self._timer is not None or not self._waiters:
+            return
+        delay = max((1 - self._tokens) / self._rate, self._paused_until - time.monotonic(), 0)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+
+    def _wake(self) -> None:
+        self._timer = None
+        self._refill()
+        if time.monotonic() >= self._paused_until:
+            while self._waiters and self._tokens >= 1:
+                _, _, fut = heapq.heappop(self._waiters)
+                if fut.done():
+                    continue
+                self._tokens -= 1
+                fut.set_result(None)
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        self._schedule()
+
+
+class RequestLimiterMiddleware(BaseRequestMiddleware):
+    def __init__(self, global_rate: float, private_rate: float, group_rate: float, max_retries: int = 3,
+                 group_burst: int = 1, chat_limits: Optional[Mapping[int, tuple[float, int]]] = None):
+        """
+        :param global_rate: запросов к чатам в секунду на всего бота.
+        :param private_rate: сообщений в секунду в один личный чат.
+        :param group_rate: сообщений в секунду в одну группу.
+        :param max_retries: сколько раз повторять запрос после TelegramRetryAfter.
+        :param group_burst: сколько сообщений подряд можно отправить в группу без ожидания.
+        :param chat_limits: отдельные (сообщений_в_секунду, burst) для конкретных чатов.
+        """
+        self._global = _PriorityBucket(global_rate, burst=max(1, int(global_rate)))
+        self._private_rate = private_rate
+        self._group_rate = group_rate
+        self._group_burst = max(1, group_burst)
+        self._chat_limits = dict(chat_limits or {})
+        self._max_retries = max_retries
+        # Бакеты по чатам; неактивные чаты со временем забываются.
+        self._chats: TTLCache = TTLCache(maxsize=100_000, ttl=600)
+        self._requests = 0
+        self._retried = 0
+        self._failed = 0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None or method.__api_method__.startswith("get"):
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        is_message = method.__api_method__.startswith(_MESSAGE_METHOD_PREFIXES)
+        chat = self._chat_bucket(chat_id) if is_message else None
+        attempt = 0
+        while True:
+            if chat is not None:
+                await chat.acquire(priority)
+            await self._global.acquire(priority)
+            self._requests += 1
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if chat is not None:
+                    chat.pause(e.retry_after)
+                if attempt > self._max_retries:
+                    self._failed += 1
+                    raise
+                self._retried += 1
+                logger.warning(
+                    f"Flood control on {method.__api_method__} to chat {chat_id}: "
+                    f"retry {attempt}/{self._max_retries} in {e.retry_after}s"
+                )
+                if chat is None:
+                    await asyncio.sleep(e.retry_after)
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> _PriorityBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id in self._chat_limits:
+                rate, burst = self._chat_limits[chat_id]
+            elif isinstance(chat_id, int) and chat_id > 0:
+                rate, burst = self._private_rate, max(1, int(self._private_rate * 3))
+            else:
+                # Отрицательные id и @username — группы и каналы.
+                rate, burst = self._group_rate, self._group_burst
+            bucket = self._chats[chat_id] = _PriorityBucket(rate, burst=max(1, burst))
+        return bucket
+
+    def stats(self) -> dict:
+        """Очереди по приоритетам (общий бакет и бакеты чатов) и счётчики запросов."""
+        waiting_global = self._global.waiting()
+        waiting_chats: dict[int, int] = {}
+        for bucket in list(self._chats.values()):
+            for priority, count in bucket.waiting().items():
+                waiting_chats[priority] = waiting_chats.get(priority, 0) + count
+        return {
+            'waiting_global': {name: waiting_global.get(p, 0) for p, name in PRIORITY_NAMES.items()},
+            'waiting_chats': {name: waiting_chats.get(p, 0) for p, name in PRIORITY_NAMES.items()},
+            'chats': len(self._chats),
+            'requests': self._requests,
+            'retried': self._retried,
+            'failed': self._failed,
+        }
+
+
+limiter = RequestLimiterMiddleware(
+    global_rate=TG_GLOBAL_RATE_PER_SECOND,
+    private_rate=SEND_PRIVATE_RATE_PER_SECOND,
+    group_rate=SEND_GROUP_RATE_PER_MINUTE / 60,
+    max_retries=TG_MAX_RETRIES,
+    group_burst=SEND_GROUP_BURST,
+    # Все темы заявок живут в одной группе поддержки — у неё свой, более широкий лимит.
+    chat_limits={SUPPORT_GROUP_ID: (SUPPORT_GROUP_RATE_PER_SECOND, SUPPORT_GROUP_BURST)} if SUPPORT_GROUP_ID else None,
+)
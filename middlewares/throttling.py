@@ -3,6 +3,7 @@ Middleware для ограничения частоты запросов (anti-s
 
 Разрешает не более 1 сообщения в секунду на пользователя.
 При превышении лимита тихо игнорирует запрос.
+Альбом считается одним сообщением: если пропущена первая часть, пропускаются и остальные.
 """
 
 from typing import Any, Awaitable, Callable
@@ -19,6 +20,8 @@ class ThrottlingMiddleware(BaseMiddleware):
         """
         # TTLCache: ключ — user_id, значение — True, TTL = rate секунд
         self._cache: TTLCache = TTLCache(maxsize=10_000, ttl=rate)
+        # media_group_id -> пропущен ли альбом; части приходят в пределах пары секунд
+        self._albums: TTLCache = TTLCache(maxsize=10_000, ttl=max(rate, 10.0))
 
     async def __call__(
         self,
@@ -26,10 +29,20 @@ class ThrottlingMiddleware(BaseMiddleware):
         event: Message,
         data: dict[str, Any],
     ) -> Any:
-        user_id = event.from_user.id if event.from_user else None
-        if user_id is not None:
-            if user_id in self._cache:
-                # Слишком быстро — игнорируем
+        album_id = event.media_group_id
+        if album_id is not None and album_id in self._albums:
+            # Следующие части альбома — решение уже принято по первой части
+            if not self._albums[album_id]:
                 return
+            return await handler(event, data)
+
+        user_id = event.from_user.id if event.from_user else None
+        allowed = user_id is None or user_id not in self._cache
+        if user_id is not None and allowed:
             self._cache[user_id] = True
+        if album_id is not None:
+            self._albums[album_id] = allowed
+        if not allowed:
+            # Слишком быстро — игнорируем
+            return
         return await handler(event, data)
@@ -8,8 +8,9 @@
     1. Читает схему SQLite и сопоставляет с таблицами PostgreSQL
     2. Переносит данные в правильном порядке (с учётом FK-зависимостей)
     3. Пропускает дубликаты (ON CONFLICT DO NOTHING)
-    4. Подробно логирует каждый шаг и все ошибки
-    5. Не трогает уже существующие данные в PostgreSQL
+    4. Пересчитывает производные таблицы (referrer_stats, referral_leaderboard, referral_tree)
+    5. Подробно логирует каждый шаг и все ошибки
+    6. Не трогает уже существующие данные в PostgreSQL
 
 Требования:
     pip install asyncpg aiosqlite python-dotenv
@@ -28,6 +29,8 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+from config import REFERRAL_TREE_MAX_DEPTH
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
@@ -155,6 +158,23 @@ async def migrate_users(sqlite_cur: sqlite3.Cursor, pg: asyncpg.Connection) -> i
     return inserted
 
 
+async def migrate_opening_balances(pg: asyncpg.Connection) -> int:
+    """Переносит users.referral_balance в balance_ledger (запись 'opening') для пользователей без записей."""
+    log.info("=== Миграция: balance_ledger (начальные балансы) ===")
+    result = await pg.execute(
+        """
+        INSERT INTO balance_ledger (user_id, kind, amount, created_at)
+        SELECT u.user_id, 'opening', u.referral_balance, now()
+        FROM users u
+        WHERE u.referral_balance <> 0
+          AND NOT EXISTS (SELECT 1 FROM balance_ledger l WHERE l.user_id = u.user_id)
+        """
+    )
+    inserted = int(result.split()[-1])
+    log.info("  Результат: вставлено=%d", inserted)
+    return inserted
+
+
 async def migrate_orders(sqlite_cur: sqlite3.Cursor, pg: asyncpg.Connection) -> dict:
     """Возвращает маппинг old_order_id -> new_order_id (если autoincrement сбросился)."""
     log.info("=== Миграция: orders ===")
@@ -364,6 +384,94 @@ async def migrate_referral_earnings(sqlite_cur: sqlite3.Cursor, pg: asyncpg.Conn
     return inserted
 
 
+async def migrate_referrer_stats(pg: asyncpg.Connection) -> int:
+    """Пересчитывает referrer_stats по users и referral_earnings (как миграция 008)."""
+    log.info("=== Миграция: referrer_stats (пересчёт) ===")
+    result = await pg.execute(
+        """
+        INSERT INTO referrer_stats (referrer_id, referral_count, total_earned, last_earning_at)
+        SELECT r.referrer_id, COALESCE(c.cnt, 0), COALESCE(e.total, 0), e.last_at
+        FROM (
+            SELECT referrer_id FROM users WHERE referrer_id IS NOT NULL
+            UNION
+            SELECT referrer_id FROM referral_earnings
+        ) r
+        JOIN users owner ON owner.user_id = r.referrer_id
+        LEFT JOIN (
+            SELECT referrer_id, COUNT(*) AS cnt FROM users
+            WHERE referrer_id IS NOT NULL GROUP BY referrer_id
+        ) c ON c.referrer_id = r.referrer_id
+        LEFT JOIN (
+            SELECT referrer_id, SUM(amount) AS total, MAX(created_at) AS last_at
+            FROM referral_earnings GROUP BY referrer_id
+        ) e ON e.referrer_id = r.referrer_id
+        ON CONFLICT (referrer_id) DO UPDATE
+            SET referral_count = EXCLUDED.referral_count,
+                total_earned = EXCLUDED.total_earned,
+                last_earning_at = EXCLUDED.last_earning_at
+        """
+    )
+    updated = int(result.split()[-1])
+    log.info("  Результат: записано=%d", updated)
+    return updated
+
+
+async def migrate_referral_leaderboard(pg: asyncpg.Connection) -> int:
+    """Пересчитывает месячный рейтинг рефереров и места в нём (как миграция 009)."""
+    log.info("=== Миграция: referral_leaderboard (пересчёт) ===")
+    result = await pg.execute(
+        """
+        INSERT INTO referral_leaderboard (period, referrer_id, total_earned, earnings_count)
+        SELECT date_trunc('month', created_at)::date, referrer_id, SUM(amount), COUNT(*)
+        FROM referral_earnings
+        WHERE created_at IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (period, referrer_id) DO UPDATE
+            SET total_earned = EXCLUDED.total_earned,
+                earnings_count = EXCLUDED.earnings_count
+        """
+    )
+    updated = int(result.split()[-1])
+    # Места пересобираем целиком: задача leaderboard_ranks обновляет только текущий месяц.
+    await pg.execute("DELETE FROM referral_leaderboard_ranks")
+    await pg.execute(
+        """
+        INSERT INTO referral_leaderboard_ranks (period, rank, referrer_id, total_earned)
+        SELECT period, ROW_NUMBER() OVER (PARTITION BY period ORDER BY total_earned DESC, referrer_id),
+               referrer_id, total_earned
+        FROM referral_leaderboard
+        """
+    )
+    log.info("  Результат: записано=%d", updated)
+    return updated
+
+
+async def migrate_referral_tree(pg: asyncpg.Connection, max_depth: int) -> int:
+    """Достраивает дерево рефералов по users.referrer_id (как миграция 010)."""
+    log.info("=== Миграция: referral_tree (до %d уровней) ===", max_depth)
+    # Глубина ограничена — это же защищает от циклов в старых данных.
+    result = await pg.execute(
+        """
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+            SELECT u.referrer_id, u.user_id, 1
+            FROM users u JOIN users r ON r.user_id = u.referrer_id
+            WHERE u.referrer_id <> u.user_id
+            UNION ALL
+            SELECT p.referrer_id, t.descendant_id, t.depth + 1
+            FROM tree t JOIN users p ON p.user_id = t.ancestor_id
+            WHERE p.referrer_id IS NOT NULL AND p.referrer_id <> t.descendant_id AND t.depth < $1
+        )
+        INSERT INTO referral_tree (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM tree GROUP BY ancestor_id, descendant_id
+        ON CONFLICT (ancestor_id, descendant_id) DO NOTHING
+        """,
+        max_depth,
+    )
+    inserted = int(result.split()[-1])
+    log.info("  Результат: вставлено=%d", inserted)
+    return inserted
+
+
 async def migrate_withdrawal_requests(sqlite_cur: sqlite3.Cursor, pg: asyncpg.Connection) -> int:
     log.info("=== Миграция: withdrawal_requests ===")
 
@@ -505,6 +613,7 @@ async def run(sqlite_path: str, pg_url: str, dry_run: bool = False):
         # Порядок важен из-за FK-зависимостей
         if "users" in existing_tables:
             await migrate_users(sqlite_cur, pg)
+            await migrate_opening_balances(pg)
         else:
             log.warning("Таблица users отсутствует в SQLite — пропускаем")
 
@@ -529,6 +638,11 @@ async def run(sqlite_path: str, pg_url: str, dry_run: bool = False):
         else:
             log.warning("Таблица referral_earnings отсутствует в SQLite — пропускаем")
 
+        # Агрегаты считаются по уже перенесённым users и referral_earnings.
+        await migrate_referrer_stats(pg)
+        await migrate_referral_leaderboard(pg)
+        await migrate_referral_tree(pg, REFERRAL_TREE_MAX_DEPTH)
+
         if "withdrawal_requests" in existing_tables:
             await migrate_withdrawal_requests(sqlite_cur, pg)
         else:
@@ -0,0 +1,51 @@
+"""Add jobs table for durable delayed work and orders.reminded_at
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = '005'
+down_revision: Union[str, None] = '004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.BigInteger, primary_key=True, autoincrement=True),
+        sa.Column('kind', sa.Text, nullable=False),
+        sa.Column('payload', postgresql.JSONB, nullable=False, server_default='{}'),
+        sa.Column('run_at', sa.DateTime, nullable=False),
+        sa.Column('priority', sa.SmallInteger, nullable=False, server_default='0'),
+        sa.Column('attempts', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('max_attempts', sa.Integer, nullable=False, server_default='5'),
+        # 'pending' — ждёт выполнения, 'failed' — исчерпал попытки (остаётся для разбора)
+        sa.Column('status', sa.Text, nullable=False, server_default='pending'),
+        # Аренда: пока locked_until в будущем, задачу выполняет какой-то воркер.
+        # Если воркер упал, задача снова становится доступной после истечения аренды.
+        sa.Column('locked_until', sa.DateTime),
+        sa.Column('last_error', sa.Text),
+        # Ключ для периодических/единичных задач, которые не должны дублироваться.
+        sa.Column('dedup_key', sa.Text, unique=True),
+        sa.Column('created_at', sa.DateTime),
+    )
+    op.create_index(
+        'ix_jobs_pending_run_at', 'jobs', ['run_at'],
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+
+    # Время последнего напоминания по заявке — вместо in-memory словаря в цикле напоминаний.
+    op.add_column('orders', sa.Column('reminded_at', sa.DateTime, nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('orders', 'reminded_at')
+    op.drop_index('ix_jobs_pending_run_at', table_name='jobs')
+    op.drop_table('jobs')
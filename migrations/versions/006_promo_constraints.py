@@ -0,0 +1,34 @@
+"""Unique promo redemption per user and non-negative uses_left
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = '006'
+down_revision: Union[str, None] = '005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Дубликаты могли появиться из-за гонки в старой активации — оставляем самую раннюю запись.
+    op.execute(
+        """
+        DELETE FROM used_promo_codes u
+        USING used_promo_codes keep
+        WHERE u.user_id = keep.user_id AND u.promo_code = keep.promo_code AND u.id > keep.id
+        """
+    )
+    op.create_unique_constraint('uq_used_promo_codes_user_code', 'used_promo_codes', ['user_id', 'promo_code'])
+
+    op.execute("UPDATE promo_codes SET uses_left = 0 WHERE uses_left < 0")
+    op.create_check_constraint('ck_promo_codes_uses_left_non_negative', 'promo_codes', 'uses_left >= 0')
+
+
+def downgrade() -> None:
+    op.drop_constraint('ck_promo_codes_uses_left_non_negative', 'promo_codes', type_='check')
+    op.drop_constraint('uq_used_promo_codes_user_code', 'used_promo_codes', type_='unique')
@@ -0,0 +1,88 @@
+"""Append-only balance ledger with per-user checkpoints
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '007'
+down_revision: Union[str, None] = '006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'balance_ledger',
+        sa.Column('id', sa.BigInteger, primary_key=True, autoincrement=True),
+        sa.Column('user_id', sa.BigInteger, sa.ForeignKey('users.user_id'), nullable=False),
+        # 'opening' — перенос старого users.referral_balance, 'earning', 'lottery_win', 'withdrawal'
+        sa.Column('kind', sa.Text, nullable=False),
+        # Со знаком: списания (withdrawal) отрицательные.
+        sa.Column('amount', sa.Numeric(12, 2), nullable=False),
+        # order_id / lottery_plays.id / withdrawal_requests.id — в зависимости от kind
+        sa.Column('ref_id', sa.BigInteger),
+        sa.Column('created_at', sa.DateTime, nullable=False),
+        sa.CheckConstraint(
+            "kind IN ('opening', 'earning', 'lottery_win', 'withdrawal')", name='ck_balance_ledger_kind'
+        ),
+    )
+    op.create_index('ix_balance_ledger_user_id_id', 'balance_ledger', ['user_id', 'id'])
+
+    # Баланс на момент last_entry_id; текущий = balance + записи ledger после него.
+    op.create_table(
+        'balance_checkpoints',
+        sa.Column('user_id', sa.BigInteger, sa.ForeignKey('users.user_id'), primary_key=True),
+        sa.Column('balance', sa.Numeric(12, 2), nullable=False),
+        sa.Column('last_entry_id', sa.BigInteger, nullable=False),
+        sa.Column('updated_at', sa.DateTime, nullable=False),
+    )
+
+    op.execute(
+        """
+        CREATE FUNCTION user_balance(p_user_id BIGINT) RETURNS NUMERIC
+        LANGUAGE sql STABLE AS $$
+            WITH c AS (
+                SELECT balance, last_entry_id FROM balance_checkpoints WHERE user_id = p_user_id
+            )
+            SELECT COALESCE((SELECT balance FROM c), 0)
+                 + COALESCE((SELECT SUM(amount) FROM balance_ledger
+                             WHERE user_id = p_user_id
+                               AND id > COALESCE((SELECT last_entry_id FROM c), 0)), 0)
+        $$
+        """
+    )
+
+    # Текущие балансы переносятся в ledger одной записью 'opening' и сразу фиксируются checkpoint'ом.
+    # Колонка users.referral_balance дальше не обновляется.
+    op.execute(
+        """
+        INSERT INTO balance_ledger (user_id, kind, amount, created_at)
+        SELECT user_id, 'opening', referral_balance, now()
+        FROM users WHERE referral_balance <> 0
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO balance_checkpoints (user_id, balance, last_entry_id, updated_at)
+        SELECT user_id, SUM(amount), MAX(id), now() FROM balance_ledger GROUP BY user_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        UPDATE users u SET referral_balance = b.balance
+        FROM (SELECT user_id, SUM(amount) AS balance FROM balance_ledger GROUP BY user_id) b
+        WHERE u.user_id = b.user_id
+        """
+    )
+    op.execute("DROP FUNCTION user_balance(BIGINT)")
+    op.drop_table('balance_checkpoints')
+    op.drop_index('ix_balance_ledger_user_id_id', table_name='balance_ledger')
+    op.drop_table('balance_ledger')
@@ -0,0 +1,53 @@
+"""Per-referrer aggregates: referral count, total earned, last earning
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '008'
+down_revision: Union[str, None] = '007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'referrer_stats',
+        sa.Column('referrer_id', sa.BigInteger, sa.ForeignKey('users.user_id'), primary_key=True),
+        sa.Column('referral_count', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('total_earned', sa.Numeric(14, 2), nullable=False, server_default='0'),
+        sa.Column('last_earning_at', sa.DateTime),
+    )
+    # Для списков рефералов конкретного пользователя.
+    op.create_index('ix_users_referrer_id', 'users', ['referrer_id'])
+
+    op.execute(
+        """
+        INSERT INTO referrer_stats (referrer_id, referral_count, total_earned, last_earning_at)
+        SELECT r.referrer_id, COALESCE(c.cnt, 0), COALESCE(e.total, 0), e.last_at
+        FROM (
+            SELECT referrer_id FROM users WHERE referrer_id IS NOT NULL
+            UNION
+            SELECT referrer_id FROM referral_earnings
+        ) r
+        JOIN users owner ON owner.user_id = r.referrer_id
+        LEFT JOIN (
+            SELECT referrer_id, COUNT(*) AS cnt FROM users
+            WHERE referrer_id IS NOT NULL GROUP BY referrer_id
+        ) c ON c.referrer_id = r.referrer_id
+        LEFT JOIN (
+            SELECT referrer_id, SUM(amount) AS total, MAX(created_at) AS last_at
+            FROM referral_earnings GROUP BY referrer_id
+        ) e ON e.referrer_id = r.referrer_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_referrer_id', table_name='users')
+    op.drop_table('referrer_stats')
@@ -0,0 +1,68 @@
+"""Monthly referral leaderboard aggregates and precomputed ranks
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '009'
+down_revision: Union[str, None] = '008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # period — первый день месяца.
+    op.create_table(
+        'referral_leaderboard',
+        sa.Column('period', sa.Date, primary_key=True),
+        sa.Column('referrer_id', sa.BigInteger, sa.ForeignKey('users.user_id'), primary_key=True),
+        sa.Column('total_earned', sa.Numeric(14, 2), nullable=False, server_default='0'),
+        sa.Column('earnings_count', sa.Integer, nullable=False, server_default='0'),
+    )
+    op.create_index(
+        'ix_referral_leaderboard_period_total', 'referral_leaderboard',
+        ['period', sa.text('total_earned DESC')],
+    )
+
+    # Пересобирается периодической задачей целиком для периода.
+    op.create_table(
+        'referral_leaderboard_ranks',
+        sa.Column('period', sa.Date, primary_key=True),
+        sa.Column('rank', sa.Integer, primary_key=True),
+        sa.Column('referrer_id', sa.BigInteger, nullable=False),
+        sa.Column('total_earned', sa.Numeric(14, 2), nullable=False),
+    )
+    op.create_index(
+        'ix_referral_leaderboard_ranks_referrer', 'referral_leaderboard_ranks',
+        ['period', 'referrer_id'], unique=True,
+    )
+
+    op.execute(
+        """
+        INSERT INTO referral_leaderboard (period, referrer_id, total_earned, earnings_count)
+        SELECT date_trunc('month', created_at)::date, referrer_id, SUM(amount), COUNT(*)
+        FROM referral_earnings
+        WHERE created_at IS NOT NULL
+        GROUP BY 1, 2
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO referral_leaderboard_ranks (period, rank, referrer_id, total_earned)
+        SELECT period, ROW_NUMBER() OVER (PARTITION BY period ORDER BY total_earned DESC, referrer_id),
+               referrer_id, total_earned
+        FROM referral_leaderboard
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_referral_leaderboard_ranks_referrer', table_name='referral_leaderboard_ranks')
+    op.drop_table('referral_leaderboard_ranks')
+    op.drop_index('ix_referral_leaderboard_period_total', table_name='referral_leaderboard')
+    op.drop_table('referral_leaderboard')
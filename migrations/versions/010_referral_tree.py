@@ -0,0 +1,57 @@
+"""Referral closure table (ancestor -> descendant with depth)
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from config import REFERRAL_TREE_MAX_DEPTH
+
+revision: str = '010'
+down_revision: Union[str, None] = '009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Строки «сам себе предок» не храним: depth всегда >= 1.
+    op.create_table(
+        'referral_tree',
+        sa.Column('ancestor_id', sa.BigInteger, sa.ForeignKey('users.user_id'), primary_key=True),
+        sa.Column('descendant_id', sa.BigInteger, sa.ForeignKey('users.user_id'), primary_key=True),
+        sa.Column('depth', sa.SmallInteger, nullable=False),
+        sa.CheckConstraint('depth >= 1', name='ck_referral_tree_depth_positive'),
+    )
+    op.create_index('ix_referral_tree_descendant_id', 'referral_tree', ['descendant_id'])
+    op.create_index('ix_referral_tree_ancestor_depth', 'referral_tree', ['ancestor_id', 'depth'])
+    # Оборот поддерева считается по завершённым заявкам потомков.
+    op.create_index('ix_orders_user_id_status', 'orders', ['user_id', 'status'])
+
+    # Глубина та же, что у save_or_update_user (REFERRAL_TREE_MAX_DEPTH);
+    # ограничение же защищает от циклов в старых данных.
+    op.execute(
+        f"""
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+            SELECT u.referrer_id, u.user_id, 1
+            FROM users u JOIN users r ON r.user_id = u.referrer_id
+            WHERE u.referrer_id <> u.user_id
+            UNION ALL
+            SELECT p.referrer_id, t.descendant_id, t.depth + 1
+            FROM tree t JOIN users p ON p.user_id = t.ancestor_id
+            WHERE p.referrer_id IS NOT NULL AND p.referrer_id <> t.descendant_id AND t.depth < {REFERRAL_TREE_MAX_DEPTH}
+        )
+        INSERT INTO referral_tree (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM tree GROUP BY ancestor_id, descendant_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_orders_user_id_status', table_name='orders')
+    op.drop_index('ix_referral_tree_ancestor_depth', table_name='referral_tree')
+    op.drop_index('ix_referral_tree_descendant_id', table_name='referral_tree')
+    op.drop_table('referral_tree')
@@ -0,0 +1,31 @@
+"""Indexes for active order routing and topic lookups
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '011'
+down_revision: Union[str, None] = '010'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Заявок в обработке единицы, а всего заявок — много: частичный индекс покрывает
+    # синхронизацию маршрутов чата и выборки автозакрытия/напоминаний.
+    op.create_index(
+        'ix_orders_processing_created_at', 'orders', ['created_at'],
+        postgresql_where=sa.text("status = 'processing'"),
+    )
+    # Промах маршрута «тема → заявка» в прокси чата.
+    op.create_index('ix_orders_topic_id', 'orders', ['topic_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_orders_topic_id', table_name='orders')
+    op.drop_index('ix_orders_processing_created_at', table_name='orders')
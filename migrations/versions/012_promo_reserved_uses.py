@@ -0,0 +1,52 @@
+"""Reserve promo code uses at activation
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '012'
+down_revision: Union[str, None] = '011'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Промокоды, которые уже активированы пользователями или висят на заявках в обработке:
+# раньше uses_left уменьшался только при подтверждении заявки, теперь — при активации.
+_HELD = """
+    SELECT code, count(*) AS held FROM (
+        SELECT activated_promo AS code FROM users WHERE activated_promo IS NOT NULL
+        UNION ALL
+        SELECT promo_code_used FROM orders WHERE status = 'processing' AND promo_code_used IS NOT NULL
+    ) h
+    GROUP BY code
+"""
+
+
+def upgrade() -> None:
+    # Сколько удержанных использований не хватило в uses_left. Возвращённые резервы сначала
+    # гасят этот долг и только потом увеличивают uses_left.
+    op.add_column('promo_codes', sa.Column('overdrawn', sa.Integer, nullable=False, server_default='0'))
+    op.execute(
+        f"""
+        UPDATE promo_codes p
+        SET uses_left = GREATEST(p.uses_left - h.held, 0),
+            overdrawn = GREATEST(h.held - p.uses_left, 0)
+        FROM ({_HELD}) h
+        WHERE p.code = h.code
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        f"""
+        UPDATE promo_codes p SET uses_left = p.uses_left + h.held - p.overdrawn
+        FROM ({_HELD}) h
+        WHERE p.code = h.code
+        """
+    )
+    op.drop_column('promo_codes', 'overdrawn')
@@ -0,0 +1,26 @@
+"""Mark lottery plays whose result was shown to the user
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-19
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '013'
+down_revision: Union[str, None] = '012'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Когда пользователю показали результат игры: повтор задачи показа его не дублирует.
+    op.add_column('lottery_plays', sa.Column('revealed_at', sa.DateTime, nullable=True))
+    # Старые игры давно показаны.
+    op.execute("UPDATE lottery_plays SET revealed_at = played_at")
+
+
+def downgrade() -> None:
+    op.drop_column('lottery_plays', 'revealed_at')
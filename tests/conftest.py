@@ -0,0 +1,22 @@
+"""
+Общие фикстуры тестов.
+
+Тесты запросов к БД работают с настоящим PostgreSQL: TEST_DATABASE_URL должен указывать
+на отдельную базу, накатанную миграциями
+(DATABASE_URL=$TEST_DATABASE_URL alembic upgrade head). Без него такие тесты пропускаются.
+"""
+
+import os
+
+import pytest
+
+# config.py требует токен при импорте.
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:test")
+
+
+@pytest.fixture
+def database_url() -> str:
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    return url
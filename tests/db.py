@@ -0,0 +1,26 @@
+"""Помощники для тестов, которым нужна настоящая база."""
+
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+
+@asynccontextmanager
+async def rollback_connection(url: str):
+    """Соединение внутри транзакции, которая откатывается после теста."""
+    conn = await asyncpg.connect(url)
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        yield conn
+    finally:
+        await tr.rollback()
+        await conn.close()
+
+
+async def create_user(conn, user_id: int, referrer_id: int | None = None) -> None:
+    await conn.execute(
+        "INSERT INTO users (user_id, username, full_name, created_at, referrer_id) "
+        "VALUES ($1, 'test', 'Test User', now(), $2)",
+        user_id, referrer_id,
+    )
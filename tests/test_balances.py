@@ -0,0 +1,72 @@
+import asyncio
+
+import asyncpg
+
+from utils.database.db_queries import checkpoint_balances, reconcile_balance_checkpoints
+
+USER_ID = 9_100_002_001
+
+
+async def _cleanup(conn: asyncpg.Connection) -> None:
+    await conn.execute("DELETE FROM balance_checkpoints WHERE user_id = $1", USER_ID)
+    await conn.execute("DELETE FROM balance_ledger WHERE user_id = $1", USER_ID)
+    await conn.execute("DELETE FROM users WHERE user_id = $1", USER_ID)
+
+
+async def _add_entry(conn: asyncpg.Connection, amount: int) -> int:
+    return await conn.fetchval(
+        "INSERT INTO balance_ledger (user_id, kind, amount, created_at) "
+        "VALUES ($1, 'earning', $2, now() - interval '1 hour') RETURNING id",
+        USER_ID, amount,
+    )
+
+
+def test_reconciliation_waits_for_running_checkpoint(database_url):
+    async def scenario():
+        setup = await asyncpg.connect(database_url)
+        checkpointer = await asyncpg.connect(database_url)
+        reconciler = await asyncpg.connect(database_url)
+        try:
+            await _cleanup(setup)
+            await setup.execute(
+                "INSERT INTO users (user_id, username, full_name, created_at) VALUES ($1, 'test', 'Test User', now())",
+                USER_ID,
+            )
+            first = await _add_entry(setup, 10)
+            # Испорченный checkpoint: сверка должна его починить.
+            await setup.execute(
+                "INSERT INTO balance_checkpoints (user_id, balance, last_entry_id, updated_at) "
+                "VALUES ($1, 999, $2, now())",
+                USER_ID, first,
+            )
+            await _add_entry(setup, 5)
+
+            # Свёртка сдвигает last_entry_id и держит транзакцию открытой, пока идёт сверка.
+            checkpoint_tr = checkpointer.transaction()
+            await checkpoint_tr.start()
+            await checkpoint_balances(checkpointer, 0)
+
+            async def reconcile():
+                async with reconciler.transaction():
+                    return await reconcile_balance_checkpoints(reconciler)
+
+            reconciling = asyncio.create_task(reconcile())
+            await asyncio.sleep(0.5)
+            assert not reconciling.done()
+            await checkpoint_tr.commit()
+            await reconciling
+
+            row = await setup.fetchrow(
+                "SELECT balance, last_entry_id FROM balance_checkpoints WHERE user_id = $1", USER_ID
+            )
+            ledger = await setup.fetchval(
+                "SELECT SUM(amount) FROM balance_ledger WHERE user_id = $1 AND id <= $2",
+                USER_ID, row['last_entry_id'],
+            )
+            assert row['balance'] == ledger == 15
+        finally:
+            await _cleanup(setup)
+            for conn in (setup, checkpointer, reconciler):
+                await conn.close()
+
+    asyncio.run(scenario())
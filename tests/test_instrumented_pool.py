@@ -0,0 +1,24 @@
+import asyncio
+
+import pytest
+
+from utils.database.instrumented_pool import _ResizableLimiter
+
+
+def test_cancelled_waiter_already_woken_is_not_removed_twice():
+    async def scenario():
+        limiter = _ResizableLimiter(1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        # Слот освобождается до того, как отменённая задача проснулась: _wake вынимает её future.
+        limiter.release()
+
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.in_use == 0
+        assert limiter.waiting == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,46 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from tests.db import rollback_connection
+from utils.database.db_queries import claim_jobs, fail_expired_jobs
+
+
+async def _insert_job(conn, kind: str, attempts: int, dedup_key: str | None = None) -> int:
+    """Задача, чей воркер пропал: аренда истекла минуту назад."""
+    past = datetime.now() - timedelta(minutes=1)
+    return await conn.fetchval(
+        "INSERT INTO jobs (kind, run_at, attempts, max_attempts, locked_until, dedup_key, created_at) "
+        "VALUES ($1, $2, $3, 3, $2, $4, $2) RETURNING id",
+        kind, past, attempts, dedup_key,
+    )
+
+
+def test_expired_job_on_last_attempt_is_dead_lettered(database_url):
+    async def scenario():
+        async with rollback_connection(database_url) as conn:
+            await conn.execute("DELETE FROM jobs")
+            dead_id = await _insert_job(conn, "test_job", attempts=3)
+            alive_id = await _insert_job(conn, "test_job", attempts=1)
+
+            failed = await fail_expired_jobs(conn)
+            claimed = await claim_jobs(conn, 10, 60)
+
+            assert [item['id'] for item in failed] == [dead_id]
+            assert [item['id'] for item in claimed] == [alive_id]
+            assert await conn.fetchval("SELECT status FROM jobs WHERE id = $1", dead_id) == 'failed'
+
+    asyncio.run(scenario())
+
+
+def test_expired_periodic_job_starts_over(database_url):
+    async def scenario():
+        async with rollback_connection(database_url) as conn:
+            await conn.execute("DELETE FROM jobs")
+            job_id = await _insert_job(conn, "test_periodic", attempts=3, dedup_key="test_periodic")
+
+            assert await fail_expired_jobs(conn) == []
+            claimed = await claim_jobs(conn, 10, 60)
+
+            assert [(item['id'], item['attempts']) for item in claimed] == [(job_id, 1)]
+
+    asyncio.run(scenario())
@@ -0,0 +1,135 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from config import LOTTERY_REVEAL_DELAY_SECONDS
+from handlers import lottery
+from utils import jobs
+
+USER_ID = 42
+CHAT_ID = 42
+MENU_MESSAGE_ID = 10
+DICE_MESSAGE_ID = 11
+PLAY_ID = 7
+PLAYED_AT = datetime(2026, 10, 19, 12, 0, 0)
+
+
+class FakeBot:
+    """Записывает вызовы Bot API вместо запросов к Telegram."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def send_dice(self, chat_id, emoji):
+        self.calls.append(('send_dice', chat_id))
+        return SimpleNamespace(message_id=DICE_MESSAGE_ID)
+
+    async def delete_message(self, chat_id, message_id):
+        self.calls.append(('delete_message', chat_id))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls.append(('send_message', chat_id))
+
+    async def edit_message_text(self, *args, **kwargs):
+        raise RuntimeError("menu is gone")
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    """Игра «сыграна» без БД; поставленные задачи складываются в список."""
+    calls = []
+    revealed = set()
+
+    @asynccontextmanager
+    async def fake_transaction():
+        yield object()
+
+    async def fake_play_lottery(conn, user_id, prize_amount):
+        return PLAY_ID, PLAYED_AT
+
+    async def fake_is_revealed(conn, play_id):
+        return play_id in revealed
+
+    async def fake_mark_revealed(conn, play_id):
+        revealed.add(play_id)
+
+    async def fake_enqueue(conn, kind, payload=None, delay_seconds=0, priority=0, dedup_key=None):
+        calls.append({'kind': kind, 'payload': payload, 'delay_seconds': delay_seconds, 'dedup_key': dedup_key})
+        return len(calls)
+
+    monkeypatch.setattr(lottery, "transaction", fake_transaction)
+    monkeypatch.setattr(lottery, "play_lottery", fake_play_lottery)
+    monkeypatch.setattr(lottery, "is_lottery_play_revealed", fake_is_revealed)
+    monkeypatch.setattr(lottery, "mark_lottery_play_revealed", fake_mark_revealed)
+    monkeypatch.setattr(lottery.prize_sampler, "draw", lambda: 3)
+    monkeypatch.setattr(jobs, "enqueue", fake_enqueue)
+    return calls
+
+
+def _callback(bot: FakeBot):
+    answers = []
+
+    async def answer(*args, **kwargs):
+        answers.append((args, kwargs))
+
+    callback = SimpleNamespace(
+        from_user=SimpleNamespace(id=USER_ID),
+        message=SimpleNamespace(chat=SimpleNamespace(id=CHAT_ID), message_id=MENU_MESSAGE_ID),
+        bot=bot,
+        answer=answer,
+    )
+    return callback, answers
+
+
+def test_play_handler_returns_without_waiting_for_animation(enqueued):
+    bot = FakeBot()
+    callback, answers = _callback(bot)
+
+    started = time.monotonic()
+    asyncio.run(lottery.lottery_play_handler(callback))
+    elapsed = time.monotonic() - started
+
+    assert elapsed < LOTTERY_REVEAL_DELAY_SECONDS / 10
+    assert bot.calls == []
+    assert answers == [((), {})]
+    assert [job['kind'] for job in enqueued] == ['lottery_dice']
+    assert enqueued[0]['payload']['played_at'] == PLAYED_AT.isoformat()
+    assert enqueued[0]['payload']['play_id'] == PLAY_ID
+    assert enqueued[0]['dedup_key'] == f"lottery_dice:{PLAY_ID}"
+
+
+def test_dice_job_schedules_reveal_after_animation(enqueued):
+    bot = FakeBot()
+    callback, _ = _callback(bot)
+    asyncio.run(lottery.lottery_play_handler(callback))
+    dice_payload = enqueued[0]['payload']
+
+    asyncio.run(lottery._send_lottery_dice(bot, dice_payload))
+
+    assert bot.calls == [('send_dice', CHAT_ID)]
+    reveal = enqueued[1]
+    assert reveal['kind'] == 'lottery_reveal'
+    assert reveal['delay_seconds'] == LOTTERY_REVEAL_DELAY_SECONDS
+    assert reveal['payload'] == {**dice_payload, 'dice_message_id': DICE_MESSAGE_ID}
+    assert reveal['dedup_key'] == f"lottery_reveal:{PLAY_ID}"
+
+
+def test_reveal_is_shown_once_even_if_menu_refresh_fails_and_jobs_rerun(enqueued):
+    bot = FakeBot()
+    callback, _ = _callback(bot)
+    asyncio.run(lottery.lottery_play_handler(callback))
+    reveal_payload = {**enqueued[0]['payload'], 'dice_message_id': DICE_MESSAGE_ID}
+
+    # Меню обновить не удаётся (FakeBot.edit_message_text падает), но задача не падает.
+    asyncio.run(lottery._reveal_lottery_win(bot, reveal_payload))
+    # Повторы задач после выполнения ничего не шлют и новый показ не ставят.
+    asyncio.run(lottery._reveal_lottery_win(bot, reveal_payload))
+    asyncio.run(lottery._send_lottery_dice(bot, enqueued[0]['payload']))
+
+    assert [name for name, _ in bot.calls].count('send_message') == 1
+    assert ('send_dice', CHAT_ID) not in bot.calls
+    assert [job['kind'] for job in enqueued] == ['lottery_dice']
@@ -0,0 +1,60 @@
+import random
+from collections import Counter
+from fractions import Fraction
+
+import pytest
+
+from config import LOTTERY_PRIZES
+from utils.prize_sampler import PrizeSampler
+
+PRIZES = [(1, 50), (3, 30), (7, 15), (10, 4.5), (100, 0.5)]
+# Критическое значение хи-квадрат для 4 степеней свободы при уровне значимости 0.001.
+CHI2_CRITICAL_DF4 = 18.467
+
+
+def _from_alias_table(sampler: PrizeSampler, amounts: list) -> dict:
+    """Вероятности сумм, собранные обратно из колонок таблицы алиасов."""
+    table = sampler.alias_table
+    n = len(table)
+    result = {amount: Fraction(0) for amount in amounts}
+    for column, (own, alias) in enumerate(table):
+        result[amounts[column]] += own / n
+        result[amounts[alias]] += (1 - own) / n
+    return result
+
+
+@pytest.mark.parametrize("prizes", [PRIZES, LOTTERY_PRIZES])
+def test_alias_table_reconstructs_exact_probabilities(prizes):
+    sampler = PrizeSampler(prizes)
+    weights = [Fraction(str(weight)) for _, weight in prizes]
+    expected = {amount: w / sum(weights) for (amount, _), w in zip(prizes, weights)}
+
+    assert sampler.probabilities == expected
+    assert _from_alias_table(sampler, [amount for amount, _ in prizes]) == expected
+    assert all(0 <= own <= 1 for own, _ in sampler.alias_table)
+
+
+def test_config_prize_probabilities():
+    assert PrizeSampler(LOTTERY_PRIZES).probabilities == {
+        1: Fraction(4, 5), 3: Fraction(1, 10), 7: Fraction(7, 100),
+        10: Fraction(2999, 100000), 100: Fraction(1, 100000),
+    }
+
+
+def test_zero_weight_prize_is_never_drawn():
+    sampler = PrizeSampler([(1, 1), (5, 0)], rng=random.Random(1))
+
+    assert sampler.probabilities[5] == 0
+    assert {sampler.draw() for _ in range(1000)} == {1}
+
+
+def test_draws_follow_probabilities():
+    draws = 200_000
+    sampler = PrizeSampler(PRIZES, rng=random.Random(20261019))
+    counts = Counter(sampler.draw() for _ in range(draws))
+
+    chi2 = sum(
+        (counts[amount] - draws * p) ** 2 / (draws * p)
+        for amount, p in sampler.probabilities.items()
+    )
+    assert chi2 < CHI2_CRITICAL_DF4
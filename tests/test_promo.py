@@ -0,0 +1,104 @@
+import asyncio
+
+import asyncpg
+
+from tests.db import create_user, rollback_connection
+from utils.database.db_queries import activate_promo_for_user
+
+CODE = "TEST-CONCURRENT-1"
+OTHER_CODE = "TEST-CONCURRENT-2"
+USER_IDS = [9_100_001_000 + i for i in range(1000)]
+# Больше соединений тестовая база (max_connections = 100 по умолчанию) может не дать;
+# 1000 активаций всё равно идут одновременно, выстраиваясь в очередь за соединениями.
+POOL_SIZE = 50
+
+
+async def _activate(pool: asyncpg.Pool, user_id: int, code: str) -> str:
+    """Активация в своём соединении и своей транзакции, как в хендлере."""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            status, *_ = await activate_promo_for_user(conn, user_id, code)
+    return status
+
+
+async def _setup(url: str, uses: int) -> asyncpg.Connection:
+    conn = await asyncpg.connect(url)
+    await _cleanup(conn)
+    await conn.executemany(
+        "INSERT INTO users (user_id, username, full_name, created_at) VALUES ($1, 'test', 'Test User', now())",
+        [(user_id,) for user_id in USER_IDS],
+    )
+    await conn.executemany(
+        "INSERT INTO promo_codes (code, total_uses, uses_left, discount_amount_rub, discount_type, created_at) "
+        "VALUES ($1, $2, $2, 10, 'percent', now())",
+        [(CODE, uses), (OTHER_CODE, uses)],
+    )
+    return conn
+
+
+async def _cleanup(conn: asyncpg.Connection) -> None:
+    await conn.execute("DELETE FROM users WHERE user_id = ANY($1::bigint[])", USER_IDS)
+    await conn.execute("DELETE FROM promo_codes WHERE code = ANY($1::text[])", [CODE, OTHER_CODE])
+
+
+def test_concurrent_activations_reserve_the_last_use_once(database_url):
+    async def scenario():
+        conn = await _setup(database_url, uses=1)
+        try:
+            async with asyncpg.create_pool(database_url, min_size=POOL_SIZE, max_size=POOL_SIZE) as pool:
+                statuses = await asyncio.gather(*(_activate(pool, user_id, CODE) for user_id in USER_IDS))
+
+            assert sorted(statuses) == ['exhausted'] * (len(USER_IDS) - 1) + ['success']
+            assert await conn.fetchval("SELECT uses_left FROM promo_codes WHERE code = $1", CODE) == 0
+            assert await conn.fetchval(
+                "SELECT count(*) FROM users WHERE user_id = ANY($1::bigint[]) AND activated_promo = $2",
+                USER_IDS, CODE,
+            ) == 1
+        finally:
+            await _cleanup(conn)
+            await conn.close()
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_activations_by_one_user_keep_one_code(database_url):
+    async def scenario():
+        conn = await _setup(database_url, uses=5)
+        user_id = USER_IDS[0]
+        try:
+            async with asyncpg.create_pool(database_url, min_size=2, max_size=2) as pool:
+                statuses = await asyncio.gather(
+                    _activate(pool, user_id, CODE),
+                    _activate(pool, user_id, OTHER_CODE),
+                )
+
+            assert sorted(statuses) == ['already_active', 'success']
+            activated = await conn.fetchval("SELECT activated_promo FROM users WHERE user_id = $1", user_id)
+            uses_left = dict(await conn.fetch(
+                "SELECT code, uses_left FROM promo_codes WHERE code = ANY($1::text[])", [CODE, OTHER_CODE]
+            ))
+            # Использование зарезервировано только у кода, который достался пользователю.
+            assert uses_left == {CODE: 5, OTHER_CODE: 5, activated: 4}
+        finally:
+            await _cleanup(conn)
+            await conn.close()
+
+    asyncio.run(scenario())
+
+
+def test_statuses_tell_dead_codes_from_unknown_ones(database_url):
+    async def scenario():
+        async with rollback_connection(database_url) as conn:
+            user_id = USER_IDS[0]
+            await create_user(conn, user_id)
+            await conn.execute(
+                "INSERT INTO promo_codes (code, total_uses, uses_left, discount_amount_rub, discount_type, created_at) "
+                "VALUES ($1, 1, 0, 10, 'percent', now())",
+                CODE,
+            )
+
+            assert (await activate_promo_for_user(conn, user_id, CODE))[0] == 'exhausted'
+            assert (await activate_promo_for_user(conn, user_id, OTHER_CODE))[0] == 'invalid_or_expired'
+            assert (await activate_promo_for_user(conn, USER_IDS[1], CODE))[0] == 'unknown_user'
+
+    asyncio.run(scenario())
@@ -0,0 +1,35 @@
+from utils import promo_cache
+
+
+def _row(code, available=True):
+    return {'code': code, 'discount_amount_rub': 10.0, 'discount_type': 'percent', 'available': available}
+
+
+def test_exhausted_code_is_not_treated_as_unknown_and_comes_back_on_release():
+    promo_cache.load([_row("LAST"), _row("EMPTY", available=False)])
+
+    promo_cache.discard("LAST")
+
+    assert promo_cache.lookup("LAST") is None
+    assert not promo_cache.is_known_invalid("LAST")
+    assert not promo_cache.is_known_invalid("EMPTY")
+
+    promo_cache.restore("LAST")
+    promo_cache.restore("EMPTY")
+
+    assert promo_cache.lookup("LAST") == (10.0, 'percent')
+    assert promo_cache.lookup("EMPTY") == (10.0, 'percent')
+
+
+def test_codes_missing_from_index_are_checked_until_the_db_denies_them():
+    promo_cache.load([])
+
+    # Код мог создать другой процесс — без ответа БД он не считается несуществующим.
+    assert not promo_cache.is_known_invalid("FRESH")
+
+    promo_cache.forget("FRESH")
+    assert promo_cache.is_known_invalid("FRESH")
+
+    promo_cache.add("FRESH", 5.0, 'fixed')
+    assert not promo_cache.is_known_invalid("FRESH")
+    assert promo_cache.lookup("FRESH") == (5.0, 'fixed')
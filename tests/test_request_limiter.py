@@ -0,0 +1,143 @@
+"""Лимитер запросов к Telegram API против локальной заглушки Bot API, отвечающей 429."""
+
+import asyncio
+import time
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+from aiohttp import web
+
+from middlewares.request_limiter import BROADCAST, DIALOG, RequestLimiterMiddleware, request_priority
+
+TOKEN = "42:TEST"
+CHAT_ID = 1001
+
+
+class StubBotApi:
+    """Заглушка Bot API: первые `floods` запросов получают 429 с retry_after."""
+
+    def __init__(self, floods: int, retry_after: int = 1):
+        self.floods = floods
+        self.retry_after = retry_after
+        self.requests: list[tuple[str, float]] = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.requests.append((method, time.monotonic()))
+        if self.floods > 0:
+            self.floods -= 1
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            }, status=429)
+        data = await request.post()
+        return web.json_response({'ok': True, 'result': {
+            'message_id': len(self.requests), 'date': int(time.time()),
+            'chat': {'id': int(data['chat_id']), 'type': 'private'}, 'text': data.get('text', ''),
+        }})
+
+
+async def _with_stub(stub: StubBotApi, limiter: RequestLimiterMiddleware, scenario):
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', stub.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}"))
+    bot = Bot(TOKEN, session=session)
+    bot.session.middleware(limiter)
+    try:
+        return await scenario(bot)
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+
+def test_retries_after_429():
+    stub = StubBotApi(floods=1, retry_after=1)
+    limiter = RequestLimiterMiddleware(global_rate=100, private_rate=100, group_rate=100, max_retries=3)
+
+    async def scenario(bot):
+        return await bot.send_message(CHAT_ID, "hello")
+
+    message = asyncio.run(_with_stub(stub, limiter, scenario))
+
+    assert message.text == "hello"
+    assert [m for m, _ in stub.requests] == ['sendMessage', 'sendMessage']
+    assert stub.requests[1][1] - stub.requests[0][1] >= 1.0
+    assert limiter.stats()['retried'] == 1
+
+
+def test_gives_up_after_max_retries():
+    stub = StubBotApi(floods=10, retry_after=1)
+    limiter = RequestLimiterMiddleware(global_rate=100, private_rate=100, group_rate=100, max_retries=1)
+
+    async def scenario(bot):
+        with pytest.raises(TelegramRetryAfter):
+            await bot.send_message(CHAT_ID, "hello")
+
+    asyncio.run(_with_stub(stub, limiter, scenario))
+
+    assert len(stub.requests) == 2
+    assert limiter.stats()['failed'] == 1
+
+
+def test_dialog_requests_overtake_queued_broadcasts():
+    stub = StubBotApi(floods=0)
+    limiter = RequestLimiterMiddleware(global_rate=5, private_rate=100, group_rate=100)
+
+    async def send(bot, chat_id, text, priority):
+        with request_priority(priority):
+            await bot.send_message(chat_id, text)
+
+    async def scenario(bot):
+        broadcasts = [asyncio.create_task(send(bot, 2000 + i, f"b{i}", BROADCAST)) for i in range(8)]
+        await asyncio.sleep(0.05)
+        dialogs = [asyncio.create_task(send(bot, 3000 + i, f"d{i}", DIALOG)) for i in range(2)]
+        await asyncio.gather(*broadcasts, *dialogs)
+
+    order = []
+    original = stub.handle
+
+    async def recording(request):
+        data = await request.post()
+        order.append(data['text'])
+        return await original(request)
+
+    stub.handle = recording
+    asyncio.run(_with_stub(stub, limiter, scenario))
+
+    # Первые 5 рассылок ушли сразу (burst), диалоги — раньше оставшихся рассылок.
+    assert order[5:7] == ['d0', 'd1']
+
+
+def test_edits_do_not_spend_the_group_message_budget():
+    stub = StubBotApi(floods=0)
+    group_id = -1001
+    support_id = -1002
+    limiter = RequestLimiterMiddleware(
+        global_rate=100, private_rate=100, group_rate=0.01, group_burst=1,
+        chat_limits={support_id: (0.01, 5)},
+    )
+
+    async def scenario(bot):
+        started = time.monotonic()
+        await bot.send_message(group_id, "first")
+        for i in range(5):
+            await bot.edit_message_text(f"edit {i}", chat_id=group_id, message_id=1)
+        for i in range(5):
+            await bot.send_message(support_id, f"topic {i}")
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(_with_stub(stub, limiter, scenario))
+
+    # Сообщение в группу съело её единственный токен, но правки его не ждут,
+    # а у группы поддержки свой burst.
+    assert elapsed < 1.0
+    assert len(stub.requests) == 11
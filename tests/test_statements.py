@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+import asyncpg
+import pytest
+
+from utils.database import connection, statements
+
+SQL = "SELECT 1"
+
+
+class FakePool:
+    """Записывает перенастройку пула вместо настоящего asyncpg.Pool."""
+
+    def __init__(self):
+        self.connect_kwargs = None
+        self.expired = False
+
+    def set_connect_args(self, dsn=None, **kwargs):
+        self.connect_kwargs = (dsn, kwargs)
+
+    async def expire_connections(self):
+        self.expired = True
+
+
+class GonePrepared:
+    async def fetchval(self, *args):
+        raise asyncpg.exceptions.InvalidSQLStatementNameError("prepared statement does not exist")
+
+
+class FakeConnection:
+    def __init__(self, stmt_name):
+        self._prepared = {stmt_name: GonePrepared()}
+
+    async def fetchval(self, sql, *args):
+        return 1
+
+
+@pytest.fixture
+def fallback_state(monkeypatch):
+    monkeypatch.setattr(statements, "_server_prepared", True)
+    pool = FakePool()
+    monkeypatch.setattr(connection, "_raw_pools", [(pool, "postgresql://bouncer/db")])
+    stmt = statements.Statement(name="test_gone", sql=SQL)
+    return SimpleNamespace(pool=pool, stmt=stmt)
+
+
+def test_runtime_fallback_also_disables_asyncpg_statement_cache(fallback_state):
+    async def scenario():
+        result = await fallback_state.stmt.fetchval(FakeConnection("test_gone"))
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(scenario()) == 1
+    assert statements._server_prepared is False
+    dsn, kwargs = fallback_state.pool.connect_kwargs
+    assert dsn == "postgresql://bouncer/db"
+    assert kwargs['statement_cache_size'] == 0
+    assert fallback_state.pool.expired
@@ -0,0 +1,66 @@
+import asyncio
+
+from tests.db import create_user, rollback_connection
+from utils.database.db_queries import save_or_update_user
+
+USER_ID = 9_100_000_001
+REFERRER_ID = 9_100_000_002
+UNKNOWN_REFERRER_ID = 9_100_000_999
+
+
+def test_unknown_referrer_is_dropped(database_url):
+    async def scenario():
+        async with rollback_connection(database_url) as conn:
+            is_new = await save_or_update_user(conn, USER_ID, "user", "User", referrer_id=UNKNOWN_REFERRER_ID)
+
+            assert is_new
+            assert await conn.fetchval("SELECT referrer_id FROM users WHERE user_id = $1", USER_ID) is None
+            assert await conn.fetchval(
+                "SELECT count(*) FROM referrer_stats WHERE referrer_id = $1", UNKNOWN_REFERRER_ID
+            ) == 0
+
+    asyncio.run(scenario())
+
+
+def test_known_referrer_is_counted(database_url):
+    async def scenario():
+        async with rollback_connection(database_url) as conn:
+            await create_user(conn, REFERRER_ID)
+            is_new = await save_or_update_user(conn, USER_ID, "user", "User", referrer_id=REFERRER_ID)
+
+            assert is_new
+            assert await conn.fetchval("SELECT referrer_id FROM users WHERE user_id = $1", USER_ID) == REFERRER_ID
+            assert await conn.fetchval(
+                "SELECT referral_count FROM referrer_stats WHERE referrer_id = $1", REFERRER_ID
+            ) == 1
+
+    asyncio.run(scenario())
+
+
+def test_unknown_referrer_adds_no_tree_rows(database_url):
+    async def scenario():
+        async with rollback_connection(database_url) as conn:
+            await save_or_update_user(conn, USER_ID, "user", "User", referrer_id=UNKNOWN_REFERRER_ID)
+
+            assert await conn.fetchval(
+                "SELECT count(*) FROM referral_tree WHERE descendant_id = $1", USER_ID
+            ) == 0
+
+    asyncio.run(scenario())
+
+
+def test_referral_tree_links_all_ancestors(database_url):
+    grandparent_id = 9_100_000_003
+
+    async def scenario():
+        async with rollback_connection(database_url) as conn:
+            await save_or_update_user(conn, grandparent_id, "gp", "Grandparent")
+            await save_or_update_user(conn, REFERRER_ID, "ref", "Referrer", referrer_id=grandparent_id)
+            await save_or_update_user(conn, USER_ID, "user", "User", referrer_id=REFERRER_ID)
+
+            rows = await conn.fetch(
+                "SELECT ancestor_id, depth FROM referral_tree WHERE descendant_id = $1 ORDER BY depth", USER_ID
+            )
+            assert [(r['ancestor_id'], r['depth']) for r in rows] == [(REFERRER_ID, 1), (grandparent_id, 2)]
+
+    asyncio.run(scenario())
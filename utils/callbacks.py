@@ -38,3 +38,11 @@ class AdminManageAction(CallbackData, prefix="adm_manage"):
 class UserBlockAction(CallbackData, prefix="user_block"):
     action: str   # 'block' | 'unblock'
     user_id: int
+
+
+class LeaderboardPage(CallbackData, prefix="lb_page"):
+    page: int  # номер страницы (начиная с 0)
+
+
+class UserNetworkView(CallbackData, prefix="user_net"):
+    user_id: int
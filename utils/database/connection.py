@@ -3,29 +3,199 @@
 
 Пул инициализируется один раз при старте бота (on_startup) и закрывается при завершении.
 Все остальные модули получают соединение через контекстный менеджер transaction() из db_helpers.
+Пул обёрнут в InstrumentedPool, который собирает метрики ожидания и удержания соединений.
+Если задан DSN реплики, создаётся второй пул для SELECT-запросов (см. get_read_pool).
 """
 
+import asyncio
+
 import asyncpg
+import orjson
 from loguru import logger
 
-_pool: asyncpg.Pool | None = None
+from config import (
+    DB_MAX_CACHED_STATEMENT_LIFETIME, DB_POOL_ADAPTIVE, DB_POOL_ADAPTIVE_MAX_SIZE,
+    DB_POOL_ADAPTIVE_WAIT_MS, DB_POOL_HOLD_WARN_SECONDS, DB_POOL_MAX_SIZE, DB_POOL_MIN_SIZE,
+    DB_PGBOUNCER_MODE, DB_REPLICA_HEALTH_INTERVAL_SECONDS, DB_REPLICA_MAX_LAG_SECONDS,
+    DB_REPLICA_POOL_MAX_SIZE, DB_STATEMENT_CACHE_SIZE,
+)
+from . import statements
+from .instrumented_pool import InstrumentedPool
+
+_pool: InstrumentedPool | None = None
+# Исходные asyncpg-пулы с их DSN — чтобы перенастроить соединения при переходе в режим pgbouncer.
+_raw_pools: list[tuple[asyncpg.Pool, str]] = []
+# Необязательная read-only реплика; пока health-check её не подтвердил, чтения идут на основную базу.
+_replica: InstrumentedPool | None = None
+_replica_healthy = False
+_replica_health_task: asyncio.Task | None = None
+
+
+class BotConnection(asyncpg.Connection):
+    """Соединение, хранящее свои подготовленные выражения из реестра statements."""
+
+    __slots__ = ('_prepared',)
+
+
+def _encode_jsonb(value) -> str:
+    return orjson.dumps(value).decode()
+
+
+async def _init_connection(conn: BotConnection) -> None:
+    """Вызывается для каждого нового соединения пула: кодеки типов и подготовка выражений реестра."""
+    # NUMERIC (деньги) оставляем на стандартном кодеке asyncpg — Decimal без потерь точности.
+    for json_type in ('json', 'jsonb'):
+        await conn.set_type_codec(
+            json_type, schema='pg_catalog', encoder=_encode_jsonb, decoder=orjson.loads, format='text',
+        )
+    # timestamp оставляем на бинарном кодеке asyncpg: он и так отдаёт naive datetime.
+
+    # Кодеки должны быть зарегистрированы до prepare — выражение запоминает их при подготовке.
+    conn._prepared = await statements.prepare_all(conn)
+
+
+def _connect_kwargs(server_prepared: bool) -> dict:
+    """Параметры соединения: без серверных prepared statements выключен и неявный кэш asyncpg."""
+    return {
+        'statement_cache_size': DB_STATEMENT_CACHE_SIZE if server_prepared else 0,
+        'max_cached_statement_lifetime': DB_MAX_CACHED_STATEMENT_LIFETIME,
+    }
+
+
+async def _create_pool(dsn: str, min_size: int, max_size: int) -> asyncpg.Pool:
+    pool = await asyncpg.create_pool(
+        dsn,
+        min_size=min_size,
+        max_size=max_size,
+        connection_class=BotConnection,
+        init=_init_connection,
+        **_connect_kwargs(server_prepared=not DB_PGBOUNCER_MODE),
+    )
+    _raw_pools.append((pool, dsn))
+    return pool
+
 
+def _disable_statement_cache() -> None:
+    """Реестр сам перешёл в режим pgbouncer: новые соединения открываются без кэша
+    выражений asyncpg, а уже открытые заменяются при следующей выдаче из пула."""
+    for pool, dsn in _raw_pools:
+        pool.set_connect_args(dsn, **_connect_kwargs(server_prepared=False))
+        asyncio.get_running_loop().create_task(pool.expire_connections())
+    logger.warning("asyncpg statement cache disabled; set DB_PGBOUNCER_MODE=true to start in this mode")
 
-async def init_pool(dsn: str) -> None:
-    global _pool
-    _pool = await asyncpg.create_pool(dsn, min_size=2, max_size=10)
-    logger.info("PostgreSQL connection pool initialized")
+
+statements.on_fallback(_disable_statement_cache)
+
+
+async def init_pool(dsn: str, replica_dsn: str | None = None) -> None:
+    global _pool, _replica, _replica_health_task
+    # В адаптивном режиме сам asyncpg-пул создаётся с запасом, а фактический лимит
+    # выдачи соединений регулирует InstrumentedPool.
+    hard_max = max(DB_POOL_MAX_SIZE, DB_POOL_ADAPTIVE_MAX_SIZE) if DB_POOL_ADAPTIVE else DB_POOL_MAX_SIZE
+    # За pgbouncer в режиме transaction pooling серверные prepared statements не живут
+    # между транзакциями — отключаем и реестр, и неявный кэш asyncpg.
+    statements.configure(server_prepared=not DB_PGBOUNCER_MODE)
+    pool = await _create_pool(dsn, DB_POOL_MIN_SIZE, hard_max)
+    _pool = InstrumentedPool(
+        pool,
+        max_size=DB_POOL_MAX_SIZE,
+        hold_warn_seconds=DB_POOL_HOLD_WARN_SECONDS,
+        adaptive_max_size=hard_max if DB_POOL_ADAPTIVE else None,
+        adaptive_wait_ms=DB_POOL_ADAPTIVE_WAIT_MS,
+    )
+    logger.info(
+        f"PostgreSQL connection pool initialized (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE}, "
+        f"adaptive={'up to ' + str(hard_max) if DB_POOL_ADAPTIVE else 'off'})"
+    )
+
+    if replica_dsn:
+        try:
+            replica_pool = await _create_pool(
+                replica_dsn, min(DB_POOL_MIN_SIZE, DB_REPLICA_POOL_MAX_SIZE), DB_REPLICA_POOL_MAX_SIZE,
+            )
+        except (OSError, asyncpg.PostgresError) as e:
+            # Бот работает и без реплики — все чтения пойдут на основную базу.
+            logger.error(f"Could not connect to read replica, reads will use the primary: {e}")
+        else:
+            _replica = InstrumentedPool(
+                replica_pool,
+                max_size=DB_REPLICA_POOL_MAX_SIZE,
+                hold_warn_seconds=DB_POOL_HOLD_WARN_SECONDS,
+            )
+            _replica_health_task = asyncio.create_task(_replica_health_loop())
+            logger.info(f"Read replica pool initialized (max={DB_REPLICA_POOL_MAX_SIZE})")
+
+
+async def _check_replica() -> bool:
+    """Реплика отвечает и отстаёт не больше DB_REPLICA_MAX_LAG_SECONDS."""
+    try:
+        async with asyncio.timeout(DB_REPLICA_HEALTH_INTERVAL_SECONDS):
+            async with _replica.acquire() as conn:
+                # Всё полученное уже проиграно — реплика догнала основную базу, даже если
+                # та давно не пишет и время последней проигранной транзакции устарело.
+                # NULL — не реплика (или ещё ничего не проигрывала): тоже считаем отставание нулевым.
+                lag = await conn.fetchval(
+                    """
+                    SELECT CASE
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                    END::float8
+                    """
+                )
+    except Exception as e:
+        logger.warning(f"Read replica health check failed: {e}")
+        return False
+    if lag is not None and lag > DB_REPLICA_MAX_LAG_SECONDS:
+        logger.warning(f"Read replica lags by {lag:.1f}s")
+        return False
+    return True
+
+
+async def _replica_health_loop() -> None:
+    global _replica_healthy
+    while True:
+        healthy = await _check_replica()
+        if healthy != _replica_healthy:
+            logger.info(f"Read replica is {'back online' if healthy else 'unavailable'}, "
+                        f"reads go to the {'replica' if healthy else 'primary'}")
+            _replica_healthy = healthy
+        await asyncio.sleep(DB_REPLICA_HEALTH_INTERVAL_SECONDS)
 
 
 async def close_pool() -> None:
-    global _pool
+    global _pool, _replica, _replica_health_task
+    if _replica_health_task:
+        _replica_health_task.cancel()
+        await asyncio.gather(_replica_health_task, return_exceptions=True)
+        _replica_health_task = None
+    if _replica:
+        await _replica.close()
+        _replica = None
     if _pool:
         await _pool.close()
         _pool = None
         logger.info("PostgreSQL connection pool closed")
+    _raw_pools.clear()
 
 
-def get_pool() -> asyncpg.Pool:
+def get_pool() -> InstrumentedPool:
     if _pool is None:
         raise RuntimeError("Database pool is not initialized. Call init_pool() first.")
     return _pool
+
+
+def get_read_pool() -> InstrumentedPool:
+    """Пул для SELECT-запросов: реплика, если она настроена и здорова, иначе основной."""
+    if _replica is not None and _replica_healthy:
+        return _replica
+    return get_pool()
+
+
+def get_pool_stats() -> dict | None:
+    """Метрики пула (None, если пул ещё не создан)."""
+    return _pool.stats() if _pool else None
+
+
+def get_replica_pool_stats() -> dict | None:
+    """Метрики пула реплики (None, если реплика не настроена)."""
+    return _replica.stats() if _replica else None
@@ -1,13 +1,50 @@
 """
 Контекстные менеджеры для работы с пулом asyncpg.
 
-transaction() — для операций записи (автоматический rollback при ошибке).
-acquire()      — для SELECT-запросов без транзакции.
+transaction() — для операций записи (автоматический rollback при ошибке), всегда основная база.
+acquire()      — для SELECT-запросов без транзакции; идёт на реплику, если она настроена.
+UnitOfWork     — соединения на обработку одного апдейта (см. middlewares/database.py).
+
+Read-your-writes: пользователь, от имени которого только что была транзакция, ещё
+DB_REPLICA_PIN_SECONDS читает с основной базы, чтобы не увидеть устаревшие данные реплики.
+Текущего пользователя выставляет DatabaseMiddleware через set_current_user().
 """
 
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
+from contextvars import ContextVar, Token
+from typing import Optional
+
+import asyncpg
+from cachetools import TTLCache
+
+from config import DB_REPLICA_PIN_SECONDS
+from .connection import get_pool, get_read_pool
+
+_current_user: ContextVar[Optional[int]] = ContextVar("db_current_user", default=None)
+# user_id тех, кто недавно писал в базу: ключ живёт DB_REPLICA_PIN_SECONDS.
+_recent_writers: TTLCache = TTLCache(maxsize=100_000, ttl=DB_REPLICA_PIN_SECONDS)
+
+
+def set_current_user(user_id: Optional[int]) -> Token:
+    """Привязывает запросы текущей задачи к пользователю (для read-your-writes)."""
+    return _current_user.set(user_id)
+
 
-from .connection import get_pool
+def reset_current_user(token: Token) -> None:
+    _current_user.reset(token)
+
+
+def _mark_write() -> None:
+    user_id = _current_user.get()
+    if user_id is not None:
+        _recent_writers[user_id] = True
+
+
+def _read_pool():
+    user_id = _current_user.get()
+    if user_id is not None and user_id in _recent_writers:
+        return get_pool()
+    return get_read_pool()
 
 
 @asynccontextmanager
@@ -16,10 +53,71 @@ async def transaction():
     async with get_pool().acquire() as conn:
         async with conn.transaction():
             yield conn
+    _mark_write()
 
 
 @asynccontextmanager
 async def acquire():
-    """Соединение из пула без транзакции (для SELECT-запросов)."""
-    async with get_pool().acquire() as conn:
+    """Соединение без транзакции (для SELECT-запросов): реплика, если можно, иначе основная база."""
+    async with _read_pool().acquire() as conn:
         yield conn
+
+
+class UnitOfWork:
+    """Соединения на время обработки одного апдейта.
+
+    Соединение берётся из пула лениво — при первом acquire()/transaction() — и дальше
+    переиспользуется всеми блоками хендлера, поэтому апдейт делает не больше одного
+    checkout'а на пул. Возвращает соединения в пул middleware после завершения хендлера
+    (или сам хендлер через release(), если дальше идут только запросы к Telegram).
+
+    acquire() читает с реплики, пока апдейт ничего не записал; после первой транзакции
+    (или если пользователь недавно писал) чтения идут через то же соединение с основной базой.
+
+    Соединения не разделяются между задачами, поэтому параллельные запросы
+    (asyncio.gather) через один UnitOfWork делать нельзя.
+    """
+
+    def __init__(self):
+        self._stack: AsyncExitStack | None = None
+        self._conn: asyncpg.Connection | None = None
+        self._read_conn: asyncpg.Connection | None = None
+
+    async def _enter(self, pool) -> asyncpg.Connection:
+        if self._stack is None:
+            self._stack = AsyncExitStack()
+        return await self._stack.enter_async_context(pool.acquire())
+
+    async def _connection(self) -> asyncpg.Connection:
+        if self._conn is None:
+            self._conn = await self._enter(get_pool())
+        return self._conn
+
+    async def _read_connection(self) -> asyncpg.Connection:
+        if self._conn is not None:
+            return self._conn
+        if self._read_conn is None:
+            pool = _read_pool()
+            if pool is get_pool():
+                return await self._connection()
+            self._read_conn = await self._enter(pool)
+        return self._read_conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Соединение без транзакции (для SELECT-запросов)."""
+        yield await self._read_connection()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Явная граница транзакции на общем соединении; вложенные блоки становятся savepoint'ами."""
+        conn = await self._connection()
+        async with conn.transaction():
+            yield conn
+        _mark_write()
+
+    async def release(self) -> None:
+        """Возвращает соединения в пул (если они были взяты). Повторный вызов безопасен."""
+        if self._stack is not None:
+            stack, self._stack, self._conn, self._read_conn = self._stack, None, None, None
+            await stack.aclose()
@@ -6,34 +6,93 @@
 Параметры передаются как позиционные ($1, $2, ...).
 """
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Dict, Any, Optional, List, Tuple
 
 import asyncpg
+from config import REFERRAL_TREE_MAX_DEPTH
 from utils.logging_config import logger
+from .statements import register as register_statement
+
+
+# --- PREPARED STATEMENTS ---
+# Горячие запросы (выполняются почти на каждом апдейте) — через реестр именованных
+# выражений: они готовятся на каждом соединении заранее и имеют свою статистику.
+
+IS_USER_BLOCKED = register_statement(
+    "is_user_blocked", "SELECT is_blocked FROM users WHERE user_id = $1"
+)
+ACTIVE_ORDER_FOR_USER = register_statement(
+    "active_order_for_user",
+    "SELECT order_id, topic_id, action, crypto, amount_crypto, amount_rub, phone_and_bank "
+    "FROM orders WHERE user_id = $1 AND status = 'processing'",
+)
+ORDER_BY_TOPIC_ID = register_statement(
+    "order_by_topic_id", "SELECT order_id, user_id FROM orders WHERE topic_id = $1"
+)
+USER_ACTIVATED_PROMO = register_statement(
+    "user_activated_promo", "SELECT activated_promo FROM users WHERE user_id = $1"
+)
+PROMO_DISCOUNT_INFO = register_statement(
+    "promo_discount_info",
+    "SELECT discount_amount_rub, discount_type FROM promo_codes WHERE code = $1 AND is_active = TRUE",
+)
+USER_LOTTERY_INFO = register_statement(
+    "user_lottery_info", "SELECT last_lottery_play, last_free_ticket FROM users WHERE user_id = $1"
+)
+ALL_SETTINGS = register_statement("all_settings", "SELECT key, value FROM settings")
+USER_REFERRAL_INFO = register_statement(
+    "user_referral_info",
+    "SELECT user_balance(u.user_id) AS referral_balance, u.referrer_id, "
+    "COALESCE(rs.referral_count, 0) AS referral_count "
+    "FROM users u LEFT JOIN referrer_stats rs ON rs.referrer_id = u.user_id WHERE u.user_id = $1",
+)
 
 
 # --- USER QUERIES ---
 
 async def save_or_update_user(conn: asyncpg.Connection, user_id: int, username: str,
-                              full_name: str, referrer_id: Optional[int] = None) -> bool:
-    """Сохраняет нового пользователя (с реферером) или обновляет существующего.
+                              full_name: str, referrer_id: Optional[int] = None,
+                              max_tree_depth: int = REFERRAL_TREE_MAX_DEPTH) -> bool:
+    """Сохраняет нового пользователя (с реферером) или обновляет username/full_name существующего.
+    Одним запросом; строка не перезаписывается, если данные не изменились.
+    Для нового пользователя с реферером увеличивает referrer_stats.referral_count и
+    добавляет его в дерево рефералов (referral_tree) под всеми предками реферера.
     Возвращает True если пользователь новый."""
-    existing = await conn.fetchval("SELECT 1 FROM users WHERE user_id = $1", user_id)
-    is_new_user = existing is None
-
-    if is_new_user:
-        await conn.execute(
-            "INSERT INTO users (user_id, username, full_name, created_at, referrer_id) VALUES ($1, $2, $3, $4, $5)",
-            user_id, username, full_name, datetime.now(), referrer_id
-        )
-    else:
-        await conn.execute(
-            "UPDATE users SET username = $1, full_name = $2 WHERE user_id = $3",
-            username, full_name, user_id
+    # xmax = 0 только у только что вставленной строки; при неизменных данных UPDATE
+    # не выполняется и RETURNING ничего не возвращает.
+    # referrer_id приходит из deep link как есть: несуществующий реферер сохраняется как NULL,
+    # иначе вставки в referrer_stats и referral_tree упали бы на внешнем ключе вместе с самим пользователем.
+    is_new_user = await conn.fetchval(
+        """
+        WITH upserted AS (
+            INSERT INTO users (user_id, username, full_name, created_at, referrer_id)
+            VALUES ($1, $2, $3, $4, (SELECT user_id FROM users WHERE user_id = $5))
+            ON CONFLICT (user_id) DO UPDATE
+                SET username = EXCLUDED.username, full_name = EXCLUDED.full_name
+                WHERE (users.username, users.full_name) IS DISTINCT FROM (EXCLUDED.username, EXCLUDED.full_name)
+            RETURNING (xmax = 0) AS is_new, referrer_id
+        ), counted AS (
+            INSERT INTO referrer_stats (referrer_id, referral_count)
+            SELECT referrer_id, 1 FROM upserted WHERE is_new AND referrer_id IS NOT NULL
+            ON CONFLICT (referrer_id) DO UPDATE SET referral_count = referrer_stats.referral_count + 1
+        ), tree AS (
+            -- referrer_id в upserted уже проверен на существование (см. VALUES выше),
+            -- поэтому ancestor_id всегда ссылается на существующего пользователя.
+            INSERT INTO referral_tree (ancestor_id, descendant_id, depth)
+            SELECT referrer_id, $1, 1 FROM upserted WHERE is_new AND referrer_id IS NOT NULL
+            UNION ALL
+            SELECT t.ancestor_id, $1, t.depth + 1
+            FROM referral_tree t JOIN upserted u ON t.descendant_id = u.referrer_id
+            WHERE u.is_new AND t.depth < $6 AND t.ancestor_id <> $1
         )
-    logger.info(f"User {user_id} {'saved' if is_new_user else 'updated'}. Referrer ID: {referrer_id if is_new_user else 'N/A'}.")
-    return is_new_user
+        SELECT is_new FROM upserted
+        """,
+        user_id, username, full_name, datetime.now(), referrer_id, max_tree_depth
+    )
+    if is_new_user:
+        logger.info(f"User {user_id} saved. Referrer ID: {referrer_id}.")
+    return bool(is_new_user)
 
 
 async def find_all_users(conn: asyncpg.Connection) -> List[asyncpg.Record]:
@@ -106,34 +165,27 @@ async def get_order_status(conn: asyncpg.Connection, order_id: int) -> Optional[
 
 async def get_active_order_for_user(conn: asyncpg.Connection, user_id: int) -> Optional[dict]:
     """Ищет активную (в обработке) заявку пользователя."""
-    logger.info(f"DB Query: Searching for active order for user_id={user_id}")
-    row = await conn.fetchrow(
-        """
-        SELECT order_id, topic_id, action, crypto, amount_crypto, amount_rub, phone_and_bank
-        FROM orders
-        WHERE user_id = $1 AND status = 'processing'
-        """,
-        user_id
-    )
+    row = await ACTIVE_ORDER_FOR_USER.fetchrow(conn, user_id)
     if row:
-        result = {
+        return {
             'order_id': row['order_id'], 'topic_id': row['topic_id'], 'action': row['action'],
             'crypto': row['crypto'], 'amount_crypto': row['amount_crypto'],
             'total_amount': row['amount_rub'], 'user_input': row['phone_and_bank']
         }
-        logger.info(f"DB Query: Found active order for user_id={user_id}.")
-        return result
-
-    logger.info(f"DB Query: No active order found for user_id={user_id}.")
     return None
 
 
+async def get_active_order_routes(conn: asyncpg.Connection) -> List[asyncpg.Record]:
+    """Маршруты чата для всех заявок в обработке: order_id, user_id, topic_id (по возрастанию order_id)."""
+    return await conn.fetch(
+        "SELECT order_id, user_id, topic_id FROM orders "
+        "WHERE status = 'processing' AND topic_id IS NOT NULL ORDER BY order_id"
+    )
+
+
 async def get_order_by_topic_id(conn: asyncpg.Connection, topic_id: int) -> Optional[dict]:
     """Ищет заявку по ID темы в Telegram."""
-    row = await conn.fetchrow(
-        "SELECT order_id, user_id FROM orders WHERE topic_id = $1",
-        topic_id
-    )
+    row = await ORDER_BY_TOPIC_ID.fetchrow(conn, topic_id)
     if row:
         return {'order_id': row['order_id'], 'user_id': row['user_id']}
     return None
@@ -156,40 +208,61 @@ async def get_order_by_id(conn: asyncpg.Connection, order_id: int) -> Optional[d
     return None
 
 
-async def get_stale_processing_orders(conn: asyncpg.Connection, older_than_minutes: int) -> List[dict]:
-    """Возвращает заявки в статусе processing старше заданного количества минут."""
+async def auto_close_stale_orders(conn: asyncpg.Connection, older_than_minutes: int) -> List[dict]:
+    """Одним запросом закрывает (auto_closed) заявки в processing старше заданного количества минут.
+
+    Зарезервированные заявками использования промокодов возвращаются кодам.
+    Возвращает закрытые заявки — для уведомлений после коммита.
+    """
     cutoff = datetime.now() - timedelta(minutes=older_than_minutes)
     rows = await conn.fetch(
         """
-        SELECT order_id, user_id, topic_id, created_at
-        FROM orders
-        WHERE status = 'processing' AND created_at <= $1
+        WITH closed AS (
+            UPDATE orders SET status = 'auto_closed'
+            WHERE status = 'processing' AND created_at <= $1
+            RETURNING order_id, user_id, topic_id, created_at, promo_code_used
+        ), released AS (
+            UPDATE promo_codes p
+            SET uses_left = p.uses_left + GREATEST(c.n - p.overdrawn, 0),
+                overdrawn = GREATEST(p.overdrawn - c.n, 0)
+            FROM (
+                SELECT promo_code_used AS code, count(*) AS n FROM closed
+                WHERE promo_code_used IS NOT NULL GROUP BY promo_code_used
+            ) c
+            WHERE p.code = c.code
+        )
+        SELECT order_id, user_id, topic_id, created_at, promo_code_used FROM closed
         """,
         cutoff
     )
     return [
         {'order_id': r['order_id'], 'user_id': r['user_id'],
-         'topic_id': r['topic_id'], 'created_at': r['created_at']}
+         'topic_id': r['topic_id'], 'created_at': r['created_at'],
+         'promo_code_used': r['promo_code_used']}
         for r in rows
     ]
 
 
-async def get_orders_needing_warning(conn: asyncpg.Connection,
-                                     auto_close_minutes: int,
-                                     warn_before_minutes: int = 5) -> List[dict]:
-    """Возвращает заявки, которым осталось warn_before_minutes до автозакрытия и ещё не было предупреждения."""
-    warn_cutoff = datetime.now() - timedelta(minutes=auto_close_minutes - warn_before_minutes)
-    close_cutoff = datetime.now() - timedelta(minutes=auto_close_minutes)
+async def mark_orders_warned(conn: asyncpg.Connection,
+                             auto_close_minutes: int,
+                             warn_before_minutes: int = 5) -> List[dict]:
+    """Одним UPDATE помечает warned_at у заявок, которым осталось warn_before_minutes до автозакрытия.
+
+    Возвращает помеченные заявки — для предупреждений после коммита.
+    """
+    now = datetime.now()
+    warn_cutoff = now - timedelta(minutes=auto_close_minutes - warn_before_minutes)
+    close_cutoff = now - timedelta(minutes=auto_close_minutes)
     rows = await conn.fetch(
         """
-        SELECT order_id, user_id, topic_id, created_at
-        FROM orders
+        UPDATE orders SET warned_at = $3
         WHERE status = 'processing'
           AND created_at <= $1
           AND created_at > $2
           AND warned_at IS NULL
+        RETURNING order_id, user_id, topic_id, created_at
         """,
-        warn_cutoff, close_cutoff
+        warn_cutoff, close_cutoff, now
     )
     return [
         {'order_id': r['order_id'], 'user_id': r['user_id'],
@@ -198,20 +271,18 @@ async def get_orders_needing_warning(conn: asyncpg.Connection,
     ]
 
 
-async def mark_order_warned(conn: asyncpg.Connection, order_id: int) -> None:
-    """Помечает заявку как предупреждённую (warned_at = NOW())."""
-    await conn.execute(
-        "UPDATE orders SET warned_at = $1 WHERE order_id = $2",
-        datetime.now(), order_id
-    )
+async def get_orders_needing_reminder(conn: asyncpg.Connection, interval_seconds: int) -> List[dict]:
+    """Возвращает необработанные заявки, по которым пора отправить напоминание в тему.
 
-
-async def get_processing_orders(conn: asyncpg.Connection) -> List[dict]:
-    """Возвращает все заявки в статусе processing для напоминаний админам."""
+    Напоминание по заявке шлётся не чаще одного раза в interval_seconds (см. reminded_at).
+    """
+    cutoff = datetime.now() - timedelta(seconds=interval_seconds)
     rows = await conn.fetch(
         "SELECT order_id, user_id, topic_id, created_at FROM orders "
-        "WHERE status = 'processing' AND operator_responded_at IS NULL "
-        "ORDER BY created_at ASC"
+        "WHERE status = 'processing' AND operator_responded_at IS NULL AND topic_id IS NOT NULL "
+        "AND (reminded_at IS NULL OR reminded_at <= $1) "
+        "ORDER BY created_at ASC",
+        cutoff
     )
     return [
         {'order_id': r['order_id'], 'user_id': r['user_id'],
@@ -220,16 +291,26 @@ async def get_processing_orders(conn: asyncpg.Connection) -> List[dict]:
     ]
 
 
-async def mark_order_operator_responded(conn: asyncpg.Connection, order_id: int) -> None:
-    """Помечает, что оператор ответил в теме заявки (чтобы прекратить напоминания).
+async def mark_orders_reminded(conn: asyncpg.Connection, order_ids: List[int]) -> None:
+    """Запоминает время последнего напоминания по заявкам."""
+    await conn.execute(
+        "UPDATE orders SET reminded_at = $1 WHERE order_id = ANY($2::int[])",
+        datetime.now(), order_ids
+    )
+
+
+async def mark_orders_operator_responded(conn: asyncpg.Connection, order_ids: List[int]) -> int:
+    """Помечает пачку заявок, в темах которых ответил оператор (чтобы прекратить напоминания).
 
     Ставит метку только один раз — повторные ответы оператора её не сдвигают.
+    Возвращает число заявок, помеченных впервые.
     """
-    await conn.execute(
+    status = await conn.execute(
         "UPDATE orders SET operator_responded_at = $1 "
-        "WHERE order_id = $2 AND operator_responded_at IS NULL",
-        datetime.now(), order_id
+        "WHERE order_id = ANY($2::int[]) AND operator_responded_at IS NULL",
+        datetime.now(), order_ids
     )
+    return int(status.split()[-1])
 
 
 async def get_user_orders_page(conn: asyncpg.Connection, user_id: int,
@@ -257,6 +338,115 @@ async def count_user_orders(conn: asyncpg.Connection, user_id: int) -> int:
     return await conn.fetchval("SELECT COUNT(*) FROM orders WHERE user_id = $1", user_id)
 
 
+# --- SETTLEMENT ---
+
+async def settle_order(conn: asyncpg.Connection, order_id: int, referral_percentage: float) -> Optional[dict]:
+    """Подтверждает заявку одним запросом.
+
+    В одном выражении: перевод processing -> completed, отметка о погашении промокода
+    (использование зарезервировано ещё при активации), начисление рефереру процента
+    от комиссий (запись в balance_ledger),
+    запись в referral_earnings, обновление referrer_stats и месячного лидерборда.
+    Возвращает данные для уведомлений или None, если заявка уже не в обработке.
+    """
+    row = await conn.fetchrow(
+        """
+        WITH settled AS (
+            UPDATE orders SET status = 'completed'
+            WHERE order_id = $1 AND status = 'processing'
+            RETURNING order_id, user_id, topic_id, promo_code_used,
+                      COALESCE(service_commission_rub, 0) + COALESCE(network_fee_rub, 0) AS referral_base
+        ), used AS (
+            INSERT INTO used_promo_codes (user_id, promo_code, order_id, used_at)
+            SELECT user_id, promo_code_used, order_id, $3 FROM settled
+            WHERE promo_code_used IS NOT NULL
+            ON CONFLICT (user_id, promo_code) DO NOTHING
+            RETURNING promo_code
+        ), referral AS (
+            SELECT u.referrer_id, s.referral_base * $2 / 100 AS amount
+            FROM settled s JOIN users u ON u.user_id = s.user_id
+            WHERE u.referrer_id IS NOT NULL
+        ), credited AS (
+            INSERT INTO balance_ledger (user_id, kind, amount, ref_id, created_at)
+            SELECT r.referrer_id, 'earning', r.amount, s.order_id, $3 FROM referral r CROSS JOIN settled s
+        ), referrer_totals AS (
+            INSERT INTO referrer_stats (referrer_id, total_earned, last_earning_at)
+            SELECT referrer_id, amount, $3 FROM referral
+            ON CONFLICT (referrer_id) DO UPDATE
+                SET total_earned = referrer_stats.total_earned + EXCLUDED.total_earned,
+                    last_earning_at = EXCLUDED.last_earning_at
+        ), leaderboard AS (
+            INSERT INTO referral_leaderboard (period, referrer_id, total_earned, earnings_count)
+            SELECT date_trunc('month', $3::timestamp)::date, referrer_id, amount, 1 FROM referral
+            ON CONFLICT (period, referrer_id) DO UPDATE
+                SET total_earned = referral_leaderboard.total_earned + EXCLUDED.total_earned,
+                    earnings_count = referral_leaderboard.earnings_count + 1
+            RETURNING period, total_earned
+        ), earning AS (
+            INSERT INTO referral_earnings (referrer_id, referral_id, order_id, amount, created_at)
+            SELECT r.referrer_id, s.user_id, s.order_id, r.amount, $3 FROM referral r CROSS JOIN settled s
+            RETURNING referrer_id, amount
+        )
+        SELECT s.order_id, s.user_id, s.topic_id, s.promo_code_used,
+               EXISTS (SELECT 1 FROM used) AS promo_burned,
+               (SELECT referrer_id FROM earning) AS referrer_id,
+               (SELECT amount FROM earning) AS referral_amount,
+               (SELECT period FROM leaderboard) AS leaderboard_period,
+               (SELECT total_earned FROM leaderboard) AS leaderboard_total
+        FROM settled s
+        """,
+        order_id, referral_percentage, datetime.now()
+    )
+    if row and row['referrer_id']:
+        logger.info(f"User {row['referrer_id']} earned {row['referral_amount']:.2f} RUB "
+                    f"from referral {row['user_id']}'s order #{order_id}.")
+    return dict(row) if row else None
+
+
+async def reject_order(conn: asyncpg.Connection, order_id: int) -> Optional[dict]:
+    """Отменяет заявку оператором одним запросом и возвращает пользователю промокод.
+
+    Промокод возвращается, только если у пользователя нет другого активного;
+    иначе зарезервированное использование возвращается коду.
+    Возвращает данные для уведомлений или None, если заявка уже не в обработке.
+    """
+    row = await conn.fetchrow(
+        """
+        WITH rejected AS (
+            UPDATE orders SET status = 'rejected'
+            WHERE order_id = $1 AND status = 'processing'
+            RETURNING order_id, user_id, topic_id, promo_code_used
+        ), unredeemed AS (
+            DELETE FROM used_promo_codes u
+            USING rejected r
+            WHERE u.user_id = r.user_id AND u.promo_code = r.promo_code_used AND u.order_id = r.order_id
+            RETURNING u.id
+        ), refunded AS (
+            UPDATE users u SET activated_promo = r.promo_code_used
+            FROM rejected r
+            WHERE u.user_id = r.user_id AND r.promo_code_used IS NOT NULL AND u.activated_promo IS NULL
+            RETURNING u.user_id
+        ), released AS (
+            UPDATE promo_codes p
+            SET uses_left = p.uses_left + CASE WHEN p.overdrawn > 0 THEN 0 ELSE 1 END,
+                overdrawn = GREATEST(p.overdrawn - 1, 0)
+            FROM rejected r
+            WHERE p.code = r.promo_code_used AND NOT EXISTS (SELECT 1 FROM refunded)
+            RETURNING p.uses_left
+        )
+        SELECT r.order_id, r.user_id, r.topic_id, r.promo_code_used,
+               EXISTS (SELECT 1 FROM refunded) AS promo_refunded,
+               EXISTS (SELECT 1 FROM released WHERE uses_left > 0) AS promo_released
+        FROM rejected r
+        """,
+        order_id
+    )
+    if row and row['promo_code_used'] and not row['promo_refunded']:
+        logger.warning(f"Not refunding '{row['promo_code_used']}' because user {row['user_id']} has another active promo; "
+                       f"its use is released.")
+    return dict(row) if row else None
+
+
 # --- PROMO CODE QUERIES ---
 
 async def add_promo_code(conn: asyncpg.Connection, code: str, total_uses: int,
@@ -273,33 +463,95 @@ async def add_promo_code(conn: asyncpg.Connection, code: str, total_uses: int,
         return False
 
 
-async def activate_promo_for_user(conn: asyncpg.Connection, user_id: int, code: str) -> str:
-    """Активирует промокод для пользователя. Возвращает статус строкой."""
-    code = code.upper()
+async def bulk_insert_promo_codes(conn: asyncpg.Connection, codes: List[str], total_uses: int,
+                                  discount_amount: float, discount_type: str = 'percent') -> List[str]:
+    """Массово добавляет промокоды через COPY во временную таблицу.
 
-    already = await conn.fetchval(
-        "SELECT 1 FROM used_promo_codes WHERE user_id = $1 AND promo_code = $2", user_id, code
+    Коды, которые уже существуют, пропускаются на стороне БД. Возвращает реально
+    созданные коды. Вызывать внутри транзакции (временная таблица живёт до COMMIT).
+    """
+    await conn.execute("CREATE TEMP TABLE IF NOT EXISTS promo_import (code TEXT) ON COMMIT DROP")
+    await conn.execute("TRUNCATE promo_import")
+    await conn.copy_records_to_table('promo_import', records=[(code.upper(),) for code in codes])
+    rows = await conn.fetch(
+        """
+        INSERT INTO promo_codes (code, total_uses, uses_left, discount_amount_rub, discount_type, created_at)
+        SELECT DISTINCT code, $1::int, $1::int, $2, $3, $4 FROM promo_import
+        ON CONFLICT (code) DO NOTHING
+        RETURNING code
+        """,
+        total_uses, discount_amount, discount_type, datetime.now()
     )
-    if already:
-        return "already_redeemed"
+    return [r['code'] for r in rows]
 
-    active = await conn.fetchval("SELECT activated_promo FROM users WHERE user_id = $1", user_id)
-    if active:
-        return "already_active"
 
-    promo = await conn.fetchrow(
-        "SELECT uses_left, is_active, discount_amount_rub FROM promo_codes WHERE code = $1", code
+async def get_active_promo_codes(conn: asyncpg.Connection) -> List[asyncpg.Record]:
+    """Все активные промокоды для индекса в памяти; available — остались ли использования."""
+    return await conn.fetch(
+        "SELECT code, discount_amount_rub, discount_type, uses_left > 0 AS available "
+        "FROM promo_codes WHERE is_active = TRUE"
     )
-    if not promo or not promo['is_active'] or promo['uses_left'] < 1:
-        return "invalid_or_expired"
 
-    await conn.execute("UPDATE users SET activated_promo = $1 WHERE user_id = $2", code, user_id)
-    return "success"
+
+async def activate_promo_for_user(conn: asyncpg.Connection, user_id: int,
+                                  code: str) -> Tuple[str, float, str, Optional[int]]:
+    """Активирует промокод для пользователя одним запросом и резервирует одно его использование.
+
+    Возвращает (статус, сумма_скидки, тип_скидки, осталось_использований). Статус: 'success',
+    'already_redeemed', 'already_active', 'exhausted' (код выключен или использования
+    закончились), 'invalid_or_expired' (такого кода нет) или 'unknown_user'. Строки пользователя и промокода блокируются
+    (сначала пользователь, затем код), поэтому параллельные активации выстраиваются в очередь,
+    и статус считается по уже заблокированным строкам, а не по снимку начала запроса.
+    Резерв возвращается в reject_order, refund_promo_if_needed и auto_close_stale_orders
+    (сначала в счёт долга overdrawn, если он остался после миграции 012).
+    """
+    row = await conn.fetchrow(
+        """
+        WITH target AS (
+            SELECT activated_promo FROM users WHERE user_id = $1 FOR UPDATE
+        ), promo AS (
+            -- Ссылка на target заставляет заблокировать пользователя раньше кода.
+            SELECT code, is_active, uses_left, discount_amount_rub, discount_type FROM promo_codes
+            WHERE code = $2 AND EXISTS (SELECT 1 FROM target)
+            FOR UPDATE
+        ), redeemed AS (
+            SELECT 1 FROM used_promo_codes WHERE user_id = $1 AND promo_code = $2
+        ), reserved AS (
+            UPDATE promo_codes p SET uses_left = p.uses_left - 1
+            FROM promo, target t
+            WHERE p.code = promo.code AND promo.is_active AND promo.uses_left > 0 AND p.uses_left > 0
+              AND t.activated_promo IS NULL
+              AND NOT EXISTS (SELECT 1 FROM redeemed)
+            RETURNING p.code, p.uses_left
+        ), activated AS (
+            UPDATE users u SET activated_promo = r.code
+            FROM reserved r
+            WHERE u.user_id = $1
+            RETURNING u.user_id
+        )
+        SELECT
+            CASE
+                WHEN EXISTS (SELECT 1 FROM activated) THEN 'success'
+                WHEN NOT EXISTS (SELECT 1 FROM target) THEN 'unknown_user'
+                WHEN EXISTS (SELECT 1 FROM redeemed) THEN 'already_redeemed'
+                WHEN (SELECT activated_promo FROM target) IS NOT NULL THEN 'already_active'
+                WHEN NOT EXISTS (SELECT 1 FROM promo) THEN 'invalid_or_expired'
+                ELSE 'exhausted'
+            END AS status,
+            (SELECT discount_amount_rub FROM promo) AS discount_amount,
+            (SELECT discount_type FROM promo) AS discount_type,
+            (SELECT uses_left FROM reserved) AS uses_left
+        """,
+        user_id, code.upper()
+    )
+    if row['status'] != 'success':
+        return row['status'], 0.0, 'percent', None
+    return row['status'], row['discount_amount'], row['discount_type'], row['uses_left']
 
 
 async def get_user_activated_promo(conn: asyncpg.Connection, user_id: int) -> Optional[str]:
     """Возвращает активный промокод пользователя."""
-    return await conn.fetchval("SELECT activated_promo FROM users WHERE user_id = $1", user_id)
+    return await USER_ACTIVATED_PROMO.fetchval(conn, user_id)
 
 
 async def clear_user_activated_promo(conn: asyncpg.Connection, user_id: int) -> None:
@@ -309,41 +561,24 @@ async def clear_user_activated_promo(conn: asyncpg.Connection, user_id: int) ->
 
 async def get_promo_discount_info(conn: asyncpg.Connection, promo_code: str) -> Tuple[float, str]:
     """Возвращает (сумма_скидки, тип_скидки). Тип: 'percent' или 'fixed'."""
-    row = await conn.fetchrow(
-        "SELECT discount_amount_rub, discount_type FROM promo_codes WHERE code = $1 AND is_active = TRUE",
-        promo_code.upper()
-    )
+    row = await PROMO_DISCOUNT_INFO.fetchrow(conn, promo_code.upper())
     if row:
         return float(row['discount_amount_rub']), row['discount_type']
     return 0.0, 'percent'
 
 
 
-async def use_activated_promo(conn: asyncpg.Connection, user_id: int, order_id: int) -> bool:
-    """'Сжигает' промокод, привязанный к заявке."""
-    promo_code = await conn.fetchval(
-        "SELECT promo_code_used FROM orders WHERE order_id = $1", order_id
-    )
-    if not promo_code:
-        return False
-
-    await conn.execute(
-        "UPDATE promo_codes SET uses_left = uses_left - 1 WHERE code = $1", promo_code
-    )
-    await conn.execute(
-        "INSERT INTO used_promo_codes (user_id, promo_code, order_id, used_at) VALUES ($1, $2, $3, $4)",
-        user_id, promo_code, order_id, datetime.now()
-    )
-    return True
-
+async def refund_promo_if_needed(conn: asyncpg.Connection, user_id: int, order_id: int) -> Optional[str]:
+    """'Возвращает' промокод пользователю, если заявка отменена.
 
-async def refund_promo_if_needed(conn: asyncpg.Connection, user_id: int, order_id: int) -> None:
-    """'Возвращает' промокод пользователю, если заявка отменена."""
+    Если у пользователя уже есть другой активный промокод, зарезервированное
+    использование возвращается коду; тогда возвращает этот код.
+    """
     promo_to_refund = await conn.fetchval(
         "SELECT promo_code_used FROM orders WHERE order_id = $1", order_id
     )
     if not promo_to_refund:
-        return
+        return None
 
     await conn.execute(
         "DELETE FROM used_promo_codes WHERE user_id = $1 AND promo_code = $2 AND order_id = $3",
@@ -352,18 +587,26 @@ async def refund_promo_if_needed(conn: asyncpg.Connection, user_id: int, order_i
 
     existing_promo = await conn.fetchval("SELECT activated_promo FROM users WHERE user_id = $1", user_id)
     if existing_promo:
-        logger.warning(f"Not refunding '{promo_to_refund}' because user {user_id} has another active promo.")
-        return
+        # Возврат сначала гасит долг overdrawn (см. миграцию 012), потом увеличивает uses_left.
+        uses_left = await conn.fetchval(
+            "UPDATE promo_codes SET uses_left = uses_left + CASE WHEN overdrawn > 0 THEN 0 ELSE 1 END, "
+            "overdrawn = GREATEST(overdrawn - 1, 0) WHERE code = $1 RETURNING uses_left",
+            promo_to_refund
+        )
+        logger.warning(f"Not refunding '{promo_to_refund}' because user {user_id} has another active promo; "
+                       f"its use is released.")
+        return promo_to_refund if uses_left else None
 
     await conn.execute("UPDATE users SET activated_promo = $1 WHERE user_id = $2", promo_to_refund, user_id)
     logger.info(f"Refunded promo '{promo_to_refund}' to user {user_id} for rejected order #{order_id}.")
+    return None
 
 
 # --- SETTINGS ---
 
 async def get_all_settings(conn: asyncpg.Connection) -> dict:
     """Возвращает все настройки из БД в виде словаря."""
-    rows = await conn.fetch("SELECT key, value FROM settings")
+    rows = await ALL_SETTINGS.fetch(conn)
     return {r['key']: r['value'] for r in rows}
 
 
@@ -379,104 +622,353 @@ async def update_setting(conn: asyncpg.Connection, key: str, value: str) -> None
 
 async def get_user_referral_info(conn: asyncpg.Connection, user_id: int) -> dict:
     """Получает реферальную информацию о пользователе."""
-    user_data = await conn.fetchrow(
-        "SELECT referral_balance, referrer_id FROM users WHERE user_id = $1", user_id
-    )
-    balance = float(user_data['referral_balance']) if user_data else 0.0
-    referrer_id = user_data['referrer_id'] if user_data else None
+    user_data = await USER_REFERRAL_INFO.fetchrow(conn, user_id)
+    if not user_data:
+        return {'balance': 0.0, 'referrer_id': None, 'referral_count': 0}
+    return {
+        'balance': user_data['referral_balance'],
+        'referrer_id': user_data['referrer_id'],
+        'referral_count': user_data['referral_count'],
+    }
 
-    referral_count = await conn.fetchval(
-        "SELECT COUNT(user_id) FROM users WHERE referrer_id = $1", user_id
-    )
-    return {'balance': balance, 'referrer_id': referrer_id, 'referral_count': referral_count}
 
+async def create_withdrawal_request(conn: asyncpg.Connection, user_id: int, amount: float, topic_id: int) -> bool:
+    """Создает заявку на вывод и списывает сумму с баланса (запись в balance_ledger).
 
-async def add_referral_earning(conn: asyncpg.Connection, order_id: int, referral_id: int,
-                               order_amount: float, percentage: float) -> bool:
-    """Находит реферера, начисляет ему процент и записывает в историю."""
-    referrer_id = await conn.fetchval(
-        "SELECT referrer_id FROM users WHERE user_id = $1", referral_id
+    Вызывать внутри транзакции: advisory lock по user_id сериализует выводы одного
+    пользователя, чтобы один и тот же баланс нельзя было вывести дважды.
+    Возвращает False, если на балансе меньше amount.
+    """
+    await conn.execute("SELECT pg_advisory_xact_lock($1)", user_id)
+    withdrawal_id = await conn.fetchval(
+        """
+        WITH request AS (
+            INSERT INTO withdrawal_requests (user_id, amount, created_at, topic_id)
+            SELECT $1, $2, $3, $4 WHERE user_balance($1) >= $2
+            RETURNING id
+        ), debit AS (
+            INSERT INTO balance_ledger (user_id, kind, amount, ref_id, created_at)
+            SELECT $1, 'withdrawal', -$2, id, $3 FROM request
+        )
+        SELECT id FROM request
+        """,
+        user_id, amount, datetime.now(), topic_id
     )
-    if not referrer_id:
+    if withdrawal_id is None:
         return False
+    logger.info(f"User {user_id} created a withdrawal request for {amount:.2f} RUB in topic #{topic_id}.")
+    return True
 
-    earning_amount = float(order_amount) * (percentage / 100.0)
 
-    await conn.execute(
-        "UPDATE users SET referral_balance = referral_balance + $1 WHERE user_id = $2",
-        earning_amount, referrer_id
+async def get_referral_earnings_history(conn: asyncpg.Connection, user_id: int, limit: int = 10) -> List[asyncpg.Record]:
+    """Получает историю последних реферальных начислений."""
+    return await conn.fetch(
+        "SELECT amount, created_at FROM referral_earnings WHERE referrer_id = $1 ORDER BY created_at DESC LIMIT $2",
+        user_id, limit
     )
-    await conn.execute(
-        "INSERT INTO referral_earnings (referrer_id, referral_id, order_id, amount, created_at) VALUES ($1, $2, $3, $4, $5)",
-        referrer_id, referral_id, order_id, earning_amount, datetime.now()
+
+
+# --- REFERRAL LEADERBOARD ---
+
+async def get_leaderboard_top(conn: asyncpg.Connection, period: date, limit: int) -> List[asyncpg.Record]:
+    """Топ рефереров периода прямо из агрегатов (для загрузки top-K в память)."""
+    return await conn.fetch(
+        "SELECT referrer_id, total_earned FROM referral_leaderboard "
+        "WHERE period = $1 ORDER BY total_earned DESC, referrer_id LIMIT $2",
+        period, limit
     )
-    logger.info(f"User {referrer_id} earned {earning_amount:.2f} RUB from referral {referral_id}'s order #{order_id}.")
-    return True
 
 
-async def create_withdrawal_request(conn: asyncpg.Connection, user_id: int, amount: float, topic_id: int) -> bool:
-    """Создает заявку на вывод и обнуляет баланс пользователя."""
+async def rebuild_leaderboard_ranks(conn: asyncpg.Connection, period: date) -> int:
+    """Пересчитывает таблицу мест за период одним пакетом. Вызывать внутри транзакции."""
+    await conn.execute("DELETE FROM referral_leaderboard_ranks WHERE period = $1", period)
     status = await conn.execute(
-        "UPDATE users SET referral_balance = 0.0 WHERE user_id = $1", user_id
+        """
+        INSERT INTO referral_leaderboard_ranks (period, rank, referrer_id, total_earned)
+        SELECT period, ROW_NUMBER() OVER (ORDER BY total_earned DESC, referrer_id), referrer_id, total_earned
+        FROM referral_leaderboard WHERE period = $1
+        """,
+        period
     )
-    if status == "UPDATE 0":
-        return False
+    return int(status.split()[-1])
 
-    await conn.execute(
-        "INSERT INTO withdrawal_requests (user_id, amount, created_at, topic_id) VALUES ($1, $2, $3, $4)",
-        user_id, amount, datetime.now(), topic_id
+
+async def get_leaderboard_ranks_page(conn: asyncpg.Connection, period: date,
+                                     limit: int, offset: int) -> List[asyncpg.Record]:
+    return await conn.fetch(
+        """
+        SELECT r.rank, r.referrer_id, r.total_earned, u.username, u.full_name
+        FROM referral_leaderboard_ranks r JOIN users u ON u.user_id = r.referrer_id
+        WHERE r.period = $1 AND r.rank > $2
+        ORDER BY r.rank LIMIT $3
+        """,
+        period, offset, limit
     )
-    logger.info(f"User {user_id} created a withdrawal request for {amount:.2f} RUB in topic #{topic_id}.")
-    return True
 
 
-async def get_referral_earnings_history(conn: asyncpg.Connection, user_id: int, limit: int = 10) -> List[asyncpg.Record]:
-    """Получает историю последних реферальных начислений."""
+async def count_leaderboard_ranks(conn: asyncpg.Connection, period: date) -> int:
+    return await conn.fetchval(
+        "SELECT COALESCE(MAX(rank), 0) FROM referral_leaderboard_ranks WHERE period = $1", period
+    )
+
+
+async def get_leaderboard_rank(conn: asyncpg.Connection, period: date, referrer_id: int) -> Optional[asyncpg.Record]:
+    """Место и сумма пользователя за период на момент последнего пересчёта мест."""
+    return await conn.fetchrow(
+        "SELECT rank, total_earned FROM referral_leaderboard_ranks WHERE period = $1 AND referrer_id = $2",
+        period, referrer_id
+    )
+
+
+async def get_users_names(conn: asyncpg.Connection, user_ids: List[int]) -> Dict[int, asyncpg.Record]:
+    rows = await conn.fetch(
+        "SELECT user_id, username, full_name FROM users WHERE user_id = ANY($1::bigint[])", user_ids
+    )
+    return {r['user_id']: r for r in rows}
+
+
+# --- REFERRAL TREE ---
+
+async def get_referral_subtree_stats(conn: asyncpg.Connection, user_id: int) -> List[asyncpg.Record]:
+    """Сеть пользователя по уровням: число рефералов, оборот и комиссия их завершённых заявок.
+
+    Индексные выборки по referral_tree и orders(user_id, status), без рекурсии.
+    """
     return await conn.fetch(
-        "SELECT amount, created_at FROM referral_earnings WHERE referrer_id = $1 ORDER BY created_at DESC LIMIT $2",
-        user_id, limit
+        """
+        SELECT t.depth,
+               COUNT(DISTINCT t.descendant_id) AS users,
+               COUNT(o.order_id) AS orders,
+               COALESCE(SUM(o.amount_rub), 0) AS volume,
+               COALESCE(SUM(COALESCE(o.service_commission_rub, 0) + COALESCE(o.network_fee_rub, 0)), 0) AS commission
+        FROM referral_tree t
+        LEFT JOIN orders o ON o.user_id = t.descendant_id AND o.status = 'completed'
+        WHERE t.ancestor_id = $1
+        GROUP BY t.depth
+        ORDER BY t.depth
+        """,
+        user_id
     )
 
 
 # --- LOTTERY ---
 
 async def get_user_lottery_info(conn: asyncpg.Connection, user_id: int) -> dict:
-    """Получает информацию о времени последней игры и получения билета."""
-    row = await conn.fetchrow(
-        "SELECT last_lottery_play, last_free_ticket FROM users WHERE user_id = $1", user_id
-    )
+    """Получает время последней игры и последнего использованного билета."""
+    row = await USER_LOTTERY_INFO.fetchrow(conn, user_id)
     if row:
         return {'last_play': row['last_lottery_play'], 'last_ticket': row['last_free_ticket']}
     return {'last_play': None, 'last_ticket': None}
 
 
-async def grant_daily_ticket(conn: asyncpg.Connection, user_id: int) -> bool:
-    """Выдает пользователю ежедневный билет."""
-    status = await conn.execute(
-        "UPDATE users SET last_free_ticket = $1 WHERE user_id = $2", datetime.now(), user_id
+async def play_lottery(conn: asyncpg.Connection, user_id: int,
+                       prize_amount: float) -> Optional[Tuple[int, datetime]]:
+    """Разыгрывает ежедневный билет одним запросом: проверка права на игру, отметка игры,
+    запись в историю и начисление выигрыша (balance_ledger).
+
+    Билет доступен, если пользователь не играл последние 24 часа; last_free_ticket
+    фиксирует момент, когда билет был использован. Право на игру проверяется в WHERE
+    самого UPDATE, поэтому два быстрых нажатия не сыграют дважды: второе дождётся
+    блокировки строки и уже не пройдёт условие.
+    Возвращает (id игры в lottery_plays, время игры) или None, если играть нельзя.
+    """
+    now = datetime.now()
+    play_id = await conn.fetchval(
+        """
+        WITH played AS (
+            UPDATE users SET last_lottery_play = $3, last_free_ticket = $3
+            WHERE user_id = $1
+              AND (last_lottery_play IS NULL OR last_lottery_play < $3::timestamp - interval '24 hours')
+            RETURNING user_id
+        ), play AS (
+            INSERT INTO lottery_plays (user_id, prize_amount, played_at)
+            SELECT user_id, $2, $3 FROM played
+            RETURNING id
+        ), credited AS (
+            INSERT INTO balance_ledger (user_id, kind, amount, ref_id, created_at)
+            SELECT $1, 'lottery_win', $2, id, $3 FROM play WHERE $2 > 0
+        )
+        SELECT id FROM play
+        """,
+        user_id, prize_amount, now
+    )
+    if play_id is None:
+        return None
+    logger.info(f"User {user_id} played lottery and won {prize_amount:.2f} RUB.")
+    return play_id, now
+
+
+async def is_lottery_play_revealed(conn: asyncpg.Connection, play_id: int) -> bool:
+    """Показан ли уже пользователю результат игры."""
+    return await conn.fetchval(
+        "SELECT revealed_at IS NOT NULL FROM lottery_plays WHERE id = $1", play_id
+    ) or False
+
+
+async def mark_lottery_play_revealed(conn: asyncpg.Connection, play_id: int) -> None:
+    """Отмечает, что результат игры показан пользователю."""
+    await conn.execute(
+        "UPDATE lottery_plays SET revealed_at = $1 WHERE id = $2 AND revealed_at IS NULL",
+        datetime.now(), play_id
     )
-    logger.info(f"Granted daily lottery ticket for user {user_id}.")
-    return status.endswith("1")
 
 
-async def play_lottery(conn: asyncpg.Connection, user_id: int, prize_amount: float) -> bool:
-    """Помечает факт игры, начисляет выигрыш и записывает в историю."""
+# --- BALANCE LEDGER ---
+
+# Общий advisory lock свёртки и сверки checkpoint'ов (форма с двумя int4 не пересекается
+# с блокировками выводов по user_id).
+_LOCK_BALANCE_CHECKPOINTS = "SELECT pg_advisory_xact_lock(hashtext('balance_checkpoints'), 0)"
+
+async def checkpoint_balances(conn: asyncpg.Connection, settle_seconds: int) -> int:
+    """Сворачивает записи ledger в balance_checkpoints одним запросом.
+
+    Берутся только записи старше settle_seconds: id выдаются до коммита, и свежая
+    транзакция ещё может закоммитить запись с меньшим id, чем уже видимые.
+    Вызывать внутри транзакции: advisory lock не даёт ей идти одновременно со сверкой.
+    Возвращает число обновлённых checkpoint'ов.
+    """
+    await conn.execute(_LOCK_BALANCE_CHECKPOINTS)
+    cutoff = datetime.now() - timedelta(seconds=settle_seconds)
     status = await conn.execute(
-        """UPDATE users SET
-           last_lottery_play = $1,
-           referral_balance = referral_balance + $2
-           WHERE user_id = $3""",
-        datetime.now(), prize_amount, user_id
+        """
+        INSERT INTO balance_checkpoints (user_id, balance, last_entry_id, updated_at)
+        SELECT l.user_id, COALESCE(c.balance, 0) + SUM(l.amount), MAX(l.id), $2
+        FROM balance_ledger l
+        LEFT JOIN balance_checkpoints c ON c.user_id = l.user_id
+        WHERE l.id > COALESCE(c.last_entry_id, 0) AND l.created_at < $1
+        GROUP BY l.user_id, c.balance
+        ON CONFLICT (user_id) DO UPDATE
+            SET balance = EXCLUDED.balance, last_entry_id = EXCLUDED.last_entry_id,
+                updated_at = EXCLUDED.updated_at
+        """,
+        cutoff, datetime.now()
     )
-    if status == "UPDATE 0":
-        return False
+    return int(status.split()[-1])
+
+
+async def reconcile_balance_checkpoints(conn: asyncpg.Connection) -> List[asyncpg.Record]:
+    """Сверяет checkpoint'ы с полной суммой ledger до last_entry_id и чинит расхождения.
+
+    Вызывать внутри транзакции: advisory lock ждёт идущую свёртку, и запрос уже видит
+    её результат — иначе старая сумма записалась бы поверх сдвинутого last_entry_id.
+    Возвращает исправленные записи (user_id, было, стало) — для логов.
+    """
+    await conn.execute(_LOCK_BALANCE_CHECKPOINTS)
+    return await conn.fetch(
+        """
+        WITH actual AS (
+            SELECT c.user_id, c.balance AS checkpoint_balance,
+                   COALESCE(SUM(l.amount), 0) AS ledger_balance
+            FROM balance_checkpoints c
+            LEFT JOIN balance_ledger l ON l.user_id = c.user_id AND l.id <= c.last_entry_id
+            GROUP BY c.user_id, c.balance
+            HAVING c.balance <> COALESCE(SUM(l.amount), 0)
+        )
+        UPDATE balance_checkpoints c SET balance = a.ledger_balance, updated_at = $1
+        FROM actual a
+        WHERE c.user_id = a.user_id
+        RETURNING c.user_id, a.checkpoint_balance, a.ledger_balance
+        """,
+        datetime.now()
+    )
+
 
+# --- JOBS ---
+
+async def enqueue_job(conn: asyncpg.Connection, kind: str, payload: Optional[dict] = None,
+                      delay_seconds: float = 0, priority: int = 0, max_attempts: int = 5,
+                      dedup_key: Optional[str] = None) -> Optional[int]:
+    """Ставит задачу в очередь. Возвращает ID задачи или None, если задача с таким dedup_key уже есть."""
+    return await conn.fetchval(
+        """INSERT INTO jobs (kind, payload, run_at, priority, max_attempts, dedup_key, created_at)
+           VALUES ($1, $2, $3, $4, $5, $6, $7)
+           ON CONFLICT (dedup_key) DO NOTHING
+           RETURNING id""",
+        kind, payload or {}, datetime.now() + timedelta(seconds=delay_seconds),
+        priority, max_attempts, dedup_key, datetime.now()
+    )
+
+
+async def claim_jobs(conn: asyncpg.Connection, limit: int, lease_seconds: int) -> List[dict]:
+    """Забирает пачку готовых к выполнению задач (FOR UPDATE SKIP LOCKED) и берёт их в аренду.
+
+    Несколько воркеров (в том числе в разных репликах) не получат одну и ту же задачу.
+    """
+    now = datetime.now()
+    rows = await conn.fetch(
+        """
+        UPDATE jobs SET locked_until = $2, attempts = attempts + 1
+        WHERE id IN (
+            SELECT id FROM jobs
+            WHERE status = 'pending' AND run_at <= $1 AND attempts < max_attempts
+              AND (locked_until IS NULL OR locked_until < $1)
+            ORDER BY priority DESC, run_at ASC
+            LIMIT $3
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, kind, payload, attempts, max_attempts
+        """,
+        now, now + timedelta(seconds=lease_seconds), limit
+    )
+    return [
+        {'id': r['id'], 'kind': r['kind'], 'payload': r['payload'],
+         'attempts': r['attempts'], 'max_attempts': r['max_attempts']}
+        for r in rows
+    ]
+
+
+async def fail_expired_jobs(conn: asyncpg.Connection) -> List[dict]:
+    """Разбирает задачи, у которых истекла аренда на последней попытке (воркер упал или завис).
+
+    Обычные задачи помечаются 'failed' и остаются для разбора; периодические
+    (dedup_key = kind) не умирают, а начинают попытки заново. Возвращает проваленные задачи.
+    """
+    rows = await conn.fetch(
+        """
+        UPDATE jobs SET
+            status = CASE WHEN dedup_key = kind THEN 'pending' ELSE 'failed' END,
+            attempts = CASE WHEN dedup_key = kind THEN 0 ELSE attempts END,
+            locked_until = NULL,
+            last_error = 'Lease expired on attempt ' || attempts
+        WHERE id IN (
+            SELECT id FROM jobs
+            WHERE status = 'pending' AND attempts >= max_attempts AND locked_until < $1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, kind, status, attempts
+        """,
+        datetime.now()
+    )
+    return [{'id': r['id'], 'kind': r['kind'], 'attempts': r['attempts']} for r in rows if r['status'] == 'failed']
+
+
+async def complete_job(conn: asyncpg.Connection, job_id: int) -> None:
+    """Удаляет успешно выполненную задачу."""
+    await conn.execute("DELETE FROM jobs WHERE id = $1", job_id)
+
+
+async def reschedule_job(conn: asyncpg.Connection, job_id: int, delay_seconds: float) -> None:
+    """Переносит периодическую задачу на следующий запуск и снимает аренду."""
     await conn.execute(
-        "INSERT INTO lottery_plays (user_id, prize_amount, played_at) VALUES ($1, $2, $3)",
-        user_id, prize_amount, datetime.now()
+        "UPDATE jobs SET run_at = $1, attempts = 0, locked_until = NULL, last_error = NULL WHERE id = $2",
+        datetime.now() + timedelta(seconds=delay_seconds), job_id
+    )
+
+
+async def retry_job(conn: asyncpg.Connection, job_id: int, delay_seconds: float, error: str) -> None:
+    """Возвращает задачу в очередь после ошибки с задержкой (backoff)."""
+    await conn.execute(
+        "UPDATE jobs SET run_at = $1, locked_until = NULL, last_error = $2 WHERE id = $3",
+        datetime.now() + timedelta(seconds=delay_seconds), error, job_id
+    )
+
+
+async def fail_job(conn: asyncpg.Connection, job_id: int, error: str) -> None:
+    """Помечает задачу как окончательно проваленную (исчерпаны попытки)."""
+    await conn.execute(
+        "UPDATE jobs SET status = 'failed', locked_until = NULL, last_error = $1 WHERE id = $2",
+        error, job_id
     )
-    logger.info(f"User {user_id} played lottery and won {prize_amount:.2f} RUB.")
-    return True
 
 
 # --- ADMIN STATISTICS ---
@@ -535,7 +1027,7 @@ async def unblock_user(conn: asyncpg.Connection, user_id: int) -> None:
 
 
 async def is_user_blocked(conn: asyncpg.Connection, user_id: int) -> bool:
-    val = await conn.fetchval("SELECT is_blocked FROM users WHERE user_id = $1", user_id)
+    val = await IS_USER_BLOCKED.fetchval(conn, user_id)
     return bool(val)
 
 
@@ -549,18 +1041,17 @@ async def get_user_info(conn: asyncpg.Connection, user_id: int) -> asyncpg.Recor
 async def get_admin_user_profile(conn: asyncpg.Connection, user_id: int) -> dict | None:
     user = await conn.fetchrow(
         "SELECT user_id, username, full_name, created_at, is_blocked, "
-        "referral_balance, referrer_id, activated_promo, last_lottery_play "
+        "user_balance(user_id) AS referral_balance, referrer_id, activated_promo, last_lottery_play "
         "FROM users WHERE user_id = $1",
         user_id,
     )
     if not user:
         return None
 
-    referral_count = await conn.fetchval(
-        "SELECT COUNT(*) FROM users WHERE referrer_id = $1", user_id)
-
-    total_earned = await conn.fetchval(
-        "SELECT COALESCE(SUM(amount), 0) FROM referral_earnings WHERE referrer_id = $1", user_id)
+    referral_stats = await conn.fetchrow(
+        "SELECT referral_count, total_earned, last_earning_at FROM referrer_stats WHERE referrer_id = $1",
+        user_id,
+    )
 
     referrer = None
     if user['referrer_id']:
@@ -602,8 +1093,9 @@ async def get_admin_user_profile(conn: asyncpg.Connection, user_id: int) -> dict
 
     return {
         'user': user,
-        'referral_count': referral_count,
-        'total_earned': total_earned,
+        'referral_count': referral_stats['referral_count'] if referral_stats else 0,
+        'total_earned': referral_stats['total_earned'] if referral_stats else 0.0,
+        'last_earning_at': referral_stats['last_earning_at'] if referral_stats else None,
         'referrer': referrer,
         'orders': orders_stats,
         'withdrawals': withdrawals,
@@ -0,0 +1,168 @@
+"""
+Обёртка над asyncpg.Pool со сбором метрик.
+
+Считает время ожидания соединения, время удержания по месту вызова и число занятых/
+свободных соединений; пишет предупреждение, если соединение держат дольше порога.
+В адаптивном режиме лимит одновременно выданных соединений растёт при устойчивом
+ожидании и плавно возвращается к базовому, когда очередь пропадает.
+"""
+
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import asyncpg
+from loguru import logger
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_SKIP_FILES = (_PACKAGE_DIR, "contextlib")
+
+# Сколько последних ожиданий учитывает адаптивный режим.
+_ADAPTIVE_WINDOW = 50
+
+
+def _call_site() -> str:
+    """Первое место вызова за пределами utils/database и contextlib: 'module:function:line'."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not any(part in filename for part in _SKIP_FILES):
+            module = os.path.splitext(os.path.basename(filename))[0]
+            return f"{module}:{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "unknown"
+
+
+class _ResizableLimiter:
+    """Семафор, лимит которого можно менять на лету."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        if self.in_use < self.limit and not self._waiters:
+            self.in_use += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Слот уже выдали, но задачу отменили — возвращаем его.
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(fut)
+                except ValueError:
+                    # _wake уже вынул отменённое ожидание из очереди.
+                    pass
+            raise
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self._wake()
+
+    def resize(self, limit: int) -> None:
+        self.limit = limit
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_use < self.limit:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_use += 1
+                fut.set_result(None)
+
+
+class InstrumentedPool:
+    def __init__(self, pool: asyncpg.Pool, max_size: int, hold_warn_seconds: float,
+                 adaptive_max_size: int | None = None, adaptive_wait_ms: float = 20.0):
+        self._pool = pool
+        self._base_size = max_size
+        self._limiter = _ResizableLimiter(max_size)
+        self._hold_warn = hold_warn_seconds
+        self._adaptive_max = adaptive_max_size
+        self._adaptive_wait = adaptive_wait_ms / 1000
+        self._recent_waits: deque[float] = deque(maxlen=_ADAPTIVE_WINDOW)
+        self._acquisitions = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._holds: dict[str, list] = {}  # site -> [count, total, max]
+
+    @property
+    def pool(self) -> asyncpg.Pool:
+        return self._pool
+
+    @asynccontextmanager
+    async def acquire(self):
+        site = _call_site()
+        started = time.monotonic()
+        await self._limiter.acquire()
+        try:
+            async with self._pool.acquire() as conn:
+                acquired = time.monotonic()
+                self._record_wait(acquired - started)
+                try:
+                    yield conn
+                finally:
+                    self._record_hold(site, time.monotonic() - acquired)
+        finally:
+            self._limiter.release()
+
+    async def close(self) -> None:
+        await self._pool.close()
+
+    def _record_wait(self, waited: float) -> None:
+        self._acquisitions += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        self._recent_waits.append(waited)
+        if self._adaptive_max and self._acquisitions % _ADAPTIVE_WINDOW == 0:
+            self._adapt()
+
+    def _record_hold(self, site: str, held: float) -> None:
+        entry = self._holds.setdefault(site, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += held
+        entry[2] = max(entry[2], held)
+        if held > self._hold_warn:
+            logger.warning(f"DB connection held for {held:.2f}s at [{site}]")
+
+    def _adapt(self) -> None:
+        avg_wait = sum(self._recent_waits) / len(self._recent_waits)
+        limit = self._limiter.limit
+        if avg_wait > self._adaptive_wait and limit < self._adaptive_max:
+            self._limiter.resize(limit + 1)
+            logger.info(f"DB pool grown to {limit + 1} (avg acquire wait {avg_wait * 1000:.1f}ms)")
+        elif avg_wait < self._adaptive_wait / 10 and limit > self._base_size:
+            self._limiter.resize(limit - 1)
+            logger.info(f"DB pool shrunk to {limit - 1} (avg acquire wait {avg_wait * 1000:.1f}ms)")
+
+    def stats(self) -> dict:
+        """Снимок метрик пула."""
+        acquisitions = self._acquisitions
+        holds = sorted(self._holds.items(), key=lambda kv: kv[1][1], reverse=True)
+        return {
+            'limit': self._limiter.limit,
+            'size': self._pool.get_size(),
+            'idle': self._pool.get_idle_size(),
+            'in_use': self._limiter.in_use,
+            'waiting': self._limiter.waiting,
+            'acquisitions': acquisitions,
+            'wait_avg_ms': (self._wait_total / acquisitions * 1000) if acquisitions else 0.0,
+            'wait_max_ms': self._wait_max * 1000,
+            'holds': [
+                {'site': site, 'count': count, 'avg_ms': total / count * 1000, 'max_ms': peak * 1000}
+                for site, (count, total, peak) in holds
+            ],
+        }
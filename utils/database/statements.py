@@ -0,0 +1,136 @@
+"""
+Реестр именованных SQL-выражений для горячих путей db_queries.
+
+Выражение регистрируется один раз на уровне модуля:
+
+    IS_USER_BLOCKED = register("is_user_blocked", "SELECT is_blocked FROM users WHERE user_id = $1")
+
+и вызывается через тонкий API: await IS_USER_BLOCKED.fetchval(conn, user_id).
+
+Все зарегистрированные выражения подготавливаются на каждом соединении при его создании
+(prepare_all из init-хука пула). По каждому выражению считаются вызовы, ошибки и время.
+
+Режим совместимости с pgbouncer (transaction pooling): серверные prepared statements
+не создаются, запросы уходят обычным текстом. Если подготовка или вызов падают из-за
+отсутствия prepared statement на сервере, реестр сам переключается в этот режим и
+сообщает об этом подписчикам on_fallback (пул выключает неявный кэш выражений asyncpg).
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+import asyncpg
+from loguru import logger
+
+# Ошибки, по которым понятно, что серверные prepared statements недоступны (pgbouncer и т.п.).
+_PREPARED_UNAVAILABLE = (
+    asyncpg.exceptions.InvalidSQLStatementNameError,
+    asyncpg.exceptions.DuplicatePreparedStatementError,
+)
+
+_registry: dict[str, "Statement"] = {}
+_server_prepared = True
+_fallback_listeners: list[Callable[[], None]] = []
+
+
+@dataclass(eq=False)
+class Statement:
+    name: str
+    sql: str
+    calls: int = field(default=0, init=False)
+    errors: int = field(default=0, init=False)
+    total_time: float = field(default=0.0, init=False)
+    max_time: float = field(default=0.0, init=False)
+
+    def _prepared_on(self, conn) -> Optional[asyncpg.prepared_stmt.PreparedStatement]:
+        if not _server_prepared:
+            return None
+        prepared = getattr(conn, '_prepared', None)
+        return prepared.get(self.name) if prepared else None
+
+    async def _run(self, conn, method: str, *args) -> Any:
+        started = time.perf_counter()
+        try:
+            stmt = self._prepared_on(conn)
+            if stmt is not None:
+                try:
+                    if method == 'execute':
+                        await stmt.fetch(*args)
+                        return stmt.get_statusmsg()
+                    return await getattr(stmt, method)(*args)
+                except _PREPARED_UNAVAILABLE as e:
+                    _disable_server_prepared(e)
+            return await getattr(conn, method)(self.sql, *args)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.calls += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+
+    async def fetch(self, conn, *args) -> list[asyncpg.Record]:
+        return await self._run(conn, 'fetch', *args)
+
+    async def fetchrow(self, conn, *args) -> Optional[asyncpg.Record]:
+        return await self._run(conn, 'fetchrow', *args)
+
+    async def fetchval(self, conn, *args) -> Any:
+        return await self._run(conn, 'fetchval', *args)
+
+    async def execute(self, conn, *args) -> str:
+        """Возвращает статус команды ('UPDATE 1' и т.п.), как asyncpg.Connection.execute."""
+        return await self._run(conn, 'execute', *args)
+
+
+def register(name: str, sql: str) -> Statement:
+    if name in _registry:
+        raise ValueError(f"Statement '{name}' is already registered")
+    stmt = Statement(name=name, sql=sql)
+    _registry[name] = stmt
+    return stmt
+
+
+def configure(server_prepared: bool) -> None:
+    """Включает/выключает серверные prepared statements (False — режим pgbouncer)."""
+    global _server_prepared
+    _server_prepared = server_prepared
+
+
+def on_fallback(listener: Callable[[], None]) -> None:
+    """Подписывает listener на автоматическое переключение в режим pgbouncer (вызывается один раз)."""
+    _fallback_listeners.append(listener)
+
+
+def _disable_server_prepared(error: Exception) -> None:
+    global _server_prepared
+    if _server_prepared:
+        _server_prepared = False
+        logger.warning(f"Server-side prepared statements are unavailable, falling back to plain queries: {error}")
+        for listener in _fallback_listeners:
+            listener()
+
+
+async def prepare_all(conn) -> dict:
+    """Подготавливает все выражения реестра на соединении. Возвращает {name: PreparedStatement}."""
+    if not _server_prepared:
+        return {}
+    try:
+        return {stmt.name: await conn.prepare(stmt.sql) for stmt in _registry.values()}
+    except _PREPARED_UNAVAILABLE as e:
+        _disable_server_prepared(e)
+        return {}
+
+
+def stats() -> list[dict]:
+    """Метрики по выражениям, отсортированные по суммарному времени."""
+    return [
+        {
+            'name': s.name, 'calls': s.calls, 'errors': s.errors,
+            'avg_ms': (s.total_time / s.calls * 1000) if s.calls else 0.0,
+            'max_ms': s.max_time * 1000,
+        }
+        for s in sorted(_registry.values(), key=lambda s: s.total_time, reverse=True)
+    ]
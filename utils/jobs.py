@@ -0,0 +1,151 @@
+"""
+Очередь отложенных задач поверх таблицы jobs в PostgreSQL.
+
+Задачи переживают перезапуск бота и разбираются воркерами в любом количестве реплик:
+пачка забирается через FOR UPDATE SKIP LOCKED и берётся в аренду (locked_until).
+Ошибки повторяются с экспоненциальной задержкой, одновременно выполняется
+не больше JOBS_CONCURRENCY задач на процесс. Задача, исчерпавшая попытки, больше
+не забирается и помечается 'failed' — в том числе если её воркер упал и аренда истекла.
+
+Обработчик регистрируется декоратором и получает (bot, payload):
+
+    @jobs.job("order_greeting")
+    async def send_greeting(bot: Bot, payload: dict) -> None: ...
+
+Периодические задачи (interval=...) живут в таблице одной строкой (dedup_key = kind)
+и после выполнения переносятся на следующий запуск, а не удаляются.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import Bot
+
+from config import (
+    JOBS_CONCURRENCY, JOBS_LEASE_SECONDS, JOBS_POLL_INTERVAL_SECONDS,
+    JOBS_RETRY_BASE_SECONDS, JOBS_RETRY_MAX_SECONDS,
+)
+from utils.logging_config import logger
+from utils.database.db_helpers import transaction
+from utils.database.db_queries import (
+    claim_jobs, complete_job, enqueue_job, fail_expired_jobs, fail_job, reschedule_job, retry_job,
+)
+
+JobHandler = Callable[[Bot, dict], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class _JobSpec:
+    handler: JobHandler
+    interval: Optional[float]
+
+
+_registry: dict[str, _JobSpec] = {}
+
+
+def job(kind: str, interval: Optional[float] = None) -> Callable[[JobHandler], JobHandler]:
+    """Регистрирует обработчик задачи. interval (сек) делает задачу периодической."""
+    def decorator(func: JobHandler) -> JobHandler:
+        if kind in _registry:
+            raise ValueError(f"Job kind '{kind}' is already registered")
+        _registry[kind] = _JobSpec(handler=func, interval=interval)
+        return func
+    return decorator
+
+
+async def enqueue(conn, kind: str, payload: Optional[dict[str, Any]] = None,
+                  delay_seconds: float = 0, priority: int = 0,
+                  dedup_key: Optional[str] = None) -> Optional[int]:
+    """Ставит задачу в очередь в рамках переданного соединения/транзакции.
+
+    Если задача с таким dedup_key уже в очереди, новая не ставится (возвращается None).
+    """
+    if kind not in _registry:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    return await enqueue_job(conn, kind, payload, delay_seconds=delay_seconds, priority=priority,
+                             dedup_key=dedup_key)
+
+
+async def ensure_periodic() -> None:
+    """Создаёт строки периодических задач, если их ещё нет (безопасно при нескольких репликах)."""
+    async with transaction() as conn:
+        for kind, spec in _registry.items():
+            if spec.interval is not None:
+                await enqueue_job(conn, kind, dedup_key=kind)
+
+
+def _retry_delay(attempt: int) -> float:
+    return min(JOBS_RETRY_BASE_SECONDS * 2 ** (attempt - 1), JOBS_RETRY_MAX_SECONDS)
+
+
+async def _run_job(bot: Bot, item: dict) -> None:
+    job_id, kind = item['id'], item['kind']
+    spec = _registry.get(kind)
+    try:
+        if spec is None:
+            raise LookupError(f"No handler registered for job kind '{kind}'")
+        await spec.handler(bot, item['payload'])
+    except asyncio.CancelledError:
+        # Аренда истечёт сама, задачу подхватит следующий воркер.
+        raise
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"[:1000]
+        try:
+            async with transaction() as conn:
+                if spec is not None and spec.interval is not None:
+                    await reschedule_job(conn, job_id, spec.interval)
+                elif spec is None or item['attempts'] >= item['max_attempts']:
+                    await fail_job(conn, job_id, error)
+                else:
+                    await retry_job(conn, job_id, _retry_delay(item['attempts']), error)
+        except Exception as db_e:
+            logger.error(f"Could not record failure of job #{job_id} ({kind}): {db_e}", exc_info=True)
+        logger.warning(f"Job #{job_id} ({kind}) failed on attempt {item['attempts']}: {error}")
+        return
+
+    try:
+        async with transaction() as conn:
+            if spec.interval is not None:
+                await reschedule_job(conn, job_id, spec.interval)
+            else:
+                await complete_job(conn, job_id)
+    except Exception as e:
+        logger.error(f"Could not complete job #{job_id} ({kind}): {e}", exc_info=True)
+
+
+async def run_worker(bot: Bot) -> None:
+    """Бесконечный цикл воркера: забирает готовые задачи и выполняет их параллельно."""
+    running: set[asyncio.Task] = set()
+    try:
+        while True:
+            free = JOBS_CONCURRENCY - len(running)
+            claimed = []
+            if free > 0:
+                try:
+                    async with transaction() as conn:
+                        expired = await fail_expired_jobs(conn)
+                        claimed = await claim_jobs(conn, free, JOBS_LEASE_SECONDS)
+                except Exception as e:
+                    logger.error(f"jobs worker: failed to claim jobs: {e}", exc_info=True)
+                else:
+                    for item in expired:
+                        logger.warning(f"Job #{item['id']} ({item['kind']}) failed: "
+                                       f"lease expired on attempt {item['attempts']}")
+
+            for item in claimed:
+                task = asyncio.create_task(_run_job(bot, item))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+            if claimed and len(claimed) == free:
+                # Очередь, вероятно, не пуста — ждём освобождения слота, а не полный интервал.
+                await asyncio.wait(running, timeout=JOBS_POLL_INTERVAL_SECONDS,
+                                   return_when=asyncio.FIRST_COMPLETED)
+            elif not claimed:
+                await asyncio.sleep(JOBS_POLL_INTERVAL_SECONDS)
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
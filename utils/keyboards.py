@@ -1,7 +1,7 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from .callbacks import CryptoInputSwitch, CryptoSelection, RubInputSwitch, OrdersPage, AdminOrderAction, CancelOrder, AdminManageAction, UserBlockAction
+from .callbacks import CryptoInputSwitch, CryptoSelection, RubInputSwitch, OrdersPage, AdminOrderAction, CancelOrder, AdminManageAction, UserBlockAction, LeaderboardPage, UserNetworkView
 
 
 def get_main_keyboard() -> InlineKeyboardMarkup:
@@ -99,6 +99,7 @@ def get_orders_pagination_keyboard(page: int, total: int, per_page: int = 5) ->
 def get_profile_keyboard(balance: float, min_withdrawal: int) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="📈 Мои начисления", callback_data="ref_earnings_history")
+    builder.button(text="🏆 Топ рефереров месяца", callback_data="ref_leaderboard")
     if balance >= min_withdrawal:
         builder.button(text=f"💸 Вывести {balance:,.2f} RUB", callback_data="ref_withdraw")
     builder.button(text="⬅️ Назад в главное меню", callback_data="back_to_main_menu")
@@ -119,9 +120,11 @@ def get_admin_keyboard() -> InlineKeyboardMarkup:
     builder.button(text="📊 Статистика", callback_data="admin_stats")
     builder.button(text="📢 Сделать рассылку", callback_data="admin_broadcast")
     builder.button(text="🎁 Создать промокод", callback_data="admin_create_promo")
+    builder.button(text="📦 Сгенерировать пачку промокодов", callback_data="admin_bulk_promo")
     builder.button(text="⚙️ Управление реквизитами", callback_data="admin_settings")
     builder.button(text="👥 Управление админами", callback_data="admin_manage_admins")
     builder.button(text="🚫 Пользователи", callback_data="admin_manage_users")
+    builder.button(text="🏆 Лидерборд рефереров", callback_data=LeaderboardPage(page=0).pack())
     builder.adjust(1)
     return builder.as_markup()
 
@@ -147,6 +150,7 @@ def get_user_info_keyboard(user_id: int, is_blocked: bool) -> InlineKeyboardMark
         builder.button(text="✅ Разблокировать", callback_data=UserBlockAction(action="unblock", user_id=user_id).pack())
     else:
         builder.button(text="🚫 Заблокировать", callback_data=UserBlockAction(action="block", user_id=user_id).pack())
+    builder.button(text="🌳 Сеть рефералов", callback_data=UserNetworkView(user_id=user_id).pack())
     builder.button(text="⬅️ Назад в админ-панель", callback_data="back_to_admin_panel")
     builder.adjust(1)
     return builder.as_markup()
@@ -165,6 +169,17 @@ def get_admin_order_keyboard(order_id: int, user_id: int) -> InlineKeyboardMarku
     return builder.as_markup()
 
 
+def get_leaderboard_pagination_keyboard(page: int, total: int, per_page: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    if page > 0:
+        builder.button(text="‹ Назад", callback_data=LeaderboardPage(page=page - 1).pack())
+    if (page + 1) * per_page < total:
+        builder.button(text="Вперёд ›", callback_data=LeaderboardPage(page=page + 1).pack())
+    builder.button(text="⬅️ Назад в админ-панель", callback_data="back_to_admin_panel")
+    builder.adjust(2, 1)
+    return builder.as_markup()
+
+
 def back_to_admin_panel() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="⬅️ Назад в админ-панель", callback_data="back_to_admin_panel")
@@ -0,0 +1,21 @@
+"""
+In-memory cache of recently seen users for /start.
+
+Holds (username, full_name) per user_id as last written to the DB. A repeat
+visitor with unchanged data is already in the table, so the upsert is skipped.
+Entries expire so that a user edited by another replica is eventually rewritten.
+"""
+
+from cachetools import TTLCache
+
+from config import KNOWN_USERS_CACHE_SIZE, KNOWN_USERS_CACHE_TTL_SECONDS
+
+_known: TTLCache = TTLCache(maxsize=KNOWN_USERS_CACHE_SIZE, ttl=KNOWN_USERS_CACHE_TTL_SECONDS)
+
+
+def is_unchanged(user_id: int, username: str, full_name: str) -> bool:
+    return _known.get(user_id) == (username, full_name)
+
+
+def remember(user_id: int, username: str, full_name: str) -> None:
+    _known[user_id] = (username, full_name)
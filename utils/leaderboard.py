@@ -0,0 +1,73 @@
+"""
+In-memory top-K of the monthly referral leaderboard.
+
+Holds the K best referrers of the current month (referrer_id -> month total).
+Settlement returns the referrer's new month total, so record() keeps the
+structure exact without re-reading the table. The whole structure is reloaded
+from referral_leaderboard at startup, on month change and periodically, so
+earnings settled by other replicas show up too.
+
+Full rankings (pagination, "your place") come from referral_leaderboard_ranks,
+which the leaderboard_ranks job rebuilds in batches.
+"""
+
+import asyncio
+from datetime import date
+from decimal import Decimal
+
+from config import LEADERBOARD_REFRESH_SECONDS, LEADERBOARD_TOP_K
+from utils.logging_config import logger
+from utils.database.db_helpers import acquire
+from utils.database.db_queries import get_leaderboard_top
+
+_period: date | None = None
+_totals: dict[int, Decimal] = {}
+
+
+def current_period() -> date:
+    return date.today().replace(day=1)
+
+
+def load(period: date, rows) -> None:
+    global _period, _totals
+    _period = period
+    _totals = {r['referrer_id']: r['total_earned'] for r in rows}
+
+
+def record(period: date, referrer_id: int, total: Decimal) -> None:
+    """Учитывает новый итог реферера за период (значение из settle_order)."""
+    global _period, _totals
+    if period != _period:
+        if _period is not None and period < _period:
+            return
+        _period, _totals = period, {}
+    if referrer_id not in _totals and len(_totals) >= LEADERBOARD_TOP_K:
+        weakest = min(_totals, key=_totals.get)
+        if total <= _totals[weakest]:
+            return
+        del _totals[weakest]
+    _totals[referrer_id] = total
+
+
+def top(limit: int) -> list[tuple[int, Decimal]]:
+    """[(referrer_id, сумма)] лучших за текущий месяц, по убыванию."""
+    if _period != current_period():
+        return []
+    ranked = sorted(_totals.items(), key=lambda kv: (-kv[1], kv[0]))
+    return ranked[:limit]
+
+
+async def refresh() -> None:
+    period = current_period()
+    async with acquire() as conn:
+        rows = await get_leaderboard_top(conn, period, LEADERBOARD_TOP_K)
+    load(period, rows)
+
+
+async def run_refresh_loop() -> None:
+    while True:
+        await asyncio.sleep(LEADERBOARD_REFRESH_SECONDS)
+        try:
+            await refresh()
+        except Exception as e:
+            logger.error(f"Failed to refresh referral leaderboard: {e}", exc_info=True)
@@ -0,0 +1,66 @@
+"""
+Buffering of Telegram albums (media groups) for batch relaying.
+
+Parts of one album arrive as separate updates a few milliseconds apart. The
+collector groups them by media_group_id for a short window and hands the whole
+album to a relay callback at once, so it can be sent with a single
+forwardMessages/copyMessages call instead of one call per part.
+
+Ordering is kept per lane (a conversation direction): an album waits for the
+previous album in its lane, and single messages call wait() so they don't
+overtake an album that is still being collected.
+"""
+
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, Hashable
+
+from aiogram.types import Message
+
+from utils.logging_config import logger
+
+AlbumRelay = Callable[[list[Message]], Awaitable[None]]
+
+
+class MediaGroupCollector:
+    def __init__(self, window: float):
+        """
+        :param window: сколько секунд после первой части ждать остальные части альбома.
+        """
+        self._window = window
+        self._groups: dict[tuple[Hashable, str], list[Message]] = {}
+        # lane -> задача отправки последнего альбома в этой полосе
+        self._lanes: dict[Hashable, asyncio.Task] = {}
+
+    def add(self, lane: Hashable, message: Message, relay: AlbumRelay) -> None:
+        """Добавляет часть альбома. Первая часть запускает отправку всего альбома через relay."""
+        key = (lane, message.media_group_id)
+        parts = self._groups.get(key)
+        if parts is not None:
+            parts.append(message)
+            return
+        self._groups[key] = [message]
+        task = asyncio.create_task(self._relay(key, relay, self._lanes.get(lane)))
+        self._lanes[lane] = task
+        task.add_done_callback(partial(self._forget, lane))
+
+    async def wait(self, lane: Hashable) -> None:
+        """Ждёт, пока уйдут альбомы, начатые в этой полосе раньше."""
+        task = self._lanes.get(lane)
+        if task is not None:
+            await asyncio.wait([task])
+
+    async def _relay(self, key: tuple[Hashable, str], relay: AlbumRelay,
+                     previous: asyncio.Task | None) -> None:
+        await asyncio.sleep(self._window)
+        if previous is not None:
+            await asyncio.wait([previous])
+        parts = sorted(self._groups.pop(key), key=lambda m: m.message_id)
+        try:
+            await relay(parts)
+        except Exception as e:
+            logger.error(f"Failed to relay media group {key[1]}: {e}", exc_info=True)
+
+    def _forget(self, lane: Hashable, task: asyncio.Task) -> None:
+        if self._lanes.get(lane) is task:
+            del self._lanes[lane]
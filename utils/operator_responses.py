@@ -0,0 +1,58 @@
+"""
+Coalesced "operator responded" marks for orders.
+
+Only the first operator message in an order's topic matters: it stops the
+reminders. Order ids already marked by this process are remembered, so later
+messages cost nothing. New marks are queued and flushed every
+OPERATOR_RESPONSE_FLUSH_SECONDS with one UPDATE for the whole batch. A failed
+flush puts the batch back for the next tick.
+"""
+
+import asyncio
+
+from cachetools import LRUCache
+
+from config import OPERATOR_RESPONSE_FLUSH_SECONDS
+from utils.logging_config import logger
+from utils.database.db_helpers import transaction
+from utils.database.db_queries import mark_orders_operator_responded
+
+_responded: LRUCache = LRUCache(maxsize=50_000)
+_pending: set[int] = set()
+
+
+def mark(order_id: int) -> None:
+    """Отмечает ответ оператора; в БД уйдёт только первая отметка по заявке."""
+    if order_id in _responded:
+        return
+    _responded[order_id] = True
+    _pending.add(order_id)
+
+
+async def flush() -> None:
+    global _pending
+    if not _pending:
+        return
+    batch, _pending = _pending, set()
+    try:
+        async with transaction() as conn:
+            await mark_orders_operator_responded(conn, list(batch))
+    except Exception:
+        _pending |= batch
+        raise
+
+
+async def run_flush_loop() -> None:
+    try:
+        while True:
+            await asyncio.sleep(OPERATOR_RESPONSE_FLUSH_SECONDS)
+            try:
+                await flush()
+            except Exception as e:
+                logger.error(f"Failed to flush operator responses: {e}", exc_info=True)
+    finally:
+        # При остановке не теряем накопленные отметки.
+        try:
+            await flush()
+        except Exception as e:
+            logger.warning(f"Could not flush operator responses on shutdown: {e}")
@@ -0,0 +1,78 @@
+"""
+In-memory routing table for the user <-> operator chat proxy.
+
+Two directions:
+  user_id  -> (order_id, topic_id) of the user's active (processing) order;
+  topic_id -> (order_id, user_id) of the order the support topic belongs to.
+
+A topic belongs to one order for its whole life, so the topic direction never
+goes stale and is only bounded in size. The user direction is filled when an
+order is created and evicted when its status leaves 'processing'. Both are
+warmed from the DB at startup; the active routes are then periodically reloaded
+so orders created or closed by another replica converge. On a miss, callers
+fall back to the DB and remember the answer.
+"""
+
+import asyncio
+from typing import Optional
+
+from cachetools import LRUCache
+
+from config import ORDER_ROUTES_REFRESH_SECONDS, ORDER_ROUTES_TOPIC_CACHE_SIZE
+from utils.logging_config import logger
+from utils.database.db_helpers import acquire
+from utils.database.db_queries import get_active_order_routes
+
+_by_user: dict[int, tuple[int, int]] = {}
+_by_topic: LRUCache = LRUCache(maxsize=ORDER_ROUTES_TOPIC_CACHE_SIZE)
+
+
+def load(rows) -> None:
+    """Заменяет активные маршруты строками (order_id, user_id, topic_id), отсортированными по order_id."""
+    global _by_user
+    by_user = {}
+    for r in rows:
+        by_user[r['user_id']] = (r['order_id'], r['topic_id'])
+        _by_topic[r['topic_id']] = (r['order_id'], r['user_id'])
+    _by_user = by_user
+
+
+def add(order_id: int, user_id: int, topic_id: int) -> None:
+    _by_user[user_id] = (order_id, topic_id)
+    _by_topic[topic_id] = (order_id, user_id)
+
+
+def remember_topic(topic_id: int, order_id: int, user_id: int) -> None:
+    _by_topic[topic_id] = (order_id, user_id)
+
+
+def close(order_id: int, user_id: int) -> None:
+    """Убирает маршрут пользователя, если он ведёт в эту заявку (статус ушёл из processing)."""
+    route = _by_user.get(user_id)
+    if route is not None and route[0] == order_id:
+        del _by_user[user_id]
+
+
+def topic_for_user(user_id: int) -> Optional[tuple[int, int]]:
+    """(order_id, topic_id) активной заявки пользователя или None, если маршрута нет."""
+    return _by_user.get(user_id)
+
+
+def order_for_topic(topic_id: int) -> Optional[tuple[int, int]]:
+    """(order_id, user_id) заявки, которой принадлежит тема, или None, если маршрута нет."""
+    return _by_topic.get(topic_id)
+
+
+async def refresh() -> None:
+    async with acquire() as conn:
+        rows = await get_active_order_routes(conn)
+    load(rows)
+
+
+async def run_refresh_loop() -> None:
+    while True:
+        await asyncio.sleep(ORDER_ROUTES_REFRESH_SECONDS)
+        try:
+            await refresh()
+        except Exception as e:
+            logger.error(f"Failed to refresh order routes: {e}", exc_info=True)
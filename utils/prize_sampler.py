@@ -0,0 +1,94 @@
+"""
+Розыгрыш призов лотереи методом алиасов (Vose).
+
+Таблица строится один раз при загрузке модуля (и заново через rebuild), после чего
+каждый розыгрыш стоит O(1): случайная колонка плюс одна проверка «своя/алиас».
+Веса переводятся в Fraction, поэтому таблица и вероятности точные, без ошибок
+округления float; проверка колонки тоже целочисленная (randrange по знаменателю).
+Источник случайности по умолчанию — random.SystemRandom (os.urandom).
+"""
+
+import random
+from fractions import Fraction
+from typing import Optional, Sequence, Tuple
+
+from config import LOTTERY_PRIZES
+
+Prize = Tuple[float, float]  # (сумма_выигрыша, вес_шанса)
+
+
+class PrizeSampler:
+    def __init__(self, prizes: Sequence[Prize], rng: Optional[random.Random] = None):
+        """
+        :param prizes: список (сумма_выигрыша, вес_шанса), как LOTTERY_PRIZES в config.
+        :param rng: источник случайности; по умолчанию криптостойкий random.SystemRandom.
+        """
+        if not prizes:
+            raise ValueError("Prize table is empty")
+        weights = [Fraction(str(weight)) for _, weight in prizes]
+        if any(w < 0 for w in weights):
+            raise ValueError("Prize weights must be non-negative")
+        total = sum(weights)
+        if total == 0:
+            raise ValueError("Prize weights sum to zero")
+
+        self._rng = rng or random.SystemRandom()
+        self._amounts = [amount for amount, _ in prizes]
+        self._probabilities = [w / total for w in weights]
+        self._build(len(prizes))
+
+    def _build(self, n: int) -> None:
+        # Каждая колонка i: с вероятностью prob[i] выпадает приз i, иначе alias[i].
+        scaled = [p * n for p in self._probabilities]
+        prob = [Fraction(1)] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            prob[less] = scaled[less]
+            alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+        # Арифметика точная, поэтому оставшиеся колонки заполнены ровно на 1.
+        self._columns = [(p.numerator, p.denominator, a) for p, a in zip(prob, alias)]
+
+    def draw(self) -> float:
+        """Разыгрывает один приз и возвращает сумму выигрыша."""
+        column = self._rng.randrange(len(self._columns))
+        numerator, denominator, alias = self._columns[column]
+        if numerator == denominator or self._rng.randrange(denominator) < numerator:
+            return self._amounts[column]
+        return self._amounts[alias]
+
+    @property
+    def probabilities(self) -> dict:
+        """Точная вероятность каждой суммы выигрыша: {сумма: Fraction}."""
+        result: dict = {}
+        for amount, p in zip(self._amounts, self._probabilities):
+            result[amount] = result.get(amount, 0) + p
+        return result
+
+    @property
+    def alias_table(self) -> list[tuple[Fraction, int]]:
+        """Таблица алиасов [(вероятность своей колонки, индекс алиаса)] — для проверок и отладки."""
+        return [(Fraction(num, den), alias) for num, den, alias in self._columns]
+
+
+_sampler = PrizeSampler(LOTTERY_PRIZES)
+
+
+def draw() -> float:
+    """Разыгрывает приз по текущей таблице призов."""
+    return _sampler.draw()
+
+
+def probabilities() -> dict:
+    return _sampler.probabilities
+
+
+def rebuild(prizes: Sequence[Prize], rng: Optional[random.Random] = None) -> None:
+    """Перестраивает таблицу призов. Новый сэмплер собирается целиком и подменяется
+    одним присваиванием, так что розыгрыш никогда не видит наполовину собранную таблицу."""
+    global _sampler
+    _sampler = PrizeSampler(prizes, rng)
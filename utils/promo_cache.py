@@ -0,0 +1,127 @@
+"""
+In-memory index of active promo codes and a guard against code guessing.
+
+The index (code -> (discount_amount, discount_type)) holds every active code with
+uses left; active codes whose uses ran out are kept aside, because a rejected,
+cancelled or auto-closed order releases its reserved use and puts the code back.
+The index is loaded at startup, updated on add_promo_code and on activations and
+releases in this process, and periodically reloaded so changes made by another
+replica converge.
+
+A code missing from the index may have just been created by another replica, so
+it is still checked in the DB; only codes the DB reported as nonexistent land in a
+bounded negative cache and are rejected without a query. Only such codes count as
+guessing attempts: per user, in a sliding window; over the limit the user is
+refused before any lookup.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+from cachetools import TTLCache
+
+from config import (
+    PROMO_INDEX_REFRESH_SECONDS, PROMO_INVALID_ATTEMPTS_LIMIT, PROMO_INVALID_ATTEMPTS_WINDOW_SECONDS,
+    PROMO_NEGATIVE_CACHE_SIZE, PROMO_NEGATIVE_CACHE_TTL_SECONDS,
+)
+from utils.logging_config import logger
+from utils.database.db_helpers import acquire
+from utils.database.db_queries import get_active_promo_codes
+
+_active: dict[str, tuple[float, str]] = {}
+# Активные коды без оставшихся использований — до возврата зарезервированного использования.
+_exhausted: dict[str, tuple[float, str]] = {}
+_unknown: TTLCache = TTLCache(maxsize=PROMO_NEGATIVE_CACHE_SIZE, ttl=PROMO_NEGATIVE_CACHE_TTL_SECONDS)
+# user_id -> время неудачных попыток; запись живёт не дольше окна.
+_attempts: TTLCache = TTLCache(maxsize=100_000, ttl=PROMO_INVALID_ATTEMPTS_WINDOW_SECONDS)
+
+
+def load(rows) -> None:
+    """Заменяет индекс строками (code, discount_amount_rub, discount_type, available)."""
+    global _active, _exhausted
+    active, exhausted = {}, {}
+    for r in rows:
+        (active if r['available'] else exhausted)[r['code']] = (float(r['discount_amount_rub']), r['discount_type'])
+    _active, _exhausted = active, exhausted
+    _unknown.clear()
+
+
+def add(code: str, discount_amount: float, discount_type: str) -> None:
+    code = code.upper()
+    _active[code] = (discount_amount, discount_type)
+    _exhausted.pop(code, None)
+    _unknown.pop(code, None)
+
+
+def discard(code: str) -> None:
+    """Убирает исчерпанный или выключенный код из индекса (он существует — restore вернёт его)."""
+    code = code.upper()
+    info = _active.pop(code, None)
+    if info is not None:
+        _exhausted[code] = info
+
+
+def restore(code: str) -> None:
+    """Возвращает в индекс код, которому вернули зарезервированное использование."""
+    code = code.upper()
+    info = _exhausted.pop(code, None)
+    if info is not None:
+        _active[code] = info
+
+
+def forget(code: str) -> None:
+    """Запоминает код, которого по данным БД не существует."""
+    code = code.upper()
+    _active.pop(code, None)
+    _exhausted.pop(code, None)
+    _unknown[code] = True
+
+
+def lookup(code: str) -> Optional[tuple[float, str]]:
+    """(сумма_скидки, тип_скидки) активного кода или None, если в индексе его нет."""
+    return _active.get(code.upper())
+
+
+def is_known_invalid(code: str) -> bool:
+    """True, если БД недавно сообщила, что такого кода нет."""
+    return code.upper() in _unknown
+
+
+def _recent_attempts(user_id: int) -> deque:
+    now = time.monotonic()
+    attempts = _attempts.get(user_id)
+    if attempts is None:
+        attempts = deque()
+    while attempts and now - attempts[0] > PROMO_INVALID_ATTEMPTS_WINDOW_SECONDS:
+        attempts.popleft()
+    return attempts
+
+
+def is_rate_limited(user_id: int) -> bool:
+    return len(_recent_attempts(user_id)) >= PROMO_INVALID_ATTEMPTS_LIMIT
+
+
+def register_invalid_attempt(user_id: int) -> None:
+    """Засчитывает попытку подбора — ввод несуществующего кода."""
+    attempts = _recent_attempts(user_id)
+    attempts.append(time.monotonic())
+    # Повторная запись продлевает TTL до конца окна последней попытки.
+    _attempts[user_id] = attempts
+
+
+async def refresh() -> None:
+    async with acquire() as conn:
+        rows = await get_active_promo_codes(conn)
+    load(rows)
+
+
+async def run_refresh_loop() -> None:
+    """Периодически перечитывает индекс (коды могли создать или исчерпать другие реплики)."""
+    while True:
+        await asyncio.sleep(PROMO_INDEX_REFRESH_SECONDS)
+        try:
+            await refresh()
+        except Exception as e:
+            logger.error(f"Failed to refresh promo code index: {e}", exc_info=True)
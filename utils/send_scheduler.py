@@ -0,0 +1,113 @@
+"""
+Планировщик исходящих сообщений чата-прокси.
+
+У каждого получателя (чат, при необходимости — тема) своя FIFO-очередь: сообщения
+одного разговора уходят строго по порядку, а разные разговоры отправляются
+параллельно, но не больше SEND_CONCURRENCY запросов одновременно на процесс.
+
+Частоту запросов по чатам и повтор после 429 обеспечивает общий лимитер сессии бота
+(middlewares/request_limiter.py), поэтому здесь их нет.
+
+Хендлер ставит отправку в очередь через submit() и сразу завершается; ошибка
+доставки передаётся в on_error, который выполняется в той же очереди.
+"""
+
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from config import SEND_CONCURRENCY
+from utils.logging_config import logger
+
+SendFactory = Callable[[], Awaitable[Any]]
+ErrorHandler = Callable[[Exception], Awaitable[None]]
+
+
+@dataclass
+class _Send:
+    chat_id: int
+    send: SendFactory
+    on_error: Optional[ErrorHandler]
+    result: asyncio.Future
+
+
+class SendScheduler:
+    def __init__(self, concurrency: int):
+        """
+        :param concurrency: сколько запросов к Telegram выполняется одновременно.
+        """
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lanes: dict[Hashable, deque[_Send]] = {}
+        self._workers: dict[Hashable, asyncio.Task] = {}
+
+    def submit(self, chat_id: int, send: SendFactory, on_error: Optional[ErrorHandler] = None,
+               thread_id: Optional[int] = None) -> asyncio.Future:
+        """Ставит отправку в очередь получателя (chat_id, thread_id).
+
+        send — фабрика корутины, вызывается, когда подходит очередь.
+        Возвращает future с результатом send(); ждать его не обязательно.
+        """
+        lane = (chat_id, thread_id)
+        item = _Send(chat_id, send, on_error, asyncio.get_running_loop().create_future())
+        self._lanes.setdefault(lane, deque()).append(item)
+        if lane not in self._workers:
+            self._workers[lane] = asyncio.create_task(self._run_lane(lane))
+        return item.result
+
+    def stats(self) -> dict:
+        return {
+            'lanes': len(self._workers),
+            'queued': sum(len(q) for q in self._lanes.values()),
+        }
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """Даёт очередям дослаться (не дольше timeout), остальное отменяет."""
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        _, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _run_lane(self, lane: Hashable) -> None:
+        queue = self._lanes[lane]
+        try:
+            while queue:
+                item = queue[0]
+                try:
+                    result = await self._deliver(item)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if not item.result.done():
+                        item.result.set_exception(e)
+                        item.result.exception()  # ошибка уже обработана, не логировать как «не извлечённую»
+                    await self._report(item, e)
+                else:
+                    if not item.result.done():
+                        item.result.set_result(result)
+                queue.popleft()
+        finally:
+            for item in queue:
+                item.result.cancel()
+            del self._lanes[lane]
+            del self._workers[lane]
+
+    async def _deliver(self, item: _Send) -> Any:
+        async with self._semaphore:
+            return await item.send()
+
+    @staticmethod
+    async def _report(item: _Send, error: Exception) -> None:
+        if item.on_error is None:
+            logger.error(f"Failed to send to chat {item.chat_id}: {error}")
+            return
+        try:
+            await item.on_error(error)
+        except Exception as e:
+            logger.error(f"Error handler for chat {item.chat_id} failed: {e}", exc_info=True)
+
+
+scheduler = SendScheduler(concurrency=SEND_CONCURRENCY)
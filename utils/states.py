@@ -28,6 +28,8 @@ class ReferralStates(StatesGroup):
 class AdminPromoStates(StatesGroup):
     waiting_for_promo_data = State()
     waiting_for_discount_type = State()
+    waiting_for_bulk_data = State()
+    waiting_for_bulk_discount_type = State()
 
 class ManageAdminStates(StatesGroup):
     waiting_for_user_id = State()
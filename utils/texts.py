@@ -36,7 +36,7 @@ def get_lottery_menu_text(lottery_info: dict, can_get_ticket: bool) -> str:
     if can_get_ticket:
         ticket_text = "✨ У вас есть <b>1</b> бесплатная игра! Готовы испытать удачу?"
     else:
-        next_ticket_time = lottery_info.get('last_ticket') + timedelta(hours=24)
+        next_ticket_time = lottery_info.get('last_play') + timedelta(hours=24)
         time_left = next_ticket_time - datetime.now()
         formatted_time = format_timedelta(time_left)
         ticket_text = f"⏳ Следующая бесплатная игра будет доступна через: <b>{formatted_time}</b>"
@@ -123,6 +123,54 @@ def get_referral_earnings_text(earnings: list, balance: float) -> str:
     return header + "\n".join(lines)
 
 
+_MONTHS_RU = (
+    "январь", "февраль", "март", "апрель", "май", "июнь",
+    "июль", "август", "сентябрь", "октябрь", "ноябрь", "декабрь",
+)
+
+
+def _mask_name(name: str) -> str:
+    """Публичный лидерборд показывает только начало имени."""
+    name = (name or "").lstrip("@")
+    if not name or name == "Нет username":
+        return "Пользователь"
+    return html.escape(name[:3]) + "***"
+
+
+def get_leaderboard_text(period, top: List[Tuple[int, float]], names: dict,
+                         user_id: int, own_rank=None) -> str:
+    lines = [f"🏆 <b>Топ рефереров — {_MONTHS_RU[period.month - 1]} {period.year}</b>\n"]
+    if not top:
+        lines.append("В этом месяце начислений ещё не было. Станьте первым!")
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    for place, (referrer_id, total) in enumerate(top, start=1):
+        user = names.get(referrer_id)
+        name = _mask_name(user['username'] if user else "")
+        you = " ← вы" if referrer_id == user_id else ""
+        lines.append(f"{medals.get(place, f'{place}.')} {name} — <b>{total:,.2f} RUB</b>{you}")
+    if own_rank:
+        lines.append(f"\nВаше место: <b>{own_rank['rank']}</b> ({own_rank['total_earned']:,.2f} RUB)")
+    elif all(referrer_id != user_id for referrer_id, _ in top):
+        lines.append("\nВы пока не в рейтинге этого месяца.")
+    return "\n".join(lines)
+
+
+def get_admin_leaderboard_text(period, rows: list, page: int, total: int, per_page: int) -> str:
+    total_pages = max(1, (total + per_page - 1) // per_page)
+    lines = [
+        f"🏆 <b>Лидерборд рефереров — {_MONTHS_RU[period.month - 1]} {period.year}</b> "
+        f"(стр. {page + 1}/{total_pages})\n"
+    ]
+    if not rows:
+        lines.append("Нет данных.")
+    for r in rows:
+        name = html.escape(r['username'] or r['full_name'] or "—")
+        lines.append(
+            f"{r['rank']}. {name} (<code>{r['referrer_id']}</code>) — <b>{r['total_earned']:,.2f} RUB</b>"
+        )
+    return "\n".join(lines)
+
+
 # --- Торговый flow ---
 
 def get_crypto_prompt_text(action: str, crypto: str, rate: float) -> str:
@@ -338,3 +386,47 @@ def get_statistics_text(stats: dict) -> str:
         "<b>Активность в лотерее:</b>\n"
         f"  — Сыграно в 🎰 за 24 часа: <i>{stats.get('lottery_day', 0)}</i>"
     )
+
+
+def get_pool_stats_text(pool: dict, top_sites: int = 5, title: str = "🗄 Пул соединений БД") -> str:
+    lines = [
+        f"\n\n<b>{title}:</b>",
+        f"  — Занято/лимит: <i>{pool['in_use']}/{pool['limit']}</i> "
+        f"(открыто {pool['size']}, свободно {pool['idle']}, в очереди {pool['waiting']})",
+        f"  — Ожидание: <i>ср. {pool['wait_avg_ms']:.1f} мс, макс. {pool['wait_max_ms']:.1f} мс</i> "
+        f"за {pool['acquisitions']} выдач",
+    ]
+    if pool['holds']:
+        lines.append("  — Дольше всего держат (суммарно):")
+        for h in pool['holds'][:top_sites]:
+            lines.append(
+                f"    <code>{html.escape(h['site'])}</code>: {h['count']}× "
+                f"ср. {h['avg_ms']:.1f} мс, макс. {h['max_ms']:.1f} мс"
+            )
+    return "\n".join(lines)
+
+
+def get_telegram_limiter_stats_text(stats: dict) -> str:
+    names = {'dialog': 'диалоги', 'notification': 'уведомления', 'broadcast': 'рассылки'}
+    queued = ", ".join(
+        f"{label} {stats['waiting_chats'][key]}/{stats['waiting_global'][key]}" for key, label in names.items()
+    )
+    return "\n".join([
+        "\n\n<b>📨 Запросы к Telegram API:</b>",
+        f"  — В очереди (чат/общая): <i>{queued}</i>",
+        f"  — Запросов: <i>{stats['requests']}</i>, повторов после 429: <i>{stats['retried']}</i>, "
+        f"не доставлено: <i>{stats['failed']}</i> (активных чатов {stats['chats']})",
+    ])
+
+
+def get_statements_stats_text(statements: list[dict], top: int = 5) -> str:
+    lines = ["\n\n<b>⚡️ Горячие запросы (суммарное время):</b>"]
+    for s in statements[:top]:
+        if not s['calls']:
+            continue
+        errors = f", ошибок {s['errors']}" if s['errors'] else ""
+        lines.append(
+            f"  <code>{html.escape(s['name'])}</code>: {s['calls']}× "
+            f"ср. {s['avg_ms']:.2f} мс, макс. {s['max_ms']:.1f} мс{errors}"
+        )
+    return "\n".join(lines) if len(lines) > 1 else ""